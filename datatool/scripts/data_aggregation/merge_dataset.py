@@ -41,6 +41,7 @@
 
 import os
 import sys
+import stat
 import uuid
 import shutil
 import yaml
@@ -49,14 +50,22 @@ from pathlib import Path
 from glob import glob
 from tqdm import tqdm
 
+import mmap
 import hashlib
 from collections import defaultdict
+from typing import NamedTuple
 from concurrent.futures import ThreadPoolExecutor
 import threading
 
 from datatool.utils.parallel import post_allocated_multiprocess, post_allocated_multithread
 from datatool.logger import log
 
+# 优先使用 libyaml 的 C 实现，未编译 libyaml 时回退到纯 Python 版本
+try:
+    from yaml import CSafeLoader as YamlLoader, CSafeDumper as YamlDumper
+except ImportError:
+    from yaml import SafeLoader as YamlLoader, SafeDumper as YamlDumper
+
 
 def simple_copy_dataset(src_dataset, dst_dataset, dataset_name):
     """将 src_dataset 合并到 dst_dataset 中（只处理MetaFiles和MediaFiles）"""
@@ -94,6 +103,25 @@ def simple_copy_dataset(src_dataset, dst_dataset, dataset_name):
         log(f"📋 源MediaFiles目录不存在: {src_mediadir}")
 
 
+def _drop_page_cache(file_path):
+    """源文件用完（已复制，或哈希后确认为重复不再复制）后通知内核丢弃其页缓存，避免大批量媒体文件挤占热数据（如 jsonl）
+
+    哈希与复制之间不能丢弃：唯一文件紧接着就要复制，丢弃后复制时需要重新从磁盘读取
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        fd = os.open(file_path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
 def get_file_hash_fast(file_path):
     """快速获取文件哈希值，优化版本
     - 首先比较文件大小进行初步去重
@@ -108,12 +136,13 @@ def get_file_hash_fast(file_path):
         if file_size == 0:
             return "empty_file"
         
-        # 小文件（<10MB）计算完整MD5
+        # 小文件（<10MB）计算完整MD5：mmap 整个文件，一次性交给 hashlib（C 层处理并释放 GIL）
         if file_size < 10 * 1024 * 1024:
             hash_md5 = hashlib.md5()
-            with open(file_path, "rb") as f:
-                for chunk in iter(lambda: f.read(8192), b""):
-                    hash_md5.update(chunk)
+            with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if hasattr(mm, "madvise"):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                hash_md5.update(mm)
             return hash_md5.hexdigest()
         
         # 大文件只计算头部、中间、尾部的哈希
@@ -155,7 +184,7 @@ def compute_hash_for_file_thread(file_info, **kwargs):
     thread_id = kwargs.get('thread_id', 'unknown')
     
     try:
-        src_path = file_info["src_path"]
+        src_path = file_info.src_path
         file_hash = get_file_hash(src_path)
         
         return {
@@ -168,50 +197,69 @@ def compute_hash_for_file_thread(file_info, **kwargs):
     except Exception as e:
         return {
             "status": "error",
-            "src_path": file_info.get("src_path", "unknown"),
+            "src_path": getattr(file_info, "src_path", "unknown"),
             "error": str(e),
             "worker_id": thread_id
         }
 
 
+# 重写jsonl时单次写入的字节块上限
+JSONL_WRITE_BUFFER_SIZE = 16 * 1024 * 1024
+
+# 多进程哈希时每个任务包含的文件数，减少逐文件的 pickle/管道开销
+HASH_BATCH_SIZE = 256
+
+
 @post_allocated_multiprocess
-def compute_hash_for_file_process(file_info, **kwargs):
-    """并发计算单个文件的哈希值（进程安全）"""
-    process_id = kwargs.get('process_id', 'unknown')
-    
-    try:
-        src_path = file_info["src_path"]
-        file_hash = get_file_hash(src_path)
-        
-        return {
-            "status": "success",
-            "src_path": src_path,
-            "file_hash": file_hash,
-            "media_file": file_info,
-            "worker_id": process_id
-        }
-    except Exception as e:
-        return {
-            "status": "error",
-            "src_path": file_info.get("src_path", "unknown"),
-            "error": str(e),
-            "worker_id": process_id
-        }
+def compute_hash_for_file_process(batch, **kwargs):
+    """并发计算一批文件的哈希值（进程安全）
+
+    Args:
+        batch (tuple): (batch_start, src_paths)，batch_start 为该批在任务列表中的起始下标
+
+    Returns:
+        tuple: (batch_start, statuses, hashes, errors)，三个与 src_paths 等长的平行元组
+    """
+    batch_start, src_paths = batch
+    statuses, hashes, errors = [], [], []
+    for src_path in src_paths:
+        try:
+            hashes.append(get_file_hash(src_path) or "")
+            statuses.append("success")
+            errors.append("")
+        except Exception as e:
+            hashes.append("")
+            statuses.append("error")
+            errors.append(str(e))
+    return batch_start, tuple(statuses), tuple(hashes), tuple(errors)
+
+
+class MediaFile(NamedTuple):
+    """单个媒体文件记录（比 dict 更省内存，适合千万级文件）"""
+    src_path: str
+    media_type: str
+    suffix: str
+    from_jsonl: str
+    file_size: int = 0
 
 
 def collect_media_files_from_jsonl(metafiles_dir):
-    """从MetaFiles目录的jsonl文件中收集所有媒体文件路径"""
+    """从MetaFiles目录的jsonl文件中收集所有媒体文件路径
+
+    以生成器形式逐条产出 MediaFile，避免一次性构建完整列表；每个路径只 stat 一次，
+    文件大小随记录一起产出，供后续按大小分组时直接使用
+    """
     metafiles_dir = Path(metafiles_dir)
-    media_files = []
     
     if not metafiles_dir.exists():
         log(f"⚠️ MetaFiles目录不存在: {metafiles_dir}")
-        return media_files
+        return
     
     # 查找所有jsonl文件
     jsonl_files = list(metafiles_dir.glob("*.jsonl"))
     
     for jsonl_file in jsonl_files:
+        jsonl_file_str = str(jsonl_file)
         try:
             with open(jsonl_file, 'r', encoding='utf-8') as f:
                 for line_idx, line in enumerate(f):
@@ -226,13 +274,17 @@ def collect_media_files_from_jsonl(metafiles_dir):
                             media_paths = item.get(media_type, [])
                             if isinstance(media_paths, list):
                                 for media_path in media_paths:
-                                    if media_path and Path(media_path).exists():
-                                        media_files.append({
-                                            "src_path": str(Path(media_path)),
-                                            "media_type": media_type,
-                                            "suffix": Path(media_path).suffix,
-                                            "from_jsonl": str(jsonl_file)
-                                        })
+                                    # 热循环中用 os.path 代替多次构造 Path；仅保留一次 Path 规范化作为映射键
+                                    if not media_path:
+                                        continue
+                                    try:
+                                        st = os.stat(media_path)
+                                    except OSError:
+                                        # 与 os.path.isfile 一致：不存在或无法访问的路径直接跳过
+                                        continue
+                                    if not stat.S_ISREG(st.st_mode):
+                                        continue
+                                    yield MediaFile(str(Path(media_path)), media_type, os.path.splitext(media_path)[1], jsonl_file_str, st.st_size)
                                         
                     except json.JSONDecodeError as e:
                         log(f"⚠️ JSON解析错误 {jsonl_file}:{line_idx}: {e}")
@@ -241,38 +293,29 @@ def collect_media_files_from_jsonl(metafiles_dir):
         except Exception as e:
             log(f"⚠️ 读取jsonl文件失败 {jsonl_file}: {e}")
             continue
-    
-    return media_files
 
 
 def copy_media_files_with_dedup(media_files, dst_mediadir, dataset_name, hash_threads=4, use_process=False):
-    """复制媒体文件并去重（优化版：两阶段去重 + 并发哈希）"""
+    """复制媒体文件并去重（优化版：两阶段去重 + 并发哈希）
+
+    media_files 可以是 collect_media_files_from_jsonl 产出的生成器，收集与 stat 在同一遍完成，
+    这里直接使用其中的 file_size，不再 stat
+    """
     dst_mediadir = Path(dst_mediadir)
-    dst_mediadir.mkdir(parents=True, exist_ok=True)
     
     # 去重处理 - 优化版本
     unique_files = {}  # {file_hash: file_info}
     media_counters = defaultdict(int)  # {media_type: count}
     copied_files = []
     path_mapping = {}  # {src_path: dst_path} - 路径映射表
-    size_groups = defaultdict(list)  # {file_size: [media_files]} - 按文件大小分组
+    size_groups = defaultdict(list)  # {file_size: [MediaFile]} - 按文件大小分组
+    total_media_files = 0
     
     log(f"🔍 {dataset_name}: 第一阶段 - 按文件大小分组...")
     # 第一阶段：按文件大小分组，快速过滤
     for media_file in tqdm(media_files, desc=f"分组{dataset_name}媒体文件"):
-        src_path = Path(media_file["src_path"])
-        
-        if not src_path.exists():
-            log(f"⚠️ 文件不存在，跳过: {src_path}")
-            continue
-        
-        try:
-            file_size = src_path.stat().st_size
-            media_file["file_size"] = file_size
-            size_groups[file_size].append(media_file)
-        except Exception as e:
-            log(f"⚠️ 获取文件大小失败 {src_path}: {e}")
-            continue
+        total_media_files += 1
+        size_groups[media_file.file_size].append(media_file)
     
     log(f"📊 {dataset_name}: 大小分组统计 - {len(size_groups)} 个不同大小的组")
     
@@ -282,12 +325,12 @@ def copy_media_files_with_dedup(media_files, dst_mediadir, dataset_name, hash_th
         if len(media_files_group) == 1:
             # 该大小只有一个文件，无需计算哈希，直接处理
             media_file = media_files_group[0]
-            src_path = Path(media_file["src_path"])
+            src_path = Path(media_file.src_path)
             
-            media_type = media_file["media_type"]
+            media_type = media_file.media_type
             media_counters[media_type] += 1
             idx = media_counters[media_type]
-            suffix = media_file["suffix"]
+            suffix = media_file.suffix
             
             # 生成新的文件名和路径
             new_filename = f"{idx}{suffix}"
@@ -317,6 +360,7 @@ def copy_media_files_with_dedup(media_files, dst_mediadir, dataset_name, hash_th
                 
                 # 记录路径映射（绝对路径）
                 path_mapping[str(src_path)] = str(dst_path)
+                _drop_page_cache(src_path)
                 
             except Exception as e:
                 log(f"⚠️ 复制文件失败 {src_path} -> {dst_path}: {e}")
@@ -337,7 +381,7 @@ def copy_media_files_with_dedup(media_files, dst_mediadir, dataset_name, hash_th
             )
     
     log(f"📊 {dataset_name} 媒体文件处理统计:")
-    log(f"   原始文件数: {len(media_files)}")
+    log(f"   原始文件数: {total_media_files}")
     log(f"   去重后文件数: {len(unique_files)}")
     log(f"   实际复制文件数: {len(copied_files)}")
     for media_type, count in media_counters.items():
@@ -349,12 +393,8 @@ def copy_media_files_with_dedup(media_files, dst_mediadir, dataset_name, hash_th
 def process_hash_group_concurrent_merge(media_files_group, media_counters, unique_files, path_mapping, copied_files, dst_mediadir, dataset_name, max_workers=4, use_process=False):
     """并发处理需要计算哈希的文件组（merge专用）"""
     
-    # 准备哈希计算任务
-    hash_tasks = []
-    for media_file in media_files_group:
-        src_path = Path(media_file["src_path"])
-        if src_path.exists():
-            hash_tasks.append(media_file)
+    # 准备哈希计算任务（收集时已确认是存在的普通文件，不再逐个检查；之后消失的文件在哈希时报错跳过）
+    hash_tasks = list(media_files_group)
     
     if not hash_tasks:
         return
@@ -362,36 +402,49 @@ def process_hash_group_concurrent_merge(media_files_group, media_counters, uniqu
     worker_type = "进程" if use_process else "线程"
     log(f"🔧 {dataset_name}: 并发计算 {len(hash_tasks)} 个文件的哈希值 (使用 {min(max_workers, len(hash_tasks))} 个{worker_type})...")
     
-    # 选择并发计算方式
+    # 选择并发计算方式，统一得到 [(file_hash, media_file)]
     if use_process:
-        # CPU密集型：使用多进程
-        hash_results = compute_hash_for_file_process(
-            hash_tasks,
-            num_workers=min(max_workers, len(hash_tasks))
-        )
+        # CPU密集型：使用多进程，按批次分发路径，结果以平行元组返回
+        batches = [
+            (start, [media_file.src_path for media_file in hash_tasks[start:start + HASH_BATCH_SIZE]])
+            for start in range(0, len(hash_tasks), HASH_BATCH_SIZE)
+        ]
+        hashes_by_idx = [None] * len(hash_tasks)
+        for batch_start, statuses, hashes, errors in compute_hash_for_file_process(
+            batches,
+            num_workers=min(max_workers, len(batches))
+        ):
+            for offset, (status, file_hash, error) in enumerate(zip(statuses, hashes, errors)):
+                if status != "success":
+                    log(f"⚠️ 计算文件哈希失败 {hash_tasks[batch_start + offset].src_path}: {error}")
+                    continue
+                hashes_by_idx[batch_start + offset] = file_hash
+        hash_results = list(zip(hashes_by_idx, hash_tasks))
     else:
         # I/O密集型：使用多线程
-        hash_results = compute_hash_for_file_thread(
-            hash_tasks,
-            num_workers=min(max_workers, len(hash_tasks))
-        )
+        hash_results = [
+            (result["file_hash"], result["media_file"])
+            for result in compute_hash_for_file_thread(
+                hash_tasks,
+                num_workers=min(max_workers, len(hash_tasks))
+            )
+            if result["status"] == "success"
+        ]
     
     # 处理哈希结果，进行去重和复制
     group_hash_map = {}
-    for result in hash_results:
-        if result["status"] != "success" or not result["file_hash"]:
+    for file_hash, media_file in hash_results:
+        if not file_hash:
             continue
         
-        file_hash = result["file_hash"]
-        media_file = result["media_file"]
-        src_path = Path(media_file["src_path"])
+        src_path = Path(media_file.src_path)
         
         if file_hash not in group_hash_map:
             # 新的唯一文件
-            media_type = media_file["media_type"]
+            media_type = media_file.media_type
             media_counters[media_type] += 1
             idx = media_counters[media_type]
-            suffix = media_file["suffix"]
+            suffix = media_file.suffix
             
             # 生成新的文件名和路径
             new_filename = f"{idx}{suffix}"
@@ -421,6 +474,7 @@ def process_hash_group_concurrent_merge(media_files_group, media_counters, uniqu
                 
                 # 记录路径映射（绝对路径）
                 path_mapping[str(src_path)] = str(dst_path)
+                _drop_page_cache(src_path)
                 
             except Exception as e:
                 log(f"⚠️ 复制文件失败 {src_path} -> {dst_path}: {e}")
@@ -429,6 +483,7 @@ def process_hash_group_concurrent_merge(media_files_group, media_counters, uniqu
             # 重复文件，使用已有的路径映射
             existing_info = group_hash_map[file_hash]
             path_mapping[str(src_path)] = existing_info["dst_path"]
+            _drop_page_cache(src_path)
 
 
 def update_jsonl_paths(src_metadir, dst_metadir, path_mapping, dataset_name):
@@ -477,10 +532,20 @@ def update_jsonl_paths(src_metadir, dst_metadir, path_mapping, dataset_name):
                         log(f"⚠️ JSON解析错误 {jsonl_file}:{line_idx}: {e}")
                         continue
             
-            # 重写更新后的jsonl文件
-            with open(jsonl_file, 'w', encoding='utf-8') as f:
+            # 重写更新后的jsonl文件：先在内存中拼接成字节块，按 16MB 分块批量写入
+            with open(jsonl_file, 'wb') as f:
+                buf = []
+                buf_size = 0
                 for item in updated_items:
-                    f.write(json.dumps(item, ensure_ascii=False) + '\n')
+                    line = (json.dumps(item, ensure_ascii=False) + '\n').encode('utf-8')
+                    buf.append(line)
+                    buf_size += len(line)
+                    if buf_size >= JSONL_WRITE_BUFFER_SIZE:
+                        f.write(b''.join(buf))
+                        buf = []
+                        buf_size = 0
+                if buf:
+                    f.write(b''.join(buf))
             
             log(f"✅ 更新JSONL文件: {jsonl_file.name} ({len(updated_items)} 个数据项)")
             
@@ -514,14 +579,11 @@ def process_media_files(src_metadir, dst_dir, dataset_name, copy_media_files=Tru
         # 从jsonl文件中收集媒体文件
         log(f"🔍 MediaFiles目录不存在，从jsonl收集媒体文件: {dataset_name}")
         media_files = collect_media_files_from_jsonl(src_metadir)
-        
-        if media_files:
-            dst_mediadir = dst_dir / "MediaFiles"
-            copied_files, path_mapping = copy_media_files_with_dedup(media_files, dst_mediadir, dataset_name, hash_threads, use_process)
-            return copied_files, path_mapping
-        else:
+        dst_mediadir = dst_dir / "MediaFiles"
+        copied_files, path_mapping = copy_media_files_with_dedup(media_files, dst_mediadir, dataset_name, hash_threads, use_process)
+        if not path_mapping:
             log(f"📋 未找到媒体文件: {dataset_name}")
-            return [], {}
+        return copied_files, path_mapping
 
 
 @post_allocated_multiprocess
@@ -624,7 +686,7 @@ def update_target_yaml(dst_yaml_path, results, dst_root_dir):
     
     # 保存新配置
     with open(dst_yaml_path, 'w', encoding='utf-8') as f:
-        yaml.dump(new_config, f, default_flow_style=False, allow_unicode=True)
+        yaml.dump(new_config, f, Dumper=YamlDumper, default_flow_style=False, allow_unicode=True)
     
     log(f"📋 更新配置文件: {dst_yaml_path}")
     log(f"📊 总数据集数: {len(new_config['Datasets'])}")
@@ -647,13 +709,13 @@ def merge_datasets(src_yaml_path, dst_root_dir, dst_yaml_path=None, copy_media_f
     
     # 加载源配置
     with open(src_yaml_path, 'r', encoding='utf-8') as f:
-        src_config = yaml.safe_load(f)
+        src_config = yaml.load(f, Loader=YamlLoader)
     
     # 加载目标配置（如果存在）
     dst_config = {}
     if dst_yaml_path and Path(dst_yaml_path).exists():
         with open(dst_yaml_path, 'r', encoding='utf-8') as f:
-            dst_config = yaml.safe_load(f)
+            dst_config = yaml.load(f, Loader=YamlLoader)
         log(f"📋 加载现有目标配置: {dst_yaml_path}")
     
     # 准备处理任务
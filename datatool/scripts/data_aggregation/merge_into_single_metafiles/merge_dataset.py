@@ -13,7 +13,6 @@ from glob import glob
 from tqdm import tqdm
 from copy import deepcopy
 from omegaconf import OmegaConf
-from filelock import FileLock
 
 from datatool.config import gconfig
 from datatool.utils.parallel import pre_allocated_multiprocess
@@ -40,14 +39,49 @@ def extract_data_iter(all_files, jsonl_size=10000):
     if batch:
         yield batch
 
+# 各进程分片文件所在的临时子目录：隐藏目录且不以 .jsonl 结尾，不会被下游的 **/*.jsonl 当作元数据读取
+PART_DIR_NAME = ".merge_parts"
+
+
+def get_part_path(meta_save_dir, merged_filename, process_id):
+    # merged.jsonl -> .merge_parts/merged.jsonl.part0000
+    return os.path.join(meta_save_dir, PART_DIR_NAME, f"{merged_filename}.part{process_id:04d}")
+
+
+def reset_part_dir(meta_save_dir):
+    """清空分片目录，丢弃异常退出或 num_workers 不同的上次运行遗留的分片"""
+    part_dir = os.path.join(meta_save_dir, PART_DIR_NAME)
+    shutil.rmtree(part_dir, ignore_errors=True)
+    os.makedirs(part_dir)
+
+
+def concat_part_files(meta_save_dir, merged_filename, num_workers):
+    """将各进程写出的分片文件按进程号顺序拼接到合并文件中，并删除分片目录"""
+    save_path = os.path.join(meta_save_dir, merged_filename)
+    part_paths = [get_part_path(meta_save_dir, merged_filename, pid) for pid in range(num_workers)]
+    # sendfile 不支持以 O_APPEND 打开的目标文件：以普通写模式打开（不截断）后定位到末尾追加
+    with open(os.open(save_path, os.O_WRONLY | os.O_CREAT, 0o644), "wb") as out:
+        out.seek(0, os.SEEK_END)
+        for part_path in part_paths:
+            if not os.path.exists(part_path):
+                continue
+            with open(part_path, "rb") as src:
+                offset = 0
+                while True:
+                    sent = os.sendfile(out.fileno(), src.fileno(), offset, 1 << 20)
+                    if sent == 0:
+                        break
+                    offset += sent
+    shutil.rmtree(os.path.join(meta_save_dir, PART_DIR_NAME), ignore_errors=True)
+
+
 @pre_allocated_multiprocess
-def process(all_files, meta_save_dir=None, chunk_size=None, process_id=0, lock_path=None, merged_filename="merged.jsonl"):
+def process(all_files, meta_save_dir=None, chunk_size=None, process_id=0, merged_filename="merged.jsonl"):
     if not chunk_size or chunk_size <= 0:
-        save_path = os.path.join(meta_save_dir, merged_filename)
-        lock_path = save_path + ".lock"
+        # 每个进程写自己的分片文件，无需跨进程加锁，结束后由主进程统一拼接
+        save_path = get_part_path(meta_save_dir, merged_filename, process_id)
         for batch in extract_data_iter(all_files, jsonl_size=10000):
-            with FileLock(lock_path):
-                save_jsonlines(batch, save_path, mode="a")
+            save_jsonlines(batch, save_path, mode="a")
     else:
         for idx, batch in enumerate(extract_data_iter(all_files, jsonl_size=chunk_size)):
             save_path = os.path.join(meta_save_dir, f"meta_{process_id:06d}_{idx:06d}.jsonl")
@@ -85,8 +119,11 @@ if __name__ == "__main__":
         all_files = []
         for meta_dir in meta_dirs:
             all_files.extend(glob(os.path.join(meta_dir, "**", "*.jsonl"), recursive=True))
-        lock_path = os.path.join(meta_save_dir, args.merged_filename + ".lock")
-        process(all_files, num_workers=args.num_workers, meta_save_dir=meta_save_dir, chunk_size=args.chunk_size, lock_path=lock_path, merged_filename=args.merged_filename)
+        if not args.chunk_size or args.chunk_size <= 0:
+            reset_part_dir(meta_save_dir)
+        process(all_files, num_workers=args.num_workers, meta_save_dir=meta_save_dir, chunk_size=args.chunk_size, merged_filename=args.merged_filename)
+        if not args.chunk_size or args.chunk_size <= 0:
+            concat_part_files(meta_save_dir, args.merged_filename, args.num_workers)
         updated_configs[dataset] = {"MetaFiles": meta_save_dir}
 
     new_dataset_config = {
@@ -96,10 +133,3 @@ if __name__ == "__main__":
     with open(args.dst_dataset_yaml, "w") as f:
         OmegaConf.save(new_dataset_config, f)
     log(f"保存新数据集配置到 {args.dst_dataset_yaml}")
-
-    # 全部数据集处理完后，统一删除 lock 文件
-    for dataset, config in dataset_config["Datasets"].items():
-        meta_save_dir = os.path.join(args.save_dir, dataset, "MetaFiles")
-        lock_file = os.path.join(meta_save_dir, args.merged_filename + ".lock")
-        if os.path.exists(lock_file):
-            os.remove(lock_file)
\ No newline at end of file
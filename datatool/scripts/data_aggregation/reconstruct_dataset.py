@@ -46,26 +46,172 @@
 import os
 import sys
 import uuid
+import atexit
+import functools
 import shutil
 import yaml
 import json
+import mmap
+import pickle
+import sqlite3
 import hashlib
+import tempfile
 from pathlib import Path
 from glob import glob
 from tqdm import tqdm
 from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import threading
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 from datatool.utils.parallel import post_allocated_multiprocess, post_allocated_multithread
+from datatool.utils.hash_cache import HashCache
+from datatool.utils.samples import count_lines, iter_jsonl_files
 from datatool.logger import log
 
+# 去重只需要内容指纹，优先使用 BLAKE3（SIMD + 多线程），未安装时回退到 MD5
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+# xxh3 用于计算文件头部的快速指纹（前缀预筛）；未安装时回退到 8 字节 BLAKE2b
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# msgpack 用于 jsonl 处理进程与主进程之间的结果交换；未安装时回退到 pickle
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# orjson 直接在 bytes 上解析/序列化，比标准库 json 快数倍；未安装时回退到 json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _new_hasher():
+    """创建内容指纹哈希器：BLAKE3 优先，否则 MD5"""
+    if blake3 is not None:
+        return blake3.blake3()
+    return hashlib.md5()
+
+
+def json_loads(line):
+    """解析一行 jsonl（str 或 bytes）"""
+    if orjson is not None:
+        return orjson.loads(line)
+    return json.loads(line)
+
+
+def json_dumps_line(item):
+    """将数据项序列化为以换行结尾的 UTF-8 字节串"""
+    if orjson is not None:
+        return orjson.dumps(item, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(item, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+def json_dumps_str(value):
+    """将字符串序列化为 JSON 字符串字面量（含引号）的 UTF-8 字节串"""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False).encode('utf-8')
+
+
+# 写出 jsonl 时内存缓冲区的刷新阈值
+JSONL_WRITE_BUFFER_SIZE = 8 << 20
+
+
+def write_jsonl(jsonl_path, lines):
+    """将以换行结尾的行字节串写入 jsonl：累积到 bytearray 中按 8MB 成块写出，结束时 fsync 一次"""
+    with open(jsonl_path, 'wb', buffering=0) as f:
+        out = bytearray()
+        for line in lines:
+            out += line
+            if len(out) > JSONL_WRITE_BUFFER_SIZE:
+                f.write(out)
+                out.clear()
+        f.write(out)
+        os.fsync(f.fileno())
+
+
+# Linux ioctl FICLONE：在支持写时复制的文件系统（Btrfs/XFS 等）上创建 reflink
+FICLONE = 0x40049409
+
+
+def fast_copy(src_path, dst_path, copy_mode="reflink"):
+    """复制单个媒体文件，尽量避免数据经过用户态
+
+    - hardlink: 先尝试 os.link，失败后按 reflink 处理
+    - reflink: 依次尝试 FICLONE、os.copy_file_range，最后回退到 shutil.copy2
+    - copy: 直接使用 shutil.copy2
+    """
+    if copy_mode == "hardlink":
+        try:
+            os.link(src_path, dst_path)
+            return
+        except OSError:
+            pass
+    
+    if copy_mode in ("reflink", "hardlink"):
+        try:
+            with open(src_path, "rb") as fsrc, open(dst_path, "wb") as fdst:
+                cloned = False
+                if fcntl is not None:
+                    try:
+                        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                        cloned = True
+                    except OSError:
+                        pass
+                if not cloned:
+                    if not hasattr(os, "copy_file_range"):
+                        raise OSError("copy_file_range not supported")
+                    remaining = os.fstat(fsrc.fileno()).st_size
+                    while remaining > 0:
+                        copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                        if copied == 0:
+                            break
+                        remaining -= copied
+            shutil.copystat(src_path, dst_path)
+            return
+        except OSError:
+            pass
+    
+    shutil.copy2(src_path, dst_path)
+
+
+# 空文件的哈希值
+EMPTY_FILE_DIGEST = 0
+
+
+def _digest_u64(hasher):
+    """取摘要的前 8 字节作为 64 位整数：百万级文件的碰撞概率约 3e-8，int 键比 32 位十六进制字符串更省内存、查找更快"""
+    return int.from_bytes(hasher.digest()[:8], "big")
+
+
+def _fadvise(fd, offset, length, advice):
+    """posix_fadvise 的可移植封装，非 POSIX 平台或调用失败时静默跳过"""
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fd, offset, length, advice)
+        except OSError:
+            pass
+
 
 def get_file_hash_fast(file_path):
     """快速获取文件哈希值，优化版本
     - 首先比较文件大小进行初步去重
     - 对于大文件，只计算文件头和尾部的哈希
-    - 对于小文件，计算完整MD5
+    - 对于小文件，计算完整哈希（BLAKE3 可用时使用 BLAKE3，否则 MD5）
+    - 返回 64 位整数摘要，空文件返回 EMPTY_FILE_DIGEST，失败返回 None
     """
     try:
         file_path = Path(file_path)
@@ -73,47 +219,90 @@ def get_file_hash_fast(file_path):
         
         # 空文件直接返回特殊哈希
         if file_size == 0:
-            return "empty_file"
+            return EMPTY_FILE_DIGEST
         
-        # 小文件（<10MB）计算完整MD5
+        # 小文件（<10MB）计算完整哈希
         if file_size < 10 * 1024 * 1024:
+            if blake3 is not None:
+                # update_mmap 在 C 层直接映射文件；调用方都在线程/进程池中并发哈希，
+                # 这里保持单线程，避免 blake3 内部再起线程造成 CPU 超额订阅
+                hasher = blake3.blake3()
+                hasher.update_mmap(str(file_path))
+                return _digest_u64(hasher)
             hash_md5 = hashlib.md5()
             with open(file_path, "rb") as f:
+                if hasattr(os, "posix_fadvise"):
+                    _fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
                 for chunk in iter(lambda: f.read(8192), b""):
                     hash_md5.update(chunk)
-            return hash_md5.hexdigest()
+                if hasattr(os, "posix_fadvise"):
+                    _fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+            return _digest_u64(hash_md5)
         
         # 大文件只计算头部、中间、尾部的哈希
-        hash_md5 = hashlib.md5()
+        hasher = _new_hasher()
         with open(file_path, "rb") as f:
+            # 提前通知内核预读即将访问的三个 1MB 区间
+            if hasattr(os, "posix_fadvise"):
+                for offset in (0, file_size // 2, max(0, file_size - 1024 * 1024)):
+                    _fadvise(f.fileno(), offset, 1024 * 1024, os.POSIX_FADV_WILLNEED)
+            
             # 读取文件头部 1MB
             head_data = f.read(1024 * 1024)
-            hash_md5.update(head_data)
+            hasher.update(head_data)
             
             # 读取文件中间 1MB
             if file_size > 2 * 1024 * 1024:
                 f.seek(file_size // 2)
                 middle_data = f.read(1024 * 1024)
-                hash_md5.update(middle_data)
+                hasher.update(middle_data)
             
             # 读取文件尾部 1MB
             if file_size > 1024 * 1024:
                 f.seek(max(0, file_size - 1024 * 1024))
                 tail_data = f.read()
-                hash_md5.update(tail_data)
+                hasher.update(tail_data)
+            
+            # 采样完成后释放这些页缓存，避免大量媒体文件挤占页缓存
+            if hasattr(os, "posix_fadvise"):
+                _fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
         
         # 将文件大小也加入哈希计算，增加唯一性
-        hash_md5.update(str(file_size).encode())
-        return f"fast_{hash_md5.hexdigest()}"
+        hasher.update(str(file_size).encode())
+        return _digest_u64(hasher)
         
     except Exception as e:
         log(f"⚠️ 计算文件哈希失败 {file_path}: {e}")
         return None
 
 
+# 文件哈希缓存，在 __main__ 中按 --hash_cache 创建；为 None 时不使用缓存
+_HASH_CACHE = None
+
+
 def get_file_hash(file_path):
-    """获取文件的MD5哈希值，用于去重（保持向后兼容）"""
-    return get_file_hash_fast(file_path)
+    """获取文件哈希值用于去重；启用哈希缓存时先按 (dev, ino, size, mtime) 查缓存"""
+    if _HASH_CACHE is None:
+        return get_file_hash_fast(file_path)
+    
+    try:
+        st = os.stat(file_path)
+        cached = _HASH_CACHE.get(st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+    except (OSError, sqlite3.Error):
+        return get_file_hash_fast(file_path)
+    if cached is not None:
+        return int.from_bytes(cached, "big")
+    
+    file_hash = get_file_hash_fast(file_path)
+    if file_hash is not None:
+        _HASH_CACHE.put(st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, file_hash.to_bytes(8, "big"))
+    return file_hash
+
+
+def flush_hash_cache():
+    """写出当前进程中哈希缓存的剩余条目，作为多进程哈希的 worker_finalizer"""
+    if _HASH_CACHE is not None:
+        _HASH_CACHE.flush()
 
 
 @post_allocated_multithread
@@ -166,8 +355,177 @@ def compute_hash_for_file_process(file_info, **kwargs):
         }
 
 
-def process_hash_group_concurrent(media_files_group, media_counters, unique_files, path_mapping, media_save_dir, dataset_name, max_workers=4, use_process=False):
-    """并发处理需要计算哈希的文件组"""
+# 大小组内文件较多时，每个线程任务一次处理的文件数上限
+HASH_BATCH_LANES = 8
+
+# 所有数据集、所有大小组共用的哈希线程池，在 __main__ 中创建，程序退出时关闭
+_HASH_POOL = None
+
+
+def _batched_file_hashes(src_paths):
+    """在同一个工作线程内依次计算一批文件的哈希，hashlib/BLAKE3 计算时会释放 GIL"""
+    return [get_file_hash(src_path) for src_path in src_paths]
+
+
+@post_allocated_multithread
+def compute_hash_for_batch_thread(batch, **kwargs):
+    """并发计算一批文件的哈希值（线程安全）
+
+    Args:
+        batch (tuple): (batch_start, src_paths)
+
+    Returns:
+        tuple: (batch_start, hashes)，hashes 与 src_paths 一一对应
+    """
+    batch_start, src_paths = batch
+    return batch_start, _batched_file_hashes(src_paths)
+
+
+@functools.lru_cache(maxsize=None)
+def is_rotational_device(st_dev):
+    """根据 /sys/dev/block/{major}:{minor} 判断设备是否为机械硬盘
+
+    分区节点本身没有 queue 目录，需要回退到父设备；无法判断时（非 Linux、网络文件系统等）按 SSD 处理
+    """
+    base = f"/sys/dev/block/{os.major(st_dev)}:{os.minor(st_dev)}"
+    for rotational_path in (os.path.join(base, "queue", "rotational"), os.path.join(base, "..", "queue", "rotational")):
+        try:
+            with open(rotational_path) as f:
+                return f.read().strip() == "1"
+        except OSError:
+            continue
+    return False
+
+
+def compute_hash_by_device(hash_tasks, max_workers=4):
+    """按存储设备分组并发计算哈希：机械硬盘每设备 1 个线程避免磁头来回寻道，SSD 使用 max_workers 个线程"""
+    device_groups = defaultdict(list)  # {st_dev: [task_idx]}
+    for task_idx, media_file in enumerate(hash_tasks):
+        device_groups[media_file["inode"][0]].append(task_idx)
+    
+    executors = []
+    futures = {}
+    try:
+        for st_dev, task_indices in device_groups.items():
+            num_workers = 1 if is_rotational_device(st_dev) else max_workers
+            executor = ThreadPoolExecutor(max_workers=min(num_workers, len(task_indices)))
+            executors.append(executor)
+            batch_size = max(1, min(HASH_BATCH_LANES, len(task_indices) // num_workers))
+            for start in range(0, len(task_indices), batch_size):
+                batch_indices = task_indices[start:start + batch_size]
+                src_paths = [hash_tasks[task_idx]["src_path"] for task_idx in batch_indices]
+                futures[executor.submit(_batched_file_hashes, src_paths)] = batch_indices
+        
+        hash_results = []
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Processing data"):
+            for task_idx, file_hash in zip(futures[future], future.result()):
+                hash_results.append({
+                    "status": "success",
+                    "file_hash": file_hash,
+                    "media_file": hash_tasks[task_idx],
+                })
+        return hash_results
+    finally:
+        for executor in executors:
+            executor.shutdown(wait=True)
+
+
+def copy_unique_media_file(media_file, media_save_dir, media_counters, copy_mode="reflink"):
+    """为新的唯一文件分配编号并复制到 MediaFiles/{media_type}/{idx}{suffix}
+
+    目标子目录由 deduplicate_and_rebuild_dataset 按媒体类型预先创建
+
+    Returns:
+        str or None: 目标路径，复制失败时返回 None
+    """
+    media_type = media_file["media_type"]
+    media_counters[media_type] += 1
+    idx = media_counters[media_type]
+    
+    # 生成新的文件名和路径
+    dst_path = Path(media_save_dir) / media_type / f"{idx}{media_file['suffix']}"
+    
+    # 复制文件
+    try:
+        fast_copy(media_file["src_path"], dst_path, copy_mode)
+    except Exception as e:
+        log(f"⚠️ 复制文件失败 {media_file['src_path']} -> {dst_path}: {e}")
+        return None
+    return str(dst_path)
+
+
+# 前缀预筛读取的文件头部字节数（一页）
+PREFIX_DIGEST_SIZE = 4096
+
+
+def _prefix_digest(file_path):
+    """读取文件前 4KB（单次 pread）计算 64 位指纹；读取失败返回 None"""
+    try:
+        fd = os.open(file_path, os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        buf = os.pread(fd, PREFIX_DIGEST_SIZE, 0)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+    if xxhash is not None:
+        return xxhash.xxh3_64_intdigest(buf)
+    return int.from_bytes(hashlib.blake2b(buf, digest_size=8).digest(), "little")
+
+
+def partition_by_prefix(hash_tasks, pool=None, known_digests=None):
+    """按文件头部指纹预筛：头部指纹在组内唯一的文件必然与其他文件不同，无需计算完整哈希
+
+    known_digests: {src_path: prefix_digest}，已在流式阶段预取的头部指纹，只读取其余文件的头部
+
+    Returns:
+        tuple: (collided_tasks, prefix_results)
+            - collided_tasks: 头部指纹碰撞、仍需完整哈希的文件
+            - prefix_results: 头部唯一的文件，以头部指纹作为摘要的结果（digest_kind 为 "prefix"）
+    """
+    known_digests = known_digests or {}
+    missing_paths = [media_file["src_path"] for media_file in hash_tasks if media_file["src_path"] not in known_digests]
+    if missing_paths:
+        missing_digests = pool.map(_prefix_digest, missing_paths) if pool is not None else map(_prefix_digest, missing_paths)
+        known_digests = {**known_digests, **dict(zip(missing_paths, missing_digests))}
+    digests = [known_digests[media_file["src_path"]] for media_file in hash_tasks]
+    
+    prefix_groups = defaultdict(list)  # {prefix_digest: [media_file]}
+    collided_tasks = []
+    for media_file, digest in zip(hash_tasks, digests):
+        if digest is None:
+            # 读取失败的文件交给完整哈希阶段统一报错处理
+            collided_tasks.append(media_file)
+        else:
+            prefix_groups[digest].append(media_file)
+    
+    prefix_results = []
+    for digest, media_files in prefix_groups.items():
+        if len(media_files) > 1:
+            collided_tasks.extend(media_files)
+            continue
+        media_file = media_files[0]
+        prefix_results.append({
+            "status": "success",
+            "file_hash": digest,
+            "digest_kind": "prefix",
+            "media_file": media_file,
+        })
+    return collided_tasks, prefix_results
+
+
+def process_hash_group_concurrent(media_files_group, media_counters, unique_files, path_mapping, media_save_dir, dataset_name, max_workers=4, use_process=False, copy_mode="reflink", precomputed_prefixes=None, pool=None):
+    """并发处理需要计算哈希的文件组
+
+    - precomputed_prefixes: {src_path: prefix_digest}，流式阶段已预取的头部指纹
+    - pool: 共享的 ThreadPoolExecutor，提供时通过 pool.map 提交，避免每个大小组重新创建线程；
+      多进程模式下只用于读取头部指纹，完整哈希仍交给进程池
+    - 先按文件头部 4KB 指纹预筛，只对头部碰撞的文件计算完整哈希
+    - 已在 path_mapping 中的文件（如大小桶中先行复制的首个文件）保持原目标路径，作为组内比较基准
+    - 头部指纹与完整哈希分属不同取值空间，组内及 unique_files 中均以 (摘要类型, 摘要) 作为键，避免二者误判相等
+    """
     
     # 准备哈希计算任务
     hash_tasks = []
@@ -179,16 +537,60 @@ def process_hash_group_concurrent(media_files_group, media_counters, unique_file
     if not hash_tasks:
         return
     
-    worker_type = "进程" if use_process else "线程"
-    log(f"🔧 {dataset_name}: 并发计算 {len(hash_tasks)} 个文件的哈希值 (使用 {min(max_workers, len(hash_tasks))} 个{worker_type})...")
+    # 头部预筛：头部指纹唯一的文件直接视为唯一文件，只有头部碰撞的文件需要完整哈希
+    hash_tasks, prefix_results = partition_by_prefix(hash_tasks, pool, precomputed_prefixes)
+    if prefix_results:
+        log(f"🔧 {dataset_name}: 头部预筛排除 {len(prefix_results)} 个文件的完整哈希计算")
+    
+    if hash_tasks:
+        worker_type = "进程" if use_process else "线程"
+        log(f"🔧 {dataset_name}: 并发计算 {len(hash_tasks)} 个文件的哈希值 (使用 {min(max_workers, len(hash_tasks))} 个{worker_type})...")
     
     # 选择并发计算方式
-    if use_process:
+    device_ids = {media_file["inode"][0] for media_file in hash_tasks}
+    if not hash_tasks:
+        hash_results = []
+    elif use_process:
         # CPU密集型：使用多进程
         hash_results = compute_hash_for_file_process(
             hash_tasks,
-            num_workers=min(max_workers, len(hash_tasks))
+            num_workers=min(max_workers, len(hash_tasks)),
+            worker_finalizer=flush_hash_cache
         )
+    elif len(device_ids) > 1 or any(is_rotational_device(st_dev) for st_dev in device_ids):
+        # 跨多个设备或位于机械硬盘：按设备分配线程
+        hash_results = compute_hash_by_device(hash_tasks, max_workers=max_workers)
+    elif pool is not None:
+        # 共享线程池：按批提交，线程只在程序启动时创建一次
+        batch_size = max(1, min(HASH_BATCH_LANES, len(hash_tasks) // max_workers))
+        batch_starts = range(0, len(hash_tasks), batch_size)
+        batch_paths = [
+            [media_file["src_path"] for media_file in hash_tasks[start:start + batch_size]]
+            for start in batch_starts
+        ]
+        hash_results = []
+        for batch_start, hashes in zip(batch_starts, pool.map(_batched_file_hashes, batch_paths)):
+            for offset, file_hash in enumerate(hashes):
+                hash_results.append({
+                    "status": "success",
+                    "file_hash": file_hash,
+                    "media_file": hash_tasks[batch_start + offset],
+                })
+    elif len(hash_tasks) >= HASH_BATCH_LANES:
+        # 文件较多：按批分发，减少逐文件的队列调度开销，同时保证每个线程都有任务
+        batch_size = max(1, min(HASH_BATCH_LANES, len(hash_tasks) // max_workers))
+        batches = [
+            (start, [media_file["src_path"] for media_file in hash_tasks[start:start + batch_size]])
+            for start in range(0, len(hash_tasks), batch_size)
+        ]
+        hash_results = []
+        for batch_start, hashes in compute_hash_for_batch_thread(batches, num_workers=min(max_workers, len(batches))):
+            for offset, file_hash in enumerate(hashes):
+                hash_results.append({
+                    "status": "success",
+                    "file_hash": file_hash,
+                    "media_file": hash_tasks[batch_start + offset],
+                })
     else:
         # I/O密集型：使用多线程
         hash_results = compute_hash_for_file_thread(
@@ -196,111 +598,278 @@ def process_hash_group_concurrent(media_files_group, media_counters, unique_file
             num_workers=min(max_workers, len(hash_tasks))
         )
     
-    # 处理哈希结果，进行去重和复制
+    # 处理哈希结果，进行去重和复制；已复制过的文件排在前面作为比较基准
+    hash_results = list(hash_results) + prefix_results
+    hash_results = sorted(hash_results, key=lambda result: result["media_file"]["src_path"] not in path_mapping)
     group_hash_map = {}
     for result in hash_results:
-        if result["status"] != "success" or not result["file_hash"]:
+        if result["status"] != "success" or result["file_hash"] is None:
             continue
         
-        file_hash = result["file_hash"]
+        file_hash = (result.get("digest_kind", "full"), result["file_hash"])
         media_file = result["media_file"]
         src_path = Path(media_file["src_path"])
         
         if file_hash not in group_hash_map:
+            existing_dst_path = path_mapping.get(str(src_path))
+            if existing_dst_path is not None:
+                # 已复制过的文件，直接作为该哈希的目标
+                group_hash_map[file_hash] = {"src_path": str(src_path), "dst_path": existing_dst_path}
+                continue
+            
             # 新的唯一文件
-            media_type = media_file["media_type"]
-            media_counters[media_type] += 1
-            idx = media_counters[media_type]
-            suffix = media_file["suffix"]
+            dst_path = copy_unique_media_file(media_file, media_save_dir, media_counters, copy_mode)
+            if dst_path is None:
+                continue
             
-            # 生成新的文件名和路径
-            new_filename = f"{idx}{suffix}"
-            dst_subdir = Path(media_save_dir) / media_type
-            dst_subdir.mkdir(parents=True, exist_ok=True)
-            dst_path = dst_subdir / new_filename
+            group_hash_map[file_hash] = {
+                "src_path": str(src_path),
+                "dst_path": dst_path,
+                "media_type": media_file["media_type"],
+                "suffix": media_file["suffix"]
+            }
             
-            # 复制文件
-            try:
-                shutil.copy2(src_path, dst_path)
-                
-                group_hash_map[file_hash] = {
-                    "src_path": str(src_path),
-                    "dst_path": str(dst_path),
-                    "media_type": media_type,
-                    "idx": idx,
-                    "suffix": suffix
-                }
-                
-                unique_files[file_hash] = group_hash_map[file_hash]
-                
-                # 记录路径映射（绝对路径）
-                path_mapping[str(src_path)] = str(dst_path)
-                
-            except Exception as e:
-                log(f"⚠️ 复制文件失败 {src_path} -> {dst_path}: {e}")
-                continue
+            unique_files[(media_file["file_size"], *file_hash)] = group_hash_map[file_hash]
+            
+            # 记录路径映射（绝对路径）
+            path_mapping[str(src_path)] = dst_path
         else:
             # 重复文件，使用已有的路径映射
             existing_info = group_hash_map[file_hash]
             path_mapping[str(src_path)] = existing_info["dst_path"]
 
 
+# jsonl 按字节区间切分给工作进程时的目标块大小
+JSONL_CHUNK_SIZE = 64 * 1024 * 1024
+# 对齐块边界时每次读取的字节数（一页）
+CHUNK_BOUNDARY_PROBE_SIZE = 4096
+
+
+def split_jsonl_chunks(jsonl_file, chunk_size=JSONL_CHUNK_SIZE):
+    """按字节区间切分 jsonl，边界向后对齐到下一个换行符之后，保证每行完整落在一个块内
+
+    只读取边界附近的页，不统计行数：区间内的行号由工作进程按区间内相对位置给出，合并时再换算为文件内行号
+
+    Returns:
+        list: [(chunk_start, chunk_end)]，按文件内顺序排列，至少包含一个区间
+    """
+    file_size = os.stat(jsonl_file).st_size
+    if file_size <= chunk_size:
+        return [(0, file_size)]
+    
+    chunks = []
+    fd = os.open(jsonl_file, os.O_RDONLY)
+    try:
+        chunk_start = 0
+        while chunk_start < file_size:
+            boundary = chunk_start + chunk_size
+            # 逐页向后查找换行符，超长行会跨越多页
+            while boundary < file_size:
+                page = os.pread(fd, CHUNK_BOUNDARY_PROBE_SIZE, boundary)
+                nl = page.find(b'\n')
+                if nl != -1:
+                    boundary += nl + 1
+                    break
+                boundary += len(page)
+            boundary = min(boundary, file_size)
+            chunks.append((chunk_start, boundary))
+            chunk_start = boundary
+    finally:
+        os.close(fd)
+    return chunks
+
+
+def iter_jsonl_lines(jsonl_file, chunk_start=0, chunk_end=None):
+    """以 mmap 方式逐行读取 jsonl，按换行符查找切分（memchr），产出 (line_idx, line_bytes)
+
+    - chunk_start/chunk_end: 只读取该字节区间内的行（由 split_jsonl_chunks 对齐到行首）
+    - line_idx 为区间内的相对行号，从 0 开始计数
+    - 行内容为未解码的 bytes，交给 orjson/json 直接解析
+    """
+    with open(jsonl_file, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mm, "madvise"):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            start = chunk_start
+            line_idx = 0
+            end = len(mm) if chunk_end is None else min(chunk_end, len(mm))
+            while start < end:
+                nl = mm.find(b'\n', start)
+                if nl == -1:
+                    nl = end
+                yield line_idx, mm[start:nl]
+                start = nl + 1
+                line_idx += 1
+
+
+def lookup_media_stat(media_path, dir_cache):
+    """通过按目录缓存的 os.scandir 结果获取媒体文件的 stat
+
+    每个目录只 scandir 一次（一次 getdents），文件是否存在直接查字典；
+    stat 仅对被引用的条目调用，并由 DirEntry 缓存，重复引用不再产生系统调用。
+
+    Returns:
+        os.stat_result or None: 文件不存在或不可访问时返回 None
+    """
+    parent, name = os.path.split(media_path)
+    entries = dir_cache.get(parent)
+    if entries is None:
+        try:
+            with os.scandir(parent or ".") as it:
+                entries = {entry.name: entry for entry in it}
+        except OSError:
+            entries = {}
+        dir_cache[parent] = entries
+    entry = entries.get(name)
+    if entry is None:
+        return None
+    try:
+        return entry.stat()
+    except OSError:
+        return None
+
+
+# 子进程结果暂存目录：优先使用内存文件系统 /dev/shm，写满（容器内默认只有 64MB）时回退到普通临时目录
+RESULT_SPILL_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+
+def spill_jsonl_result(jsonl_data, media_files, dataset_name, process_id):
+    """将子进程解析结果写入暂存文件，只把文件路径经队列传回主进程，避免大对象在进程间 pickle 传输
+
+    Returns:
+        str: 暂存文件路径
+    """
+    payload = None
+    if msgpack is not None:
+        try:
+            payload = b"M" + msgpack.packb(jsonl_data, use_bin_type=True) + msgpack.packb(media_files, use_bin_type=True)
+        except (TypeError, ValueError, OverflowError):
+            # 超出 msgpack 表示范围的数据（如超长整数）回退到 pickle
+            payload = None
+    if payload is None:
+        payload = b"P" + pickle.dumps((jsonl_data, media_files), protocol=pickle.HIGHEST_PROTOCOL)
+    
+    spill_dirs = [RESULT_SPILL_DIR]
+    if RESULT_SPILL_DIR != tempfile.gettempdir():
+        spill_dirs.append(tempfile.gettempdir())
+    for spill_dir in spill_dirs:
+        spill_path = None
+        try:
+            fd, spill_path = tempfile.mkstemp(prefix=f"reconstruct_{dataset_name}_p{process_id}_", dir=spill_dir)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(payload)
+            return spill_path
+        except OSError as e:
+            if spill_path is not None:
+                Path(spill_path).unlink(missing_ok=True)
+            if spill_dir == spill_dirs[-1]:
+                raise
+            log(f"⚠️ 暂存目录 {spill_dir} 写入失败（{e}），改用 {spill_dirs[-1]}")
+
+
+def load_jsonl_result(spill_path):
+    """读取并删除子进程的暂存结果
+
+    Returns:
+        tuple: (jsonl_data, media_files)
+    """
+    try:
+        with open(spill_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm[:1] == b"M":
+                unpacker = msgpack.Unpacker(raw=False, max_buffer_size=len(mm))
+                unpacker.feed(mm[1:])
+                jsonl_data = unpacker.unpack()
+                media_files = unpacker.unpack()
+                # msgpack 将 tuple 还原为 list，inode 需要可哈希
+                for media_file in media_files:
+                    media_file["inode"] = tuple(media_file["inode"])
+            else:
+                jsonl_data, media_files = pickle.loads(mm[1:])
+    finally:
+        os.unlink(spill_path)
+    return jsonl_data, media_files
+
+
 @post_allocated_multiprocess
 def process_single_jsonl_file(jsonl_file_info, **kwargs):
-    """处理单个jsonl文件（多进程安全）"""
-    jsonl_file, dataset_name, meta_save_dir, media_save_dir = jsonl_file_info
+    """处理jsonl文件中的一个字节区间（多进程安全）
+
+    任何异常都转为 status 为 "error" 的结果返回，不向外抛出：
+    工作进程一旦因异常退出，主进程会一直等待该区间的结果
+    """
+    jsonl_file, chunk_start = jsonl_file_info[0], jsonl_file_info[1]
     process_id = kwargs.get('process_id', 0)
     
     try:
-        log(f"🔧 进程 {process_id} 开始处理: {Path(jsonl_file).name}")
+        _, _, chunk_end, dataset_name, meta_save_dir, media_save_dir = jsonl_file_info
+        log(f"🔧 进程 {process_id} 开始处理: {Path(jsonl_file).name} [{chunk_start}, {chunk_end})")
         
         # 读取jsonl数据
         jsonl_data = []
         media_files = []
+        dir_cache = {}  # {parent_dir: {name: os.DirEntry}}
+        bad_lines = []  # [(line_idx, error)] - 解析失败的行，合并时换算为文件内行号后记录日志
+        # 行号均为区间内的相对行号；缺少 id 的数据 item_id 为 None，合并时按文件内行号生成
+        line_count = 0
         
-        with open(jsonl_file, 'r', encoding='utf-8') as f:
-            for line_idx, line in enumerate(f):
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    item = json.loads(line)
-                    item_id = item.get("id", f"item_{line_idx}")
-                    
-                    # 保存原始数据
-                    jsonl_data.append({
-                        "data": item,
-                        "line_idx": line_idx,
-                        "src_file": str(jsonl_file)
-                    })
-                    
-                    # 收集媒体文件路径
-                    for media_type in ["images", "videos", "audios"]:
-                        media_paths = item.get(media_type, [])
-                        if isinstance(media_paths, list):
-                            for idx, media_path in enumerate(media_paths):
-                                if media_path and Path(media_path).exists():
-                                    media_files.append({
-                                        "item_id": item_id,
-                                        "line_idx": line_idx,
-                                        "media_type": media_type,
-                                        "media_idx": idx,
-                                        "src_path": str(Path(media_path)),
-                                        "suffix": Path(media_path).suffix,
-                                        "from_jsonl": str(jsonl_file)
-                                    })
-                                    
-                except json.JSONDecodeError as e:
-                    log(f"⚠️ JSON解析错误 {jsonl_file}:{line_idx}: {e}")
-                    continue
+        for line_idx, line in iter_jsonl_lines(jsonl_file, chunk_start, chunk_end):
+            line_count = line_idx + 1
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json_loads(line)
+                item_id = item.get("id")
+                
+                # 保存原始数据
+                media_refs = []  # [(media_type, media_idx, original_path, canonical_src_path)] - 回写路径时使用
+                jsonl_data.append({
+                    "raw": line,
+                    "line_idx": line_idx,
+                    "src_file": str(jsonl_file),
+                    "media_refs": media_refs
+                })
+                
+                # 收集媒体文件路径
+                for media_type in ["images", "videos", "audios"]:
+                    media_paths = item.get(media_type, [])
+                    if isinstance(media_paths, list):
+                        for idx, media_path in enumerate(media_paths):
+                            if not media_path:
+                                continue
+                            canonical_path = str(Path(media_path))
+                            media_refs.append((media_type, idx, media_path, canonical_path))
+                            media_stat = lookup_media_stat(media_path, dir_cache)
+                            if media_stat is not None:
+                                media_files.append({
+                                    "item_id": item_id,
+                                    "line_idx": line_idx,
+                                    "media_type": media_type,
+                                    "media_idx": idx,
+                                    "src_path": canonical_path,
+                                    "suffix": os.path.splitext(canonical_path)[1],
+                                    "from_jsonl": str(jsonl_file),
+                                    "file_size": media_stat.st_size,
+                                    "inode": (media_stat.st_dev, media_stat.st_ino)
+                                })
+                                
+            except json.JSONDecodeError as e:
+                bad_lines.append((line_idx, str(e)))
+                continue
         
+        # 解析结果写入暂存文件，队列中只传路径和计数
         return {
             "status": "success",
             "jsonl_file": str(jsonl_file),
+            "chunk_start": chunk_start,
+            "line_count": line_count,
+            "bad_lines": bad_lines,
             "dataset_name": dataset_name,
-            "jsonl_data": jsonl_data,
-            "media_files": media_files,
+            "result_path": spill_jsonl_result(jsonl_data, media_files, dataset_name, process_id),
             "sample_count": len(jsonl_data),
+            "media_count": len(media_files),
             "process_id": process_id
         }
         
@@ -309,21 +878,112 @@ def process_single_jsonl_file(jsonl_file_info, **kwargs):
         return {
             "status": "error",
             "jsonl_file": str(jsonl_file),
+            "chunk_start": chunk_start,
             "error": str(e),
             "process_id": process_id
         }
 
 
-def deduplicate_and_rebuild_dataset(dataset_results, meta_save_dir, media_save_dir, dataset_name, copy_media_files=True, hash_threads=4, use_process=False):
-    """去重并重建单个数据集"""
+def rewrite_media_paths(raw_line, media_refs, path_mapping):
+    """直接在原始 jsonl 行字节上替换媒体路径，未改动的部分不经过解析和序列化
+
+    - 每个源路径的 JSON 字面量在行内出现次数与其引用次数一致、且行内没有 \\u、\\/ 转义时，直接做字节替换
+    - 否则（同一字符串还出现在其他字段，或源文件使用了不同的转义写法）回退为解析后按下标赋值
+
+    Returns:
+        bytes: 以换行结尾的新行
+    """
+    replacements = {}  # {src_token: [dst_token, ref_count]}
+    for media_type, idx, media_path, canonical_path in media_refs:
+        dst_path = path_mapping.get(canonical_path)
+        if dst_path is None:
+            log(f"⚠️ 找不到路径映射: {media_path}")  # 保留原路径
+            continue
+        src_token = json_dumps_str(media_path)
+        if src_token in replacements:
+            replacements[src_token][1] += 1
+        else:
+            replacements[src_token] = [json_dumps_str(dst_path), 1]
+    
+    if not replacements:
+        return raw_line + b'\n'
+    
+    if b'\\u' not in raw_line and b'\\/' not in raw_line and all(
+        raw_line.count(src_token) == ref_count for src_token, (_, ref_count) in replacements.items()
+    ):
+        for src_token, (dst_token, _) in replacements.items():
+            raw_line = raw_line.replace(src_token, dst_token)
+        return raw_line + b'\n'
+    
+    # 回退：解析整行后按 (media_type, idx) 下标赋值
+    item = json_loads(raw_line)
+    for media_type, idx, media_path, canonical_path in media_refs:
+        dst_path = path_mapping.get(canonical_path)
+        if dst_path is not None:
+            item[media_type][idx] = dst_path
+    return json_dumps_line(item)
+
+
+def collapse_by_inode(media_files_group):
+    """按 (st_dev, st_ino) 合并同一物理文件的多次引用
+
+    Returns:
+        tuple: (unique_media_files, aliases)，aliases 为 [(alias_src_path, canonical_src_path)]
+    """
+    inode_map = {}  # {(dev, ino): media_file}
+    unique_media_files = []
+    aliases = []
+    for media_file in media_files_group:
+        inode = media_file["inode"]
+        canonical = inode_map.get(inode)
+        if canonical is None:
+            inode_map[inode] = media_file
+            unique_media_files.append(media_file)
+        elif media_file["src_path"] != canonical["src_path"]:
+            aliases.append((media_file["src_path"], canonical["src_path"]))
+    return unique_media_files, aliases
+
+
+def deduplicate_and_rebuild_dataset(dataset_results, meta_save_dir, media_save_dir, dataset_name, copy_media_files=True, hash_threads=4, use_process=False, copy_mode="reflink", hash_pool=None):
+    """去重并重建单个数据集
+
+    - hash_pool: 跨数据集共享的哈希线程池；未提供时本函数临时创建并在结束时关闭
+    """
     # 合并所有数据
     all_jsonl_data = []
     all_media_files = []
     
-    for result in dataset_results:
-        if result["status"] == "success":
-            all_jsonl_data.extend(result["jsonl_data"])
-            all_media_files.extend(result["media_files"])
+    # 任一区间处理失败都会丢失数据，直接终止而不是带着缺失继续重建
+    failed_results = [result for result in dataset_results if result["status"] != "success"]
+    if failed_results:
+        for result in failed_results:
+            log(f"❌ {dataset_name}: {result['jsonl_file']} 处理失败: {result.get('error')}")
+        # 成功区间的暂存文件不再读取，直接清理
+        for result in dataset_results:
+            if result["status"] == "success":
+                Path(result["result_path"]).unlink(missing_ok=True)
+        raise RuntimeError(f"{dataset_name}: {len(failed_results)} 个 jsonl 区间处理失败，终止重建")
+    
+    # 工作进程按完成顺序返回结果，按 (文件, 区间起点) 排序后合并，保持源文件内的行顺序；
+    # 合并时累加同一文件内前序区间的行数，把区间内相对行号换算为文件内行号
+    line_offset = 0
+    prev_jsonl_file = None
+    for result in sorted(dataset_results, key=lambda r: (r["jsonl_file"], r["chunk_start"])):
+        if result["jsonl_file"] != prev_jsonl_file:
+            prev_jsonl_file = result["jsonl_file"]
+            line_offset = 0
+        jsonl_data, media_files = load_jsonl_result(result["result_path"])
+        for line_idx, error in result["bad_lines"]:
+            log(f"⚠️ JSON解析错误 {result['jsonl_file']}:{line_offset + line_idx + 1}: {error}")
+        for item_info in jsonl_data:
+            item_info["line_idx"] += line_offset
+        for media_file in media_files:
+            media_file["line_idx"] += line_offset
+            if media_file["item_id"] is None:
+                media_file["item_id"] = f"item_{media_file['line_idx']}"
+        all_jsonl_data.extend(jsonl_data)
+        all_media_files.extend(media_files)
+        line_offset += result["line_count"]
     
     if not all_jsonl_data:
         log(f"⚠️ {dataset_name}: 没有有效的数据")
@@ -333,99 +993,113 @@ def deduplicate_and_rebuild_dataset(dataset_results, meta_save_dir, media_save_d
     if not copy_media_files or media_save_dir is None:
         log(f"📋 {dataset_name}: 跳过媒体文件复制，仅处理MetaFiles")
         
-        # 仅保存jsonl数据，不更新路径
-        updated_data = []
-        for item_info in all_jsonl_data:
-            updated_data.append(item_info["data"])
+        # 仅保存jsonl数据，不更新路径：原始行字节直接写出
+        updated_data = [item_info["raw"] + b'\n' for item_info in all_jsonl_data]
         
         # 保存jsonl文件
         jsonl_path = os.path.join(meta_save_dir, f"{dataset_name}.jsonl")
-        with open(jsonl_path, 'w', encoding='utf-8') as f:
-            for item in updated_data:
-                f.write(json.dumps(item, ensure_ascii=False) + '\n')
+        write_jsonl(jsonl_path, updated_data)
         
         log(f"📁 保存jsonl: {jsonl_path} ({len(updated_data)} 个数据项)")
         return len(updated_data)
     
     log(f"🔍 {dataset_name}: 开始媒体文件去重处理...")
     
-    # 去重处理 - 优化版本
-    unique_files = {}  # {file_hash: file_info}
+    # 每种媒体类型的目标子目录只创建一次，复制时不再逐文件 mkdir
+    for media_type in {media_file["media_type"] for media_file in all_media_files}:
+        (Path(media_save_dir) / media_type).mkdir(parents=True, exist_ok=True)
+    
+    # 去重处理 - 单遍流式版本
+    unique_files = {}  # {(file_size, digest_kind, digest): file_info}，digest_kind 为 "size"/"prefix"/"full"
     path_mapping = {}  # {src_path: new_rel_path}
     media_counters = defaultdict(int)  # {media_type: count}
-    size_groups = defaultdict(list)  # {file_size: [media_files]} - 按文件大小分组
+    first_in_bucket = {}  # {file_size: media_file} - 每个大小桶的首个文件，出现即复制
+    collided_buckets = {}  # {file_size: [media_files]} - 出现大小碰撞、需要哈希去重的桶
+    prefetched_prefixes = {}  # {src_path: Future} - 碰撞发生时立即提交的后台头部指纹任务
+    prefetched_inodes = set()
+    # 头部指纹读取是 I/O 密集型，多进程模式下同样使用线程池；完整哈希仍只对头部碰撞的文件计算
+    own_hash_pool = hash_pool is None
+    if own_hash_pool:
+        hash_pool = ThreadPoolExecutor(max_workers=hash_threads)
+    
+    def prefetch_prefix(media_file):
+        # 机械硬盘上的文件交给 process_hash_group_concurrent 按组读取，避免后台随机寻道
+        inode = media_file["inode"]
+        if inode in prefetched_inodes or is_rotational_device(inode[0]):
+            return
+        prefetched_inodes.add(inode)
+        prefetched_prefixes[media_file["src_path"]] = hash_pool.submit(_prefix_digest, media_file["src_path"])
     
-    log(f"🔍 {dataset_name}: 第一阶段 - 按文件大小分组...")
-    # 第一阶段：按文件大小分组，快速过滤
+    log(f"🔍 {dataset_name}: 第一阶段 - 流式按大小分桶，碰撞时后台读取头部指纹...")
+    # 第一阶段：大小与 inode 已在收集阶段通过 scandir 缓存获得；首次出现的大小直接复制，碰撞的文件立即提交头部指纹读取
     for media_file in tqdm(all_media_files, desc=f"分组{dataset_name}媒体文件"):
-        src_path = Path(media_file["src_path"])
+        file_size = media_file["file_size"]
+        first_media_file = first_in_bucket.get(file_size)
         
-        if not src_path.exists():
-            log(f"⚠️ 文件不存在，跳过: {src_path}")
+        if first_media_file is None:
+            # 该大小目前只有一个文件，无需计算哈希，直接处理
+            first_in_bucket[file_size] = media_file
+            src_path = media_file["src_path"]
+            dst_path = copy_unique_media_file(media_file, media_save_dir, media_counters, copy_mode)
+            if dst_path is None:
+                continue
+            
+            # 该大小下只有这一个文件，仅以大小区分（无需计算哈希）
+            unique_files[(file_size, "size", None)] = {
+                "src_path": src_path,
+                "dst_path": dst_path,
+                "media_type": media_file["media_type"],
+                "suffix": media_file["suffix"]
+            }
+            
+            # 记录路径映射（绝对路径）
+            path_mapping[src_path] = dst_path
             continue
         
-        try:
-            file_size = src_path.stat().st_size
-            media_file["file_size"] = file_size
-            size_groups[file_size].append(media_file)
-        except Exception as e:
-            log(f"⚠️ 获取文件大小失败 {src_path}: {e}")
-            continue
+        media_files_group = collided_buckets.get(file_size)
+        if media_files_group is None:
+            media_files_group = collided_buckets[file_size] = [first_media_file]
+        media_files_group.append(media_file)
+        # 与首个文件是同一 inode 时无需哈希（在第二阶段按 inode 合并）
+        if media_file["inode"] != first_media_file["inode"]:
+            prefetch_prefix(first_media_file)
+            prefetch_prefix(media_file)
     
-    log(f"📊 {dataset_name}: 大小分组统计 - {len(size_groups)} 个不同大小的组")
+    log(f"📊 {dataset_name}: 大小分组统计 - {len(first_in_bucket)} 个不同大小的组，{len(collided_buckets)} 个组需要哈希")
     
-    log(f"🔍 {dataset_name}: 第二阶段 - 计算哈希去重...")
-    # 第二阶段：对每个大小组内的文件计算哈希
-    for file_size, media_files_group in tqdm(size_groups.items(), desc=f"处理{dataset_name}大小组"):
-        if len(media_files_group) == 1:
-            # 该大小只有一个文件，无需计算哈希，直接处理
-            media_file = media_files_group[0]
-            src_path = Path(media_file["src_path"])
-            
-            media_type = media_file["media_type"]
-            media_counters[media_type] += 1
-            idx = media_counters[media_type]
-            suffix = media_file["suffix"]
-            
-            # 生成新的文件名和路径
-            new_filename = f"{idx}{suffix}"
-            dst_subdir = Path(media_save_dir) / media_type
-            dst_subdir.mkdir(parents=True, exist_ok=True)
-            dst_path = dst_subdir / new_filename
+    log(f"🔍 {dataset_name}: 第二阶段 - 汇总哈希结果去重...")
+    # 第二阶段：只处理发生碰撞的大小桶，桶内首个文件已复制，其余文件与其比较
+    try:
+        for file_size, media_files_group in tqdm(collided_buckets.items(), desc=f"处理{dataset_name}大小组"):
+            # 同一 inode（同一路径多次引用或硬链接）无需读取内容即可判定重复
+            media_files_group, inode_aliases = collapse_by_inode(media_files_group)
             
-            # 复制文件
-            try:
-                shutil.copy2(src_path, dst_path)
-                
-                # 使用文件大小作为唯一标识（无需计算哈希）
-                size_hash = f"size_{file_size}_{str(src_path)}"
-                unique_files[size_hash] = {
-                    "src_path": str(src_path),
-                    "dst_path": str(dst_path),
-                    "media_type": media_type,
-                    "idx": idx,
-                    "suffix": suffix
+            if len(media_files_group) > 1:
+                precomputed_prefixes = {
+                    media_file["src_path"]: prefetched_prefixes[media_file["src_path"]].result()
+                    for media_file in media_files_group
+                    if media_file["src_path"] in prefetched_prefixes
                 }
-                
-                # 记录路径映射（绝对路径）
-                path_mapping[str(src_path)] = str(dst_path)
-                
-            except Exception as e:
-                log(f"⚠️ 复制文件失败 {src_path} -> {dst_path}: {e}")
-                continue
-        
-        else:
-            # 该大小有多个文件，需要计算哈希去重（使用并发）
-            process_hash_group_concurrent(
-                media_files_group, 
-                media_counters, 
-                unique_files, 
-                path_mapping, 
-                media_save_dir, 
-                dataset_name,
-                max_workers=hash_threads,
-                use_process=use_process
-            )
+                process_hash_group_concurrent(
+                    media_files_group, 
+                    media_counters, 
+                    unique_files, 
+                    path_mapping, 
+                    media_save_dir, 
+                    dataset_name,
+                    max_workers=hash_threads,
+                    use_process=use_process,
+                    copy_mode=copy_mode,
+                    precomputed_prefixes=precomputed_prefixes,
+                    pool=hash_pool
+                )
+            
+            for alias_path, canonical_path in inode_aliases:
+                if canonical_path in path_mapping:
+                    path_mapping[alias_path] = path_mapping[canonical_path]
+    finally:
+        if own_hash_pool:
+            hash_pool.shutdown(wait=True)
     
     log(f"📊 {dataset_name} 媒体文件处理统计:")
     log(f"   原始文件数: {len(all_media_files)}")
@@ -434,33 +1108,15 @@ def deduplicate_and_rebuild_dataset(dataset_results, meta_save_dir, media_save_d
     for media_type, count in media_counters.items():
         log(f"   {media_type}: {count} 个文件")
     
-    # 更新jsonl数据中的路径
-    updated_data = []
-    for item_info in all_jsonl_data:
-        item = item_info["data"].copy()
-        
-        # 更新媒体文件路径
-        for media_type in ["images", "videos", "audios"]:
-            if media_type in item:
-                media_paths = item[media_type]
-                if isinstance(media_paths, list):
-                    new_paths = []
-                    for src_path in media_paths:
-                        src_path_str = str(Path(src_path))
-                        if src_path_str in path_mapping:
-                            new_paths.append(path_mapping[src_path_str])
-                        else:
-                            log(f"⚠️ 找不到路径映射: {src_path}")
-                            new_paths.append(src_path)  # 保留原路径
-                    item[media_type] = new_paths
-        
-        updated_data.append(item)
+    # 更新jsonl数据中的路径：在原始行字节上按收集阶段记录的媒体引用直接替换
+    updated_data = [
+        rewrite_media_paths(item_info["raw"], item_info["media_refs"], path_mapping)
+        for item_info in all_jsonl_data
+    ]
     
     # 保存更新后的jsonl文件
     jsonl_path = os.path.join(meta_save_dir, f"{dataset_name}.jsonl")
-    with open(jsonl_path, 'w', encoding='utf-8') as f:
-        for item in updated_data:
-            f.write(json.dumps(item, ensure_ascii=False) + '\n')
+    write_jsonl(jsonl_path, updated_data)
     
     log(f"📁 保存更新后的jsonl: {jsonl_path} ({len(updated_data)} 个数据项)")
     return len(updated_data)
@@ -468,19 +1124,20 @@ def deduplicate_and_rebuild_dataset(dataset_results, meta_save_dir, media_save_d
 
 def stat_sample_nums(meta_save_dir):
     """统计样本数量"""
-    total_samples = 0
     jsonl_files = glob(os.path.join(meta_save_dir, "*.jsonl"))
+    if not jsonl_files:
+        return 0
     
-    for jsonl_file in jsonl_files:
+    # 重建输出的 jsonl 由本脚本逐行写出、不含空行，直接统计换行符即可
+    def count_file(jsonl_file):
         try:
-            with open(jsonl_file, 'r', encoding='utf-8') as f:
-                for line in f:
-                    if line.strip():
-                        total_samples += 1
+            return count_lines(jsonl_file)
         except Exception as e:
             log(f"⚠️ 统计文件失败 {jsonl_file}: {e}")
+            return 0
     
-    return total_samples
+    with ThreadPoolExecutor(max_workers=min(32, len(jsonl_files))) as executor:
+        return sum(executor.map(count_file, jsonl_files))
 
 
 if __name__ == "__main__":
@@ -503,6 +1160,10 @@ if __name__ == "__main__":
                         help="使用多进程进行哈希计算（CPU密集型优化）")
     parser.add_argument("--num_workers", type=int, default=8,
                         help="并发进程数")
+    parser.add_argument("--copy_mode", type=str, default="reflink", choices=["reflink", "hardlink", "copy"],
+                        help="媒体文件复制方式：reflink（写时复制，不支持时回退为内核态拷贝）、hardlink（硬链接）、copy（普通复制） (默认: reflink)")
+    parser.add_argument("--hash_cache", type=str, default="",
+                        help="跨运行复用的文件哈希缓存（sqlite）路径，如 ~/.cache/k12_recordgen/hash_cache.sqlite (默认: 不使用)")
     
     args = parser.parse_args()
     
@@ -519,8 +1180,21 @@ if __name__ == "__main__":
     log(f"  复制媒体文件: {args.copy_media}")
     log(f"  哈希计算线程数: {args.hash_threads}")
     log(f"  使用多进程哈希: {args.use_process}")
+    log(f"  媒体文件复制方式: {args.copy_mode}")
+    log(f"  哈希缓存: {args.hash_cache or '不使用'}")
     log(f"  进程数: {args.num_workers}")
     
+    # 哈希缓存：重复运行时未变化的文件直接复用上次的摘要
+    if args.copy_media and args.hash_cache:
+        # 缓存的是 64 位截断摘要，算法名与 zip_dataset.py 的完整十六进制摘要区分开
+        _HASH_CACHE = HashCache(os.path.expanduser(args.hash_cache), algo="blake3_u64" if blake3 is not None else "md5_u64")
+        atexit.register(_HASH_CACHE.flush)
+    
+    # 所有数据集共用一个线程池（头部指纹预取，以及线程哈希模式下的完整哈希），避免逐个数据集/大小组反复创建销毁线程
+    if args.copy_media:
+        _HASH_POOL = ThreadPoolExecutor(max_workers=args.hash_threads)
+        atexit.register(_HASH_POOL.shutdown, wait=True)
+    
     reconstruct_total_sample_nums = 0
     updated_configs = {}
     
@@ -549,7 +1223,7 @@ if __name__ == "__main__":
             media_save_dir = None
         
         # 处理jsonl文件
-        all_files = glob(os.path.join(str(metafiles_dir), "**", "*.jsonl"), recursive=True)
+        all_files = list(iter_jsonl_files(str(metafiles_dir)))
         
         if not all_files:
             log(f"⚠️ 跳过 {dataset_name}: 未找到jsonl文件")
@@ -557,10 +1231,11 @@ if __name__ == "__main__":
         
         log(f"📋 {dataset_name}: 找到 {len(all_files)} 个jsonl文件")
         
-        # 准备多进程任务
+        # 准备多进程任务：按 64MB 字节区间切分，避免文件大小不均导致部分进程空闲
         jsonl_tasks = []
         for jsonl_file in all_files:
-            jsonl_tasks.append([jsonl_file, dataset_name, meta_save_dir, media_save_dir])
+            for chunk_start, chunk_end in split_jsonl_chunks(jsonl_file):
+                jsonl_tasks.append([jsonl_file, chunk_start, chunk_end, dataset_name, meta_save_dir, media_save_dir])
         
         # 多进程处理jsonl文件
         log(f"🚀 {dataset_name}: 开始多进程处理 (使用 {min(args.num_workers, len(jsonl_tasks))} 个进程)...")
@@ -571,7 +1246,8 @@ if __name__ == "__main__":
         
         # 去重并重建数据集
         c_sample_nums = deduplicate_and_rebuild_dataset(
-            dataset_results, meta_save_dir, media_save_dir, dataset_name, args.copy_media, args.hash_threads, args.use_process
+            dataset_results, meta_save_dir, media_save_dir, dataset_name, args.copy_media, args.hash_threads, args.use_process, args.copy_mode,
+            hash_pool=_HASH_POOL
         )
         
         reconstruct_total_sample_nums += c_sample_nums
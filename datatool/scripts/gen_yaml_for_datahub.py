@@ -11,10 +11,9 @@ import yaml
 import argparse
 from pathlib import Path
 
-from glob import glob
 from tqdm import tqdm
 
-from datatool.utils.samples import stat_sample_nums
+from datatool.utils.samples import stat_sample_nums, find_metafile_dirs
 from datatool.config import gconfig
 
 parser = argparse.ArgumentParser()
@@ -28,7 +27,7 @@ args = parser.parse_args()
 if args.save_path is None:
     args.save_path = gconfig.config_dir / f"datahubs/{os.path.basename(args.data_dir)}@{args.metafile_name}.yaml"
 
-metafile_dirs = sorted(glob(os.path.join(args.data_dir, "**", args.metafile_name), recursive=True))
+metafile_dirs = find_metafile_dirs(args.data_dir, args.metafile_name)
 
 total_sample_nums = 0
 final_config = {"DataDir": args.data_dir, "Datasets": {}}
@@ -1,12 +1,12 @@
 """
-JSONL文件分割脚本 - 多线程并发版本
+JSONL文件分割脚本 - 多进程并发版本
 
 功能描述:
-    这个脚本用于将大型JSONL文件按指定的样本数量上限进行分割，支持多线程并发处理。
+    这个脚本用于将大型JSONL文件按指定的样本数量上限进行分割，支持多进程并发处理。
     分割完成后会自动删除原始文件，确保数据目录的整洁。
 
 主要功能:
-    1. 🚀 多线程并发处理多个JSONL文件
+    1. 🚀 多进程并发处理多个JSONL文件
     2. ✂️ 按用户指定样本上限分割文件
     3. 🗑️ 自动删除原始文件
     4. 📋 智能命名新分割的文件
@@ -14,7 +14,7 @@ JSONL文件分割脚本 - 多线程并发版本
 
 工作流程:
     1. 扫描数据集配置，找到所有MetaFiles目录
-    2. 多线程并发处理每个JSONL文件
+    2. 多进程并发处理每个JSONL文件
     3. 按样本上限分割文件
     4. 安全删除原始文件
     5. 生成处理报告
@@ -36,99 +36,214 @@ JSONL文件分割脚本 - 多线程并发版本
 注意事项:
     - 确保有足够的磁盘空间存放分割后的文件
     - 原始文件会被删除，请提前备份重要数据
-    - 线程数建议设置为CPU核心数的1-2倍
+    - 进程数建议不超过CPU核心数
 """
 
 import os
 import json
+import mmap
 import yaml
 from pathlib import Path
 from typing import Dict, List, Any, Tuple
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 
-from datatool.utils.parallel import post_allocated_multithread
+from datatool.utils.parallel import post_allocated_multiprocess
+from datatool.utils.samples import list_files_by_suffix
 from datatool.logger import log
 
 
-@post_allocated_multithread
+# 优先使用 libyaml 的 C 实现，未编译 libyaml 时回退到纯 Python 版本
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
+# orjson 直接在 bytes 上解析，比标准库 json 快数倍；未安装时回退到 json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def json_loads(line: bytes) -> Any:
+    """解析一行 jsonl（bytes）"""
+    if orjson is not None:
+        return orjson.loads(line)
+    return json.loads(line)
+
+
+# 判断空白行时需要检查的行首字节
+WHITESPACE_BYTES = frozenset(b' \t\r\n\x0b\x0c')
+
+
+def scan_part_segments(mm: mmap.mmap, max_samples: int, jsonl_file: Path) -> List[Tuple[List[Tuple[int, int]], int]]:
+    """扫描换行符并逐行校验 JSON，将合法的非空行按 max_samples 划分为若干部分
+    
+    无法解析的行记录日志后跳过，不写入分割文件也不计入样本数
+    
+    Returns:
+        [(segments, samples)]，segments 为该部分中连续合法行的字节区间 [(start, end)]
+    """
+    parts = []
+    segments = []
+    samples = 0
+    pos = 0
+    size = len(mm)
+    line_idx = 0
+    while pos < size:
+        nl = mm.find(b'\n', pos)
+        end = size if nl == -1 else nl + 1
+        # JSON 行以 { 开头，只有行首为空白字符时才需要检查整行是否为空白
+        if mm[pos] not in WHITESPACE_BYTES or not mm[pos:end].isspace():
+            try:
+                json_loads(mm[pos:end])
+            except json.JSONDecodeError as e:
+                log(f"⚠️ JSON解析错误 {jsonl_file}:{line_idx}: {e}")
+                pos = end
+                line_idx += 1
+                continue
+            if segments and segments[-1][1] == pos:
+                segments[-1] = (segments[-1][0], end)
+            else:
+                segments.append((pos, end))
+            samples += 1
+            if samples == max_samples:
+                parts.append((segments, samples))
+                segments = []
+                samples = 0
+        pos = end
+        line_idx += 1
+    if samples:
+        parts.append((segments, samples))
+    return parts
+
+
+def write_all(out_fd: int, data) -> None:
+    """将 data 全部写入 out_fd；os.write 可能只写出一部分，循环直到写完"""
+    view = memoryview(data)
+    while view:
+        written = os.write(out_fd, view)
+        view = view[written:]
+
+
+def copy_byte_range(in_fd: int, out_fd: int, offset: int, length: int):
+    """将输入文件 [offset, offset + length) 的字节追加到输出文件，优先使用内核态的 os.sendfile
+    
+    输入文件在区间结束前就到达末尾时抛出 IOError，避免分割文件被截断后原文件仍被删除
+    """
+    if not hasattr(os, "sendfile"):
+        while length > 0:
+            chunk = os.pread(in_fd, min(length, 1 << 20), offset)
+            if not chunk:
+                raise IOError(f"输入文件在偏移 {offset} 处提前结束，还有 {length} 字节未复制")
+            write_all(out_fd, chunk)
+            offset += len(chunk)
+            length -= len(chunk)
+        return
+    while length > 0:
+        sent = os.sendfile(out_fd, in_fd, offset, length)
+        if sent == 0:
+            raise IOError(f"输入文件在偏移 {offset} 处提前结束，还有 {length} 字节未复制")
+        offset += sent
+        length -= sent
+
+
+# 小于该长度的字节区间先合并到内存缓冲区，避免逐段发起 sendfile 系统调用
+SMALL_SEGMENT_SIZE = 64 * 1024
+# 合并缓冲区的刷新阈值
+WRITE_BUFFER_SIZE = 1 << 20
+
+
+def write_part_segments(mm: mmap.mmap, in_fd: int, out_f, segments: List[Tuple[int, int]], append_newline: bool = False):
+    """将若干字节区间写入分割文件（out_f 需以 buffering=0 打开）
+
+    大区间直接用 sendfile 在内核态复制；小区间（空行打断的零碎行）累积到 1MiB 缓冲区后一次写出。
+    无缓冲的文件对象单次 write 可能只写出一部分，缓冲区经 write_all 循环写完
+    """
+    out_fd = out_f.fileno()
+    buf = bytearray()
+    for seg_start, seg_end in segments:
+        if seg_end - seg_start < SMALL_SEGMENT_SIZE:
+            buf += mm[seg_start:seg_end]
+            if len(buf) >= WRITE_BUFFER_SIZE:
+                write_all(out_fd, buf)
+                buf.clear()
+            continue
+        if buf:
+            write_all(out_fd, buf)
+            buf.clear()
+        copy_byte_range(in_fd, out_fd, seg_start, seg_end - seg_start)
+    if append_newline:
+        buf.append(0x0A)
+    if buf:
+        write_all(out_fd, buf)
+
+
+@post_allocated_multiprocess
 def split_single_jsonl_file(file_info: Dict[str, Any], **kwargs) -> Dict[str, Any]:
-    """分割单个JSONL文件（多线程安全）"""
+    """分割单个JSONL文件（多进程安全）"""
     jsonl_file = Path(file_info["jsonl_file"])
     max_samples = file_info["max_samples_per_file"]
     output_prefix = file_info.get("output_prefix", "part")
-    thread_id = kwargs.get("thread_id", "unknown")
+    process_id = kwargs.get("process_id", "unknown")
     
     try:
-        log(f"🔧 线程 {thread_id} 开始处理: {jsonl_file.name}")
+        log(f"🔧 进程 {process_id} 开始处理: {jsonl_file.name}")
         
-        # 读取所有样本
-        all_samples = []
-        with open(jsonl_file, 'r', encoding='utf-8') as f:
-            for line_idx, line in enumerate(f):
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    sample = json.loads(line)
-                    all_samples.append(sample)
-                except json.JSONDecodeError as e:
-                    log(f"⚠️ JSON解析错误 {jsonl_file}:{line_idx}: {e}")
-                    continue
+        output_dir = jsonl_file.parent
+        base_name = jsonl_file.stem
+        
+        def get_part_path(part_idx):
+            # 生成新文件名
+            if output_prefix:
+                return output_dir / f"{output_prefix}_{base_name}_part{part_idx}.jsonl"
+            return output_dir / f"{base_name}_part{part_idx}.jsonl"
+        
+        # 分割只按行划分：先扫描换行符并校验每行 JSON，确定每个分割文件的字节区间，再由内核直接复制行字节
+        output_files = []
+        total_samples = 0
+        with open(jsonl_file, 'rb') as f:
+            file_size = os.fstat(f.fileno()).st_size
+            if file_size > 0:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    parts = scan_part_segments(mm, max_samples, jsonl_file)
+                    missing_final_newline = mm[-1:] != b'\n'
+                    total_samples = sum(samples for _, samples in parts)
+                    
+                    if len(parts) > 1:
+                        for part_idx, (segments, samples) in enumerate(parts):
+                            new_file_path = get_part_path(part_idx + 1)
+                            with open(new_file_path, 'wb', buffering=0) as out_f:
+                                write_part_segments(
+                                    mm, f.fileno(), out_f, segments,
+                                    append_newline=missing_final_newline and segments[-1][1] == file_size
+                                )
+                            output_files.append({"file": str(new_file_path), "samples": samples})
         
-        if not all_samples:
+        if total_samples == 0:
             log(f"⚠️ 文件为空，跳过: {jsonl_file}")
             return {
                 "status": "skipped",
                 "file": str(jsonl_file),
                 "reason": "empty_file",
-                "thread_id": thread_id
+                "process_id": process_id
             }
         
-        total_samples = len(all_samples)
-        
         # 如果样本数不超过限制，无需分割
-        if total_samples <= max_samples:
-            log(f"📋 线程 {thread_id} - {jsonl_file.name}: {total_samples} 样本，无需分割")
+        if not output_files:
+            log(f"📋 进程 {process_id} - {jsonl_file.name}: {total_samples} 样本，无需分割")
             return {
                 "status": "no_split_needed",
                 "file": str(jsonl_file),
                 "total_samples": total_samples,
-                "thread_id": thread_id
+                "process_id": process_id
             }
         
-        # 计算需要分割的文件数
-        num_parts = (total_samples + max_samples - 1) // max_samples
+        num_parts = len(output_files)
         
-        # 生成分割后的文件
-        output_files = []
-        output_dir = jsonl_file.parent
-        base_name = jsonl_file.stem
-        
-        for part_idx in range(num_parts):
-            start_idx = part_idx * max_samples
-            end_idx = min((part_idx + 1) * max_samples, total_samples)
-            part_samples = all_samples[start_idx:end_idx]
-            
-            # 生成新文件名
-            if output_prefix:
-                new_filename = f"{output_prefix}_{base_name}_part{part_idx + 1}.jsonl"
-            else:
-                new_filename = f"{base_name}_part{part_idx + 1}.jsonl"
-            
-            new_file_path = output_dir / new_filename
-            
-            # 写入分割后的文件
-            with open(new_file_path, 'w', encoding='utf-8') as f:
-                for sample in part_samples:
-                    f.write(json.dumps(sample, ensure_ascii=False) + '\n')
-            
-            output_files.append({
-                "file": str(new_file_path),
-                "samples": len(part_samples)
-            })
-        
-        log(f"✅ 线程 {thread_id} - {jsonl_file.name}: 分割为 {num_parts} 个文件")
+        log(f"✅ 进程 {process_id} - {jsonl_file.name}: 分割为 {num_parts} 个文件")
         
         return {
             "status": "success",
@@ -136,7 +251,7 @@ def split_single_jsonl_file(file_info: Dict[str, Any], **kwargs) -> Dict[str, An
             "total_samples": total_samples,
             "output_files": output_files,
             "num_parts": num_parts,
-            "thread_id": thread_id
+            "process_id": process_id
         }
         
     except Exception as e:
@@ -144,14 +259,14 @@ def split_single_jsonl_file(file_info: Dict[str, Any], **kwargs) -> Dict[str, An
             "status": "error",
             "file": str(jsonl_file),
             "message": str(e),
-            "thread_id": thread_id
+            "process_id": process_id
         }
 
 
 def collect_jsonl_files(yaml_path: str) -> List[Dict[str, Any]]:
     """收集所有需要处理的JSONL文件"""
     with open(yaml_path, "r") as f:
-        dataset_config = yaml.safe_load(f)
+        dataset_config = yaml.load(f, Loader=YamlLoader)
     
     jsonl_files = []
     
@@ -164,35 +279,50 @@ def collect_jsonl_files(yaml_path: str) -> List[Dict[str, Any]]:
             continue
         
         # 查找所有JSONL文件
-        dataset_jsonl_files = list(metafile_dir.glob("*.jsonl"))
+        dataset_jsonl_files = list_files_by_suffix(metafile_dir, ".jsonl")
         
         for jsonl_file in dataset_jsonl_files:
             jsonl_files.append({
                 "dataset_name": dataset_name,
-                "jsonl_file": str(jsonl_file),
+                "jsonl_file": jsonl_file,
                 "metafile_dir": str(metafile_dir)
             })
     
     return jsonl_files
 
 
+def delete_single_file(file_path: str) -> str:
+    """删除单个文件，返回状态: deleted / missing / failed"""
+    try:
+        os.unlink(file_path)
+        return "deleted"
+    except FileNotFoundError:
+        log(f"⚠️ 文件不存在，跳过删除: {file_path}")
+        return "missing"
+    except Exception as e:
+        log(f"❌ 删除文件失败 {file_path}: {e}")
+        return "failed"
+
+
 def safe_delete_files(files_to_delete: List[str], num_workers: int = 4) -> Dict[str, Any]:
-    """安全删除文件列表"""
+    """安全删除文件列表
+    
+    unlink 主要耗时在文件系统元数据操作上且会释放 GIL，使用线程池并发提交删除
+    """
     deleted_count = 0
     failed_deletes = []
     
     log(f"🗑️ 开始删除 {len(files_to_delete)} 个原始文件...")
     
-    for file_path in tqdm(files_to_delete, desc="删除原始文件"):
-        try:
-            if Path(file_path).exists():
-                Path(file_path).unlink()
+    max_workers = max(1, min(num_workers * 4, 32, len(files_to_delete)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(delete_single_file, file_path): file_path for file_path in files_to_delete}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="删除原始文件"):
+            status = future.result()
+            if status == "deleted":
                 deleted_count += 1
-            else:
-                log(f"⚠️ 文件不存在，跳过删除: {file_path}")
-        except Exception as e:
-            log(f"❌ 删除文件失败 {file_path}: {e}")
-            failed_deletes.append(file_path)
+            elif status == "failed":
+                failed_deletes.append(futures[future])
     
     return {
         "deleted_count": deleted_count,
@@ -212,7 +342,7 @@ def split_jsonl_files(yaml_path: str, max_samples_per_file: int, output_prefix:
     log(f"  YAML配置: {yaml_path}")
     log(f"  每文件最大样本数: {max_samples_per_file}")
     log(f"  输出前缀: {output_prefix or '(无)'}")
-    log(f"  线程数: {num_workers}")
+    log(f"  进程数: {num_workers}")
     
     # 收集所有JSONL文件
     log("📋 收集JSONL文件...")
@@ -234,8 +364,9 @@ def split_jsonl_files(yaml_path: str, max_samples_per_file: int, output_prefix:
             "dataset_name": file_info["dataset_name"]
         })
     
-    # 多线程并发处理
-    log(f"🚀 开始多线程分割 (使用 {num_workers} 个线程)...")
+    # 多进程并发处理：扫描换行符是 CPU 密集的解释器循环，多线程受 GIL 限制
+    num_workers = min(num_workers, len(file_tasks))
+    log(f"🚀 开始多进程分割 (使用 {num_workers} 个进程)...")
     results = split_single_jsonl_file(file_tasks, num_workers=num_workers)
     
     # 统计结果
@@ -281,11 +412,11 @@ def split_jsonl_files(yaml_path: str, max_samples_per_file: int, output_prefix:
 if __name__ == "__main__":
     import argparse
     
-    parser = argparse.ArgumentParser(description="JSONL文件分割工具 - 多线程并发版本")
+    parser = argparse.ArgumentParser(description="JSONL文件分割工具 - 多进程并发版本")
     parser.add_argument("--datasets_yaml", required=True, help="数据集YAML配置文件路径")
     parser.add_argument("--max_samples", type=int, default=1000, help="每个JSONL文件的最大样本数")
     parser.add_argument("--output_prefix", default=None, help="输出文件名前缀（可选）")
-    parser.add_argument("--workers", type=int, default=8, help="并发线程数 (默认: 8)")
+    parser.add_argument("--workers", type=int, default=8, help="并发进程数 (默认: 8)")
     
     args = parser.parse_args()
     
@@ -40,30 +40,131 @@
 
 import os
 import json
+import mmap
 import yaml
+import heapq
+import shutil
 import argparse
 import zipfile
+import numpy as np
 from pathlib import Path
 from glob import glob
 from tqdm import tqdm
 import multiprocessing
 from concurrent.futures import ProcessPoolExecutor, as_completed
 import time
-from typing import List, Dict, Any, Tuple
+from collections import defaultdict
+from typing import List, Dict, Any, Tuple, Iterator
 
 from datatool.utils.parallel import post_allocated_multiprocess
+from datatool.utils.samples import list_files_by_suffix
 from datatool.logger import log
 
 
+# 优先使用 libyaml 的 C 实现，未编译 libyaml 时回退到纯 Python 版本
+try:
+    from yaml import CSafeLoader as YamlLoader, CSafeDumper as YamlDumper
+except ImportError:
+    from yaml import SafeLoader as YamlLoader, SafeDumper as YamlDumper
+
+
 @post_allocated_multiprocess
 def extract_zip_parallel(zip_file_info: Tuple[str, str], **kwargs) -> Dict[str, Any]:
     """使用post_allocated_multiprocess并行解压单个zip文件"""
     return extract_single_zip(zip_file_info, **kwargs)
 
 
+# 单个zip成员数不少于该值时才拆分给多个进程并行解压
+MIN_MEMBERS_PER_WORKER = 16
+
+
+def split_members_by_size(members: List[zipfile.ZipInfo], num_groups: int) -> List[List[str]]:
+    """按解压后大小将zip成员均衡分成 num_groups 组（大文件优先分配给当前负载最小的组）"""
+    groups = [[] for _ in range(num_groups)]
+    loads = [(0, group_idx) for group_idx in range(num_groups)]
+    for member in sorted(members, key=lambda m: m.file_size, reverse=True):
+        load, group_idx = heapq.heappop(loads)
+        groups[group_idx].append(member.filename)
+        heapq.heappush(loads, (load + member.file_size, group_idx))
+    return [group for group in groups if group]
+
+
+# 流式解压zip成员时的读写缓冲区大小
+EXTRACT_BUFFER_SIZE = 1 << 20
+
+
+def extract_member_streaming(zipf: zipfile.ZipFile, member: zipfile.ZipInfo, extract_dir: str, verify_crc: bool = True) -> bool:
+    """以 1MiB 缓冲区流式解压单个成员；目标文件已存在且大小一致时跳过
+
+    verify_crc=False 时跳过解压数据的 CRC32 校验（仅用于可信的压缩包，如本仓库 zip_dataset.py 生成的数据）；
+    依赖 ZipExtFile 的私有属性 _expected_crc，缺少该属性时仍校验 CRC
+
+    Returns:
+        bool: 是否实际写入了文件
+    """
+    extract_root = os.path.abspath(extract_dir)
+    target = os.path.normpath(os.path.join(extract_root, member.filename))
+    if not target.startswith(extract_root + os.sep):
+        # 含 .. 或绝对路径的成员交给 zipfile 自带的路径清理逻辑
+        zipf.extract(member, extract_dir)
+        return True
+    
+    if member.is_dir():
+        os.makedirs(target, exist_ok=True)
+        return False
+    
+    try:
+        if os.stat(target).st_size == member.file_size:
+            return False  # 已解压过，跳过
+    except FileNotFoundError:
+        pass
+    
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with zipf.open(member) as src, open(target, 'wb', buffering=0) as dst:
+        if not verify_crc and hasattr(src, "_expected_crc"):
+            # ZipExtFile 在没有期望 CRC 时既不累计计算也不在结尾校验；
+            # 该私有属性不存在时（zipfile 实现变化）按正常流程校验 CRC
+            src._expected_crc = None
+        shutil.copyfileobj(src, dst, EXTRACT_BUFFER_SIZE)
+    return True
+
+
+def extract_members(zip_file: str, extract_dir: str, member_names: List[str], verify_crc: bool = True) -> int:
+    """在独立进程中解压指定的zip成员，每个进程使用自己的 ZipFile 句柄"""
+    with zipfile.ZipFile(zip_file, 'r') as zipf:
+        for name in member_names:
+            extract_member_streaming(zipf, zipf.getinfo(name), extract_dir, verify_crc)
+    return len(member_names)
+
+
+def extract_members_parallel(zipf: zipfile.ZipFile, zip_file: str, extract_dir: str, num_workers: int, verify_crc: bool = True):
+    """将单个zip的成员按大小分组后由进程池并行解压，充分利用多核进行 DEFLATE 解压"""
+    members = zipf.infolist()
+    
+    # 先统一创建所有目录，避免多个进程同时创建同一目录产生冲突
+    extract_root = os.path.abspath(extract_dir)
+    for member in members:
+        member_dir = os.path.normpath(os.path.join(extract_root, os.path.dirname(member.filename)))
+        if member_dir.startswith(extract_root):
+            os.makedirs(member_dir, exist_ok=True)
+    
+    member_groups = split_members_by_size([m for m in members if not m.is_dir()], num_workers)
+    with ProcessPoolExecutor(max_workers=len(member_groups)) as executor:
+        futures = [executor.submit(extract_members, zip_file, str(extract_dir), group, verify_crc) for group in member_groups]
+        for future in as_completed(futures):
+            future.result()
+
+
 def extract_single_zip(zip_file_info: Tuple[str, str], **kwargs) -> Dict[str, Any]:
-    """解压单个zip文件（多进程安全）"""
-    zip_file, extract_dir = zip_file_info
+    """解压单个zip文件（多进程安全）
+
+    zip_file_info 可追加可选元素：
+        - member_workers: 单个zip内部用于并行解压成员的进程数
+        - trust_archives: 是否跳过 CRC32 校验
+    """
+    zip_file, extract_dir = zip_file_info[:2]
+    member_workers = zip_file_info[2] if len(zip_file_info) > 2 else 1
+    trust_archives = zip_file_info[3] if len(zip_file_info) > 3 else False
     process_id = kwargs.get("process_id", "unknown")
     
     try:
@@ -79,21 +180,21 @@ def extract_single_zip(zip_file_info: Tuple[str, str], **kwargs) -> Dict[str, An
             
             # 安全解压所有文件（处理并发目录创建冲突）
             try:
-                zipf.extractall(extract_dir)
+                if member_workers > 1 and file_count >= member_workers * MIN_MEMBERS_PER_WORKER:
+                    # 成员较多：拆分给多个进程并行解压
+                    extract_members_parallel(zipf, zip_file, extract_dir, member_workers, verify_crc=not trust_archives)
+                elif trust_archives:
+                    # extractall 无法关闭 CRC 校验，可信压缩包逐个成员流式解压
+                    for member in zipf.infolist():
+                        extract_member_streaming(zipf, member, extract_dir, verify_crc=False)
+                else:
+                    zipf.extractall(extract_dir)
             except FileExistsError as e:
                 # 处理并发目录创建冲突，逐个文件解压
                 log(f"🔄 进程 {process_id} 检测到目录冲突，切换到安全模式解压")
-                for member in zipf.namelist():
-                    try:
-                        zipf.extract(member, extract_dir)
-                    except FileExistsError:
-                        # 如果是目录冲突，忽略；如果是文件冲突，跳过
-                        if not member.endswith('/'):
-                            # 检查文件是否已存在且内容相同
-                            target_file = Path(extract_dir) / member
-                            if target_file.exists():
-                                continue  # 文件已存在，跳过
-                        continue
+                for member in zipf.infolist():
+                    # 目录使用 exist_ok 创建，大小一致的已有文件直接跳过
+                    extract_member_streaming(zipf, member, extract_dir, verify_crc=not trust_archives)
         
         duration = time.time() - start_time
         
@@ -110,7 +211,7 @@ def extract_single_zip(zip_file_info: Tuple[str, str], **kwargs) -> Dict[str, An
         return {"status": "error", "file": zip_file, "message": str(e), "process_id": process_id}
 
 
-def extract_zip_files(zip_pattern: str, zip_source_dir: str, extract_dir: str, num_workers: int = 8) -> Path:
+def extract_zip_files(zip_pattern: str, zip_source_dir: str, extract_dir: str, num_workers: int = 8, trust_archives: bool = False) -> Path:
     """智能多进程解压所有zip文件"""
     zip_source_dir = Path(zip_source_dir)
     extract_dir = Path(extract_dir)
@@ -182,8 +283,13 @@ def extract_zip_files(zip_pattern: str, zip_source_dir: str, extract_dir: str, n
     if is_volume_set and len(zip_files) > 1:
         log(f"🔍 检测到分卷文件，使用优化的解压策略")
     
-    # 准备多进程参数 - 解压到extract_dir
-    extract_tasks = [(zip_file, extract_dir) for zip_file in zip_files]
+    # 准备多进程参数 - 解压到extract_dir；zip文件少于CPU核数时，剩余核数用于单个zip内部的并行解压
+    member_workers = max(1, (os.cpu_count() or 1) // actual_workers)
+    if member_workers > 1:
+        log(f"💡 每个zip内部使用 {member_workers} 个进程并行解压成员")
+    if trust_archives:
+        log(f"⚡ 信任压缩包：跳过 CRC32 校验")
+    extract_tasks = [(zip_file, extract_dir, member_workers, trust_archives) for zip_file in zip_files]
     
     # 使用post_allocated_multiprocess进行多进程解压
     log(f"🚀 开始多进程解压 (使用 {actual_workers} 个进程)...")
@@ -238,41 +344,57 @@ def extract_zip_files(zip_pattern: str, zip_source_dir: str, extract_dir: str, n
 
 
 def verify_extraction_completeness(zip_files: List[str], extract_dir: Path) -> Dict[str, Any]:
-    """验证分卷解压的完整性"""
+    """验证分卷解压的完整性
+
+    按目录比较文件数量：由各zip的成员列表统计每个目录应有的文件数，再用 os.scandir 只列出这些目录，
+    不再为每个文件拼接完整路径并集中到一个大集合里比较。
+    同名成员只计一次：zip_dataset 会把 jsonl、recipe 等文件写入每一个分卷
+    """
     try:
-        # 统计zip文件中的总文件数
-        expected_files = set()
-        total_expected = 0
+        # 统计zip文件中每个目录的文件（按文件名去重）
+        expected_names = defaultdict(set)  # {相对目录: {文件名}}
         
         for zip_file in zip_files:
             with zipfile.ZipFile(zip_file, 'r') as zipf:
                 for name in zipf.namelist():
                     if not name.endswith('/'):  # 排除目录
-                        expected_files.add(name)
-                        total_expected += 1
+                        rel_dir, _, base_name = name.rpartition('/')
+                        expected_names[rel_dir].add(base_name)
+        expected_counts = {rel_dir: len(names) for rel_dir, names in expected_names.items()}
+        del expected_names
+        total_expected = sum(expected_counts.values())
         
-        # 统计实际解压的文件数
-        actual_files = set()
-        for root, dirs, files in os.walk(extract_dir):
-            for file in files:
-                rel_path = os.path.relpath(os.path.join(root, file), extract_dir)
-                actual_files.add(rel_path)
-        
-        missing_files = expected_files - actual_files
-        extra_files = actual_files - expected_files
+        # 统计实际解压的文件数（只列出期望存在的目录）
+        extract_root = str(extract_dir)
+        total_actual = 0
+        short_dirs = []
+        missing_count = 0
+        for rel_dir, expected in expected_counts.items():
+            actual = 0
+            try:
+                with os.scandir(os.path.join(extract_root, rel_dir) if rel_dir else extract_root) as it:
+                    for entry in it:
+                        if entry.is_file():
+                            actual += 1
+            except FileNotFoundError:
+                pass
+            total_actual += actual
+            if actual < expected:
+                missing_count += expected - actual
+                short_dirs.append(rel_dir or ".")
         
-        if missing_files:
+        if missing_count:
             return {
                 "success": False,
-                "message": f"缺少 {len(missing_files)} 个文件",
-                "missing_files": list(missing_files)[:10],  # 只显示前10个
-                "total_files": len(actual_files)
+                "message": f"缺少 {missing_count} 个文件",
+                "missing_files": short_dirs[:10],  # 只显示前10个缺少文件的目录
+                "total_files": total_actual
             }
         
         return {
             "success": True,
-            "total_files": len(actual_files),
-            "expected_files": len(expected_files)
+            "total_files": total_actual,
+            "expected_files": total_expected
         }
         
     except Exception as e:
@@ -283,52 +405,93 @@ def verify_extraction_completeness(zip_files: List[str], extract_dir: Path) -> D
         }
 
 
+MEDIA_TYPES = ("images", "videos", "audios")
+# 复用同一个编码器，避免 json.dumps 每次调用重新解析参数、构造 JSONEncoder；分隔符保持默认以与原输出一致
+json_encode = json.JSONEncoder(ensure_ascii=False).encode
+# 按块向量化查找换行符，避免为整个大文件一次性生成布尔数组
+LINE_INDEX_TILE_SIZE = 64 << 20
+
+
+def iter_lines_mmap(file_path) -> Iterator[bytes]:
+    """mmap 读取文件，逐块用 numpy 一次性定位换行符后按偏移切出每一行（含结尾换行符）
+
+    相比逐行迭代文件对象，换行查找在 numpy 中完成，Python 层只剩切片；末行缺少换行符时原样产出
+    """
+    with open(file_path, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        if file_size == 0:
+            return
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    
+    try:
+        start = 0
+        for tile_start in range(0, file_size, LINE_INDEX_TILE_SIZE):
+            tile_size = min(LINE_INDEX_TILE_SIZE, file_size - tile_start)
+            tile = np.frombuffer(mm, dtype=np.uint8, count=tile_size, offset=tile_start)
+            newlines = np.flatnonzero(tile == 0x0A)
+            del tile
+            for end in (newlines + (tile_start + 1)).tolist():
+                yield mm[start:end]
+                start = end
+        if start < file_size:
+            yield mm[start:file_size]
+    finally:
+        mm.close()
+
+
+def repath_item(item: Dict[str, Any], prefix: str) -> Dict[str, Any]:
+    """将样本中的相对媒体路径改写为绝对路径（已是绝对路径的保持不变，与 Path 拼接语义一致）"""
+    for media_type in MEDIA_TYPES:
+        paths = item.get(media_type)
+        if paths:
+            # 原地改写列表元素，不再为每条记录新建列表
+            for idx, rel_path in enumerate(paths):
+                if not rel_path.startswith(os.sep):
+                    paths[idx] = prefix + rel_path
+    return item
+
+
 @post_allocated_multiprocess
 def process_jsonl_file(file_info, **kwargs):
     """并发处理单个jsonl文件中的路径更新"""
     jsonl_file, dataset_dir, new_base_path = file_info
     
+    # 逐行流式改写到临时文件，完成后原子替换原文件；进程中途被杀时原文件保持完整
+    tmp_file = Path(str(jsonl_file) + ".tmp")
     try:
-        updated_items = []
-        
-        with open(jsonl_file, "r") as f:
-            lines = f.readlines()
+        items_count = 0
+        # 绝对路径前缀只拼接一次，逐条记录只做字符串拼接，不再构造 Path 对象
+        prefix = str(new_base_path / dataset_dir.name) + os.sep
         
-        for line in lines:
-            if not line.strip():
-                continue
-            
-            try:
-                item = json.loads(line)
-                
-                # 更新媒体文件路径
-                for media_type in ["images", "videos", "audios"]:
-                    if media_type in item and item[media_type]:
-                        updated_paths = []
-                        for rel_path in item[media_type]:
-                            # 从相对路径构建绝对路径
-                            abs_path = new_base_path / dataset_dir.name / rel_path
-                            updated_paths.append(str(abs_path))
-                        item[media_type] = updated_paths
-                
-                updated_items.append(item)
+        with open(tmp_file, "wb") as dst:
+            lines = iter_lines_mmap(jsonl_file)
+            # try 放在整个循环外：格式正确的文件只进入一次异常处理块；
+            # 遇到坏行时记录日志后重新进入循环，生成器从下一行继续
+            while True:
+                try:
+                    for line in lines:
+                        if line.isspace():
+                            continue
+                        
+                        # 坏行在这里抛出 JSONDecodeError，记录日志后跳过
+                        item = repath_item(json.loads(line), prefix)
+                        dst.write((json_encode(item) + "\n").encode("utf-8"))
+                        items_count += 1
+                    break
                 
-            except json.JSONDecodeError as e:
-                log(f"JSON decode error in {jsonl_file}: {e}")
-                continue
+                except json.JSONDecodeError as e:
+                    log(f"JSON decode error in {jsonl_file}: {e}")
         
-        # 写回文件
-        with open(jsonl_file, "w") as f:
-            for item in updated_items:
-                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+        os.replace(tmp_file, jsonl_file)
         
         return {
             "file": str(jsonl_file),
-            "items_count": len(updated_items),
+            "items_count": items_count,
             "status": "success"
         }
         
     except Exception as e:
+        tmp_file.unlink(missing_ok=True)
         return {
             "file": str(jsonl_file),
             "status": "error", 
@@ -336,10 +499,66 @@ def process_jsonl_file(file_info, **kwargs):
         }
 
 
+def reassemble_chunked_media(dataset_dir: Path) -> int:
+    """还原 zip_dataset.py --chunk_dedup 打包的媒体文件
+    
+    按每个 recipe（{dataset}/MediaFiles/recipes/...json）记录的块顺序拼接 MediaFiles/chunks 中的块文件，
+    全部还原成功后删除块目录和 recipe 目录；有块缺失（如分卷未全部解压）时保留它们以便补齐后重试
+    
+    Returns:
+        还原的文件数
+    """
+    chunk_dir = dataset_dir / "MediaFiles" / "chunks"
+    if not chunk_dir.is_dir():
+        return 0
+    
+    recipe_dirs = [path for path in dataset_dir.glob("*/MediaFiles/recipes") if path.is_dir()]
+    recipe_files = [path for recipe_dir in recipe_dirs for path in recipe_dir.rglob("*.json")]
+    log(f"🧩 按 recipe 还原 {len(recipe_files)} 个块级去重的媒体文件...")
+    
+    restored = 0
+    failed = 0
+    for recipe_file in tqdm(recipe_files, desc="还原分块文件"):
+        # .../{dataset}/MediaFiles/recipes/{media_type}/{name}.json -> .../{dataset}/MediaFiles/{media_type}/{name}
+        recipe_root = next(recipe_dir for recipe_dir in recipe_dirs if recipe_dir in recipe_file.parents)
+        target = recipe_root.parent / recipe_file.relative_to(recipe_root).with_suffix("")
+        tmp_target = Path(str(target) + ".tmp")
+        try:
+            recipe = json.loads(recipe_file.read_bytes())
+            target.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_target, "wb") as dst:
+                for chunk_hash in recipe["chunks"]:
+                    with open(chunk_dir / f"{chunk_hash}.bin", "rb") as src:
+                        shutil.copyfileobj(src, dst, EXTRACT_BUFFER_SIZE)
+            if tmp_target.stat().st_size != recipe["size"]:
+                raise ValueError(f"大小不一致: {tmp_target.stat().st_size} != {recipe['size']}")
+            os.replace(tmp_target, target)
+            restored += 1
+        except Exception as e:
+            tmp_target.unlink(missing_ok=True)
+            log(f"❌ 还原分块文件失败 {target}: {e}")
+            failed += 1
+    
+    if failed:
+        log(f"⚠️ {failed} 个文件还原失败，保留块目录: {chunk_dir}")
+    else:
+        shutil.rmtree(chunk_dir)
+        for recipe_dir in recipe_dirs:
+            shutil.rmtree(recipe_dir)
+        # 块目录位于顶层 MediaFiles 下，若已为空一并删除
+        try:
+            chunk_dir.parent.rmdir()
+        except OSError:
+            pass
+    
+    log(f"✅ 分块文件还原完成: {restored} 个")
+    return restored
+
+
 def update_yaml_config(yaml_file, new_base_path):
     """更新yaml配置文件中的路径"""
     with open(yaml_file, "r") as f:
-        config = yaml.safe_load(f)
+        config = yaml.load(f, Loader=YamlLoader)
     
     # 更新 DataDir
     config["DataDir"] = str(new_base_path)
@@ -359,13 +578,13 @@ def update_yaml_config(yaml_file, new_base_path):
     
     # 写回文件
     with open(yaml_file, "w") as f:
-        yaml.dump(config, f, default_flow_style=False, allow_unicode=True)
+        yaml.dump(config, f, Dumper=YamlDumper, default_flow_style=False, allow_unicode=True)
     
     log(f"✅ 更新配置文件: {yaml_file}")
     return config
 
 
-def unzip_update_dataset_paths(zip_pattern, zip_source_dir, new_base_path, num_workers=8):
+def unzip_update_dataset_paths(zip_pattern, zip_source_dir, new_base_path, num_workers=8, trust_archives=False):
     """解压zip文件并更新所有路径为绝对路径"""
     zip_source_dir = Path(zip_source_dir)
     new_base_path = Path(new_base_path)
@@ -377,10 +596,15 @@ def unzip_update_dataset_paths(zip_pattern, zip_source_dir, new_base_path, num_w
     log(f"  进程数量: {num_workers}")
     
     # 多进程解压zip文件 - 从zip_source_dir解压到new_base_path
-    dataset_dir = extract_zip_files(zip_pattern, zip_source_dir, new_base_path, num_workers)
+    dataset_dir = extract_zip_files(zip_pattern, zip_source_dir, new_base_path, num_workers, trust_archives)
+    
+    # 还原块级去重打包的媒体文件（未使用 --chunk_dedup 打包时无操作）
+    reassemble_chunked_media(dataset_dir)
     
     # 查找yaml配置文件 - 在解压后的目录中查找
-    yaml_files = list(dataset_dir.glob("*.yaml")) + list(dataset_dir.glob("*.yml"))
+    # 与原先 glob("*.yaml") + glob("*.yml") 一致：所有 .yaml 排在 .yml 之前
+    yaml_files = sorted(list_files_by_suffix(dataset_dir, (".yaml", ".yml")),
+                        key=lambda p: (not p.endswith(".yaml"), p))
     if not yaml_files:
         log("❌ 未找到yaml配置文件")
         return
@@ -405,7 +629,7 @@ def unzip_update_dataset_paths(zip_pattern, zip_source_dir, new_base_path, num_w
             log(f"⚠️ MetaFiles目录不存在: {metafiles_dir}")
             continue
         
-        jsonl_files = list(metafiles_dir.glob("*.jsonl"))
+        jsonl_files = list_files_by_suffix(metafiles_dir, ".jsonl")
         for jsonl_file in jsonl_files:
             jsonl_tasks.append((jsonl_file, dataset_subdir, new_base_path))
     
@@ -468,7 +692,9 @@ if __name__ == "__main__":
     parser.add_argument("--zip_source_dir", required=True, help="zip文件所在目录")
     parser.add_argument("--target_dir", required=True, help="解压目标目录 (数据最终存放位置)")
     parser.add_argument("--workers", type=int, default=8, help="并发进程数 (默认: 8，会自动调整为zip文件数量)")
+    parser.add_argument("--trust_archives", action="store_true",
+                       help="信任压缩包（如 zip_dataset.py 生成的数据），解压时跳过 CRC32 校验以提升速度")
     
     args = parser.parse_args()
     
-    unzip_update_dataset_paths(args.zip_pattern, args.zip_source_dir, args.target_dir, args.workers)
+    unzip_update_dataset_paths(args.zip_pattern, args.zip_source_dir, args.target_dir, args.workers, args.trust_archives)
@@ -14,7 +14,7 @@
     6. 🛡️ 错误处理和进度显示
 
 工作流程:
-    阶段1: 收集所有数据项（单线程，快速）
+    阶段1: 多进程并行解析所有元数据文件，收集数据项
     阶段2: 多线程并行收集所有媒体文件信息
     阶段3: 单线程进行媒体文件去重（避免竞争条件）
     阶段4: 多线程并行更新每个item的媒体文件路径
@@ -76,22 +76,118 @@ from glob import glob
 from pathlib import Path
 import threading
 from concurrent.futures import ThreadPoolExecutor
-from collections import defaultdict
+from collections import defaultdict, deque
 import io
+import mmap
+import zlib
+import shutil
 import hashlib
+import itertools
+import bisect
 from typing import Dict, List, Tuple, Any
 
-from datatool.utils.parallel import post_allocated_multithread, post_allocated_multiprocess
+import numpy as np
+
+from datatool.utils.parallel import post_allocated_multithread
+from datatool.utils.hash_cache import HashCache
 from datatool.logger import log
 import concurrent.futures
 import time
 
+# xxh3_128 使用 SIMD 指令，整文件哈希速度接近磁盘带宽；未安装时回退到 blake3 / MD5
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# blake3 使用 SIMD 指令，吞吐量远高于 MD5；未安装时回退到 hashlib.md5
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+# orjson 直接在 bytes 上解析，比标准库 json 快数倍；未安装时回退到 json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+json_loads = orjson.loads if orjson is not None else json.loads
+
+
+def json_dumps_line(item) -> bytes:
+    """序列化单条数据为 jsonl 的一行（utf-8 bytes，含换行符）
+
+    回退到 json 时使用与 orjson 相同的紧凑分隔符，两条路径输出的字节一致
+    """
+    if orjson is not None:
+        return orjson.dumps(item, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(item, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+# fastcdc 用于 --chunk_dedup 模式的内容定义分块；未安装时该模式不可用
+try:
+    import fastcdc
+except ImportError:
+    fastcdc = None
+
+# 已压缩的媒体格式，再做 DEFLATE 几乎没有收益，直接以 ZIP_STORED 存储
+PRECOMPRESSED_SUFFIXES = frozenset({
+    ".jpg", ".jpeg", ".png", ".webp", ".gif",
+    ".mp4", ".mov", ".webm", ".mkv", ".avi",
+    ".mp3", ".flac", ".aac", ".m4a", ".ogg",
+})
+# 计算文件哈希时每次读取的字节数
+HASH_READ_SIZE = 1 << 20
+# 哈希流水线中同时在途的任务数上限
+HASH_PIPELINE_DEPTH = 1024
+# 多进程哈希时每个任务包含的文件数
+HASH_PROCESS_BATCH = 64
+# 一组待哈希文件总大小超过该值时自动改用多进程（线程受 GIL 限制只能用上少数核心）
+HASH_PROCESS_THRESHOLD = 1 << 30
+# 文本类成员（jsonl / yaml）及其他未知格式使用的压缩级别
+DEFLATE_LEVEL = 1
+# 写入 ZIP_STORED 成员时的拷贝缓冲区大小（ZipFile.write 内部固定为 8KB）
+ZIP_COPY_BUFFER_SIZE = 1 << 20
+# 超过该大小的待压缩媒体文件不整体读入内存并行压缩，仍由 ZipFile.write 流式压缩
+PARALLEL_DEFLATE_MAX_SIZE = 64 << 20
+# 块级去重：平均块大小约 1MiB，小于 CHUNK_DEDUP_MIN_SIZE 的文件仍按整文件存储
+CHUNK_AVG_SIZE = 1 << 20
+CHUNK_DEDUP_MIN_SIZE = 4 << 20
+CHUNK_STORE_DIR = "MediaFiles/chunks"
+
+
+# 每个哈希线程复用的 blake3 哈希对象与读缓冲区，避免每个文件重新分配
+_HASH_TLS = threading.local()
+
+
+def new_file_hasher():
+    """获取文件内容哈希对象，优先使用 blake3（线程内复用，reset 后返回）"""
+    if blake3 is not None:
+        hasher = getattr(_HASH_TLS, "hasher", None)
+        if hasher is None:
+            # 调用方都在哈希线程/进程池中并发执行，这里保持单线程，避免 blake3 内部再起线程造成 CPU 超额订阅
+            hasher = _HASH_TLS.hasher = blake3.blake3()
+        else:
+            hasher.reset()
+        return hasher
+    # hashlib.md5 不支持 reset，每次新建
+    return hashlib.md5()
+
+
+def get_read_buffer() -> memoryview:
+    """获取当前线程复用的 1MiB 读缓冲区"""
+    buf = getattr(_HASH_TLS, "buf", None)
+    if buf is None:
+        buf = _HASH_TLS.buf = memoryview(bytearray(HASH_READ_SIZE))
+    return buf
+
 
 def get_file_hash_fast(file_path):
-    """快速获取文件哈希值，优化版本
-    - 首先比较文件大小进行初步去重
-    - 对于大文件，只计算文件头和尾部的哈希
-    - 对于小文件，计算完整MD5
+    """获取整个文件内容的哈希值，用于去重
+    - 空文件直接返回特殊哈希 "empty_file"
+    - 优先使用 xxh3_128（SIMD 实现，速度接近磁盘带宽），其次 blake3，均未安装时回退到 MD5
+    - 不超过 HASH_READ_SIZE 的小文件读入线程内复用的缓冲区一次性哈希，不建立 mmap、也不为每次读取分配新的 bytes
+    - 不再对大文件做头部/中间/尾部采样：采样处相同而其余内容不同的文件会被误判为重复
     """
     try:
         file_path = Path(file_path)
@@ -101,36 +197,43 @@ def get_file_hash_fast(file_path):
         if file_size == 0:
             return "empty_file"
         
-        # 小文件（<10MB）计算完整MD5
-        if file_size < 10 * 1024 * 1024:
-            hash_md5 = hashlib.md5()
-            with open(file_path, "rb") as f:
-                for chunk in iter(lambda: f.read(8192), b""):
-                    hash_md5.update(chunk)
-            return hash_md5.hexdigest()
-        
-        # 大文件只计算头部、中间、尾部的哈希
-        hash_md5 = hashlib.md5()
-        with open(file_path, "rb") as f:
-            # 读取文件头部 1MB
-            head_data = f.read(1024 * 1024)
-            hash_md5.update(head_data)
-            
-            # 读取文件中间 1MB
-            if file_size > 2 * 1024 * 1024:
-                f.seek(file_size // 2)
-                middle_data = f.read(1024 * 1024)
-                hash_md5.update(middle_data)
-            
-            # 读取文件尾部 1MB
-            if file_size > 1024 * 1024:
-                f.seek(max(0, file_size - 1024 * 1024))
-                tail_data = f.read()
-                hash_md5.update(tail_data)
+        if file_size <= HASH_READ_SIZE:
+            buf = get_read_buffer()
+            n = 0
+            with open(file_path, "rb", buffering=0) as f:
+                while n < file_size:
+                    read = f.readinto(buf[n:])
+                    if not read:
+                        break
+                    n += read
+            if xxhash is not None:
+                return xxhash.xxh3_128_hexdigest(buf[:n])
+            hasher = new_file_hasher()
+            hasher.update(buf[:n])
+            return hasher.hexdigest()
         
-        # 将文件大小也加入哈希计算，增加唯一性
-        hash_md5.update(str(file_size).encode())
-        return f"fast_{hash_md5.hexdigest()}"
+        if xxhash is not None:
+            with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                # 顺序访问提示：内核加大预读
+                if hasattr(mm, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                return xxhash.xxh3_128_hexdigest(mm)
+        
+        hasher = new_file_hasher()
+        if blake3 is not None:
+            # blake3 直接通过 mmap 读取整个文件
+            hasher.update_mmap(file_path)
+            return hasher.hexdigest()
+        buf = get_read_buffer()
+        with open(file_path, "rb", buffering=0) as f:
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            while True:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                hasher.update(buf[:n])
+        return hasher.hexdigest()
         
     except Exception as e:
         log(f"⚠️ 计算文件哈希失败 {file_path}: {e}")
@@ -138,66 +241,74 @@ def get_file_hash_fast(file_path):
 
 
 def get_file_hash(file_path):
-    """获取文件的MD5哈希值，用于去重（保持向后兼容）"""
+    """获取文件内容哈希值，用于去重（保持向后兼容）"""
     return get_file_hash_fast(file_path)
 
 
-@post_allocated_multithread
-def compute_hash_for_file_zip_thread(file_info, **kwargs):
-    """并发计算单个文件的哈希值（线程安全）- zip专用"""
-    thread_id = kwargs.get('thread_id', 'unknown')
-    
-    try:
-        src_path = file_info["src_path"]
-        file_hash = get_file_hash(src_path)
-        
-        return {
-            "status": "success",
-            "src_path": src_path,
-            "file_hash": file_hash,
-            "media_file": file_info,
-            "worker_id": thread_id
-        }
-    except Exception as e:
-        return {
-            "status": "error",
-            "src_path": file_info.get("src_path", "unknown"),
-            "error": str(e),
-            "worker_id": thread_id
-        }
+def get_file_hashes(src_paths: List[str]) -> List[str]:
+    """批量计算一组文件的哈希值（在子进程中执行，一次往返处理整批路径）"""
+    return [get_file_hash(src_path) for src_path in src_paths]
 
 
-@post_allocated_multiprocess
-def compute_hash_for_file_zip_process(file_info, **kwargs):
-    """并发计算单个文件的哈希值（进程安全）- zip专用"""
-    process_id = kwargs.get('process_id', 'unknown')
+def iter_file_hashes(src_paths, num_workers, use_process=False):
+    """按输入顺序产出各文件的哈希值（流水线）
     
-    try:
-        src_path = file_info["src_path"]
-        file_hash = get_file_hash(src_path)
-        
-        return {
-            "status": "success",
-            "src_path": src_path,
-            "file_hash": file_hash,
-            "media_file": file_info,
-            "worker_id": process_id
-        }
-    except Exception as e:
-        return {
-            "status": "error",
-            "src_path": file_info.get("src_path", "unknown"),
-            "error": str(e),
-            "worker_id": process_id
-        }
+    所有待哈希文件共用同一个线程/进程池持续计算，调用方边消费结果边分配去重编号；
+    同时在途的任务数不超过 HASH_PIPELINE_DEPTH，限制结果积压占用的内存。
+    多进程时每 HASH_PROCESS_BATCH 个路径打包为一个任务，只传递路径字符串列表，摊薄每个任务的序列化与 IPC 开销
+    """
+    src_paths = iter(src_paths)
+    if use_process:
+        executor_cls = concurrent.futures.ProcessPoolExecutor
+        batch_size = HASH_PROCESS_BATCH
+    else:
+        executor_cls = ThreadPoolExecutor
+        batch_size = 1
+    max_pending = max(1, HASH_PIPELINE_DEPTH // batch_size)
+    with executor_cls(max_workers=num_workers) as executor:
+        pending = deque()
+        while True:
+            batch = list(itertools.islice(src_paths, batch_size))
+            if not batch:
+                break
+            pending.append(executor.submit(get_file_hashes, batch))
+            if len(pending) >= max_pending:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def parse_one_metafile(metafile, dataset_name):
+    """解析单个元数据文件，返回其中所有数据项（可在子进程中执行）"""
+    items = []
+    # 以二进制逐行流式读取，不再 readlines 一次性载入整个文件，也省去 utf-8 解码
+    with open(metafile, "rb") as f:
+        for line_idx, line in enumerate(f):
+            if not line.strip():
+                continue
+            try:
+                meta_item = json_loads(line)
+                items.append({
+                    "dataset_name": dataset_name,
+                    "metafile": metafile,
+                    "line_idx": line_idx,
+                    "meta_item": meta_item
+                })
+            except json.JSONDecodeError as e:
+                log(f"JSON decode error in {metafile}:{line_idx}: {e}")
+    return items
 
 
-def collect_all_data_items(yaml_path):
-    """收集所有需要处理的数据项（不去重）"""
+def collect_all_data_items(yaml_path, num_workers=1):
+    """收集所有需要处理的数据项（不去重）
+    
+    元数据文件较多时使用多进程并行解析，结果按文件顺序合并，与串行结果一致
+    """
     with open(yaml_path, "r") as f:
         dataset_config = yaml.safe_load(f)
     
-    all_items = []
+    metafiles = []
+    dataset_names = []
     
     # 遍历所有 Datasets
     for dataset_name, config in dataset_config["Datasets"].items():
@@ -205,24 +316,17 @@ def collect_all_data_items(yaml_path):
         
         # 递归找到所有 .jsonl 文件
         all_metafiles = glob(os.path.join(metafile_dir, "**", "*.jsonl"), recursive=True)
-        
-        for metafile in all_metafiles:
-            with open(metafile, "r") as f:
-                lines = f.readlines()
-                for line_idx, line in enumerate(lines):
-                    if not line.strip():
-                        continue
-                    try:
-                        meta_item = json.loads(line)
-                        all_items.append({
-                            "dataset_name": dataset_name,
-                            "metafile": metafile,
-                            "line_idx": line_idx,
-                            "meta_item": meta_item
-                        })
-                    except json.JSONDecodeError as e:
-                        log(f"JSON decode error in {metafile}:{line_idx}: {e}")
+        metafiles.extend(all_metafiles)
+        dataset_names.extend([dataset_name] * len(all_metafiles))
     
+    num_workers = min(num_workers, len(metafiles))
+    if num_workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
+            item_lists = list(executor.map(parse_one_metafile, metafiles, dataset_names, chunksize=4))
+    else:
+        item_lists = map(parse_one_metafile, metafiles, dataset_names)
+    
+    all_items = list(itertools.chain.from_iterable(item_lists))
     return all_items, dataset_config
 
 
@@ -248,7 +352,8 @@ def collect_media_files_from_item(item_data: Dict[str, Any], **kwargs) -> List[D
                 continue
                 
             try:
-                file_size = src_path.stat().st_size
+                file_stat = src_path.stat()
+                file_size = file_stat.st_size
                 suffix = src_path.suffix if src_path.suffix else ""
                 
                 media_files.append({
@@ -256,6 +361,8 @@ def collect_media_files_from_item(item_data: Dict[str, Any], **kwargs) -> List[D
                     "media_type": media_type,
                     "suffix": suffix,
                     "size": file_size,
+                    "inode": (file_stat.st_dev, file_stat.st_ino),  # 用于按磁盘顺序读取及哈希缓存
+                    "mtime": file_stat.st_mtime_ns,
                     "dataset_name": dataset_name,
                     "item_id": item_id,
                     "item_idx": idx  # 在item内的索引
@@ -267,21 +374,25 @@ def collect_media_files_from_item(item_data: Dict[str, Any], **kwargs) -> List[D
     return media_files
 
 
-def deduplicate_media_files_byhash(all_media_files: List[Dict[str, Any]], hash_threads: int = 16, use_process: bool = False) -> Tuple[Dict[str, Dict], Dict[str, str]]:
+def deduplicate_media_files_byhash(all_media_files: List[Dict[str, Any]], hash_threads: int = 16, use_process: bool = False, hash_cache: HashCache = None) -> Tuple[Dict[str, Dict], Dict[str, str]]:
     """对媒体文件进行去重，返回唯一文件映射和路径映射（优化版：两阶段去重 + 并发哈希）
     
+    传入 hash_cache 时，大小、mtime 均未变化的文件直接复用上次运行的哈希值
+    
     Returns:
-        unique_files: {file_hash: {media_type, src_path, idx, suffix, size}}
+        unique_files: {(file_size, file_hash): {media_type, src_path, idx, suffix, size}}
+            该大小下只有一个文件时无需计算哈希，file_hash 为 None
         path_mapping: {original_src_path: new_relative_path}
     """
     log("🔍 开始媒体文件去重...")
     
-    unique_files = {}  # {file_hash: file_info}
+    unique_files = {}  # {(file_size, file_hash): file_info}
     path_mapping = {}  # {src_path: relative_path}
     media_counters = defaultdict(lambda: defaultdict(int))  # {dataset: {media_type: counter}} - 按数据集分别计数
     size_groups = defaultdict(list)  # {file_size: [media_files]} - 按文件大小分组
     
     # 第一阶段：按文件大小分组，快速过滤
+    # 直接复用 collect_media_files_from_item 中 stat 得到的 size，不再重复 stat
     log("🔍 第一阶段：按文件大小分组...")
     processed_paths = set()  # 用于跟踪已处理的路径
     for media_file in tqdm(all_media_files, desc="分组媒体文件"):
@@ -291,19 +402,52 @@ def deduplicate_media_files_byhash(all_media_files: List[Dict[str, Any]], hash_t
         if src_path in processed_paths:
             continue
         processed_paths.add(src_path)
-        
-        try:
-            file_size = Path(src_path).stat().st_size
-            media_file["file_size"] = file_size
-            size_groups[file_size].append(media_file)
-        except Exception as e:
-            log(f"⚠️ 获取文件大小失败 {src_path}: {e}")
-            continue
+        size_groups[media_file["size"]].append(media_file)
     
     log(f"📊 大小分组统计 - {len(size_groups)} 个不同大小的组")
     
     # 第二阶段：对每个大小组内的文件计算哈希
+    # 所有需要哈希的文件一次性提交到同一个池中流水线计算，主线程按组顺序消费结果并分配编号，
+    # 不再为每个大小组单独创建线程池并等待整组完成；编号仍按发现顺序分配，与逐组处理时一致
     log("🔍 第二阶段：计算哈希去重...")
+    hash_groups = {}  # {file_size: [存在的media_files]} - 需要计算哈希的组
+    for file_size, media_files_group in size_groups.items():
+        if len(media_files_group) > 1:
+            hash_groups[file_size] = [media_file for media_file in media_files_group if Path(media_file["src_path"]).exists()]
+    hash_tasks = list(itertools.chain.from_iterable(hash_groups.values()))
+    
+    cached_hashes = {}  # {src_path: file_hash} - 哈希缓存命中的文件
+    if hash_cache is not None:
+        for media_file in hash_tasks:
+            file_hash = hash_cache.get(*media_file["inode"], media_file["size"], media_file["mtime"])
+            if file_hash is not None:
+                cached_hashes[media_file["src_path"]] = file_hash
+        log(f"💾 哈希缓存命中 {len(cached_hashes)}/{len(hash_tasks)} 个文件")
+        hash_tasks = [media_file for media_file in hash_tasks if media_file["src_path"] not in cached_hashes]
+    
+    num_workers = max(1, min(hash_threads, len(hash_tasks)))
+    if not use_process and sum(media_file["size"] for media_file in hash_tasks) > HASH_PROCESS_THRESHOLD:
+        use_process = True
+    if hash_tasks:
+        worker_type = "进程" if use_process else "线程"
+        log(f"🔧 流水线计算 {len(hash_tasks)} 个文件的哈希值 (使用 {num_workers} 个{worker_type})...")
+    # 只有哈希的读取顺序按 (设备号, inode) 全局排序：同一文件系统上 inode 顺序通常接近数据块的物理顺序，
+    # 读取由随机寻道变为近似顺序读（机械硬盘上收益明显）；结果先暂存，分配编号时再按发现顺序取用
+    hash_tasks.sort(key=lambda media_file: media_file["inode"])
+    file_hashes = iter_file_hashes((media_file["src_path"] for media_file in hash_tasks), num_workers, use_process)
+    hash_feed = iter(hash_tasks)
+    ready_hashes = {}  # {src_path: file_hash} - 已算出、尚未被所在大小组取用的哈希
+    
+    def take_hash(media_file):
+        """取出 media_file 的哈希，必要时继续消费流水线直到其结果产出"""
+        while media_file["src_path"] not in ready_hashes:
+            hashed_file = next(hash_feed)
+            file_hash = next(file_hashes)
+            if hash_cache is not None and file_hash is not None:
+                hash_cache.put(*hashed_file["inode"], hashed_file["size"], hashed_file["mtime"], file_hash)
+            ready_hashes[hashed_file["src_path"]] = file_hash
+        return ready_hashes.pop(media_file["src_path"])
+    
     for file_size, media_files_group in tqdm(size_groups.items(), desc="处理大小组"):
         if len(media_files_group) == 1:
             # 该大小只有一个文件，无需计算哈希，直接处理
@@ -316,9 +460,8 @@ def deduplicate_media_files_byhash(all_media_files: List[Dict[str, Any]], hash_t
             idx = media_counters[dataset_name][media_type]
             suffix = media_file["suffix"]
             
-            # 使用文件大小作为唯一标识（无需计算哈希）
-            size_hash = f"size_{file_size}_{src_path}"
-            unique_files[size_hash] = {
+            # 使用文件大小作为唯一标识（无需计算哈希），不再为每个文件拼接包含完整路径的字符串键
+            unique_files[(file_size, None)] = {
                 "media_type": media_type,
                 "src_path": src_path,
                 "idx": idx,
@@ -331,15 +474,21 @@ def deduplicate_media_files_byhash(all_media_files: List[Dict[str, Any]], hash_t
             path_mapping[src_path] = rel_path
         
         else:
-            # 该大小有多个文件，需要计算哈希去重（使用并发）
-            process_hash_group_concurrent_zip(
-                media_files_group, 
-                media_counters, 
-                unique_files, 
-                path_mapping,
-                max_workers=hash_threads,
-                use_process=use_process
+            # 该大小有多个文件，从流水线中取出本组的哈希结果去重
+            group_tasks = hash_groups[file_size]
+            group_hashes = [
+                cached_hashes[media_file["src_path"]] if media_file["src_path"] in cached_hashes else take_hash(media_file)
+                for media_file in group_tasks
+            ]
+            assign_hash_group(
+                zip(group_tasks, group_hashes),
+                media_counters,
+                unique_files,
+                path_mapping
             )
+    file_hashes.close()
+    if hash_cache is not None:
+        hash_cache.flush()
     
     log(f"📊 媒体文件去重统计:")
     log(f"   原始文件数: {len(all_media_files)}")
@@ -401,44 +550,17 @@ def deduplicate_media_files_by_path(all_media_files: List[Dict[str, Any]]) -> Tu
     return unique_files, path_mapping
 
 
-def process_hash_group_concurrent_zip(media_files_group, media_counters, unique_files, path_mapping, max_workers=16, use_process=False):
-    """并发处理需要计算哈希的文件组（zip专用）"""
+def assign_hash_group(hashed_files, media_counters, unique_files, path_mapping):
+    """对同一大小组内已算出哈希的文件去重并分配编号（zip专用）
     
-    # 准备哈希计算任务
-    hash_tasks = []
-    for media_file in media_files_group:
-        src_path = media_file["src_path"]
-        if Path(src_path).exists():
-            hash_tasks.append(media_file)
-    
-    if not hash_tasks:
-        return
-    
-    worker_type = "进程" if use_process else "线程"
-    log(f"🔧 并发计算 {len(hash_tasks)} 个文件的哈希值 (使用 {min(max_workers, len(hash_tasks))} 个{worker_type})...")
-    
-    # 选择并发计算方式
-    if use_process:
-        # CPU密集型：使用多进程
-        hash_results = compute_hash_for_file_zip_process(
-            hash_tasks,
-            num_workers=min(max_workers, len(hash_tasks))
-        )
-    else:
-        # I/O密集型：使用多线程
-        hash_results = compute_hash_for_file_zip_thread(
-            hash_tasks,
-            num_workers=min(max_workers, len(hash_tasks))
-        )
-    
-    # 处理哈希结果，进行去重
+    Args:
+        hashed_files: 可迭代的 (media_file, file_hash)，哈希失败的文件 file_hash 为 None，直接跳过
+    """
     group_hash_map = {}
-    for result in hash_results:
-        if result["status"] != "success" or not result["file_hash"]:
+    for media_file, file_hash in hashed_files:
+        if not file_hash:
             continue
         
-        file_hash = result["file_hash"]
-        media_file = result["media_file"]
         src_path = media_file["src_path"]
         
         if file_hash not in group_hash_map:
@@ -458,7 +580,7 @@ def process_hash_group_concurrent_zip(media_files_group, media_counters, unique_
                 "original_dataset": dataset_name
             }
             
-            unique_files[file_hash] = group_hash_map[file_hash]
+            unique_files[(media_file["size"], file_hash)] = group_hash_map[file_hash]
             
             rel_path = f"MediaFiles/{media_type}/{idx}{suffix}"
             path_mapping[src_path] = rel_path
@@ -499,9 +621,143 @@ def update_item_paths(item_data: Dict[str, Any], path_mapping: Dict[str, str], *
     }
 
 
+def read_file_range(src_path: str, offset: int, length: int) -> bytes:
+    """读取文件中的一段字节（块级去重的块数据）"""
+    with open(src_path, "rb") as f:
+        data = os.pread(f.fileno(), length, offset)
+    if len(data) != length:
+        raise EOFError(f"读取块数据不完整: {src_path} @ {offset}")
+    return data
+
+
+def chunk_member_info(arcname: str, date_time) -> zipfile.ZipInfo:
+    """块文件成员的 ZipInfo（块不对应单个源文件，使用固定元数据）"""
+    zinfo = zipfile.ZipInfo(arcname, date_time=date_time)
+    zinfo.external_attr = 0o644 << 16
+    return zinfo
+
+
+def write_stored_member(zipf: zipfile.ZipFile, src_path: str, arcname: str, offset: int = None, length: int = None):
+    """以 ZIP_STORED 方式写入单个文件，使用 1MiB 缓冲区流式拷贝
+    
+    zipfile 的写入句柄不是真实 fd，无法用 sendfile，这里以大缓冲区减少 Python 层循环次数；
+    元数据（修改时间、权限）与 ZipFile.write 一致取自源文件。指定 offset 时只写入 [offset, offset+length) 这一块
+    """
+    if offset is not None:
+        zinfo = chunk_member_info(arcname, time.localtime(time.time())[:6])
+        zinfo.file_size = length
+        with zipf.open(zinfo, "w") as dst:
+            dst.write(read_file_range(src_path, offset, length))
+        return
+    
+    zinfo = zipfile.ZipInfo.from_file(src_path, arcname)
+    zinfo.compress_type = zipfile.ZIP_STORED
+    with open(src_path, "rb") as src, zipf.open(zinfo, "w") as dst:
+        shutil.copyfileobj(src, dst, ZIP_COPY_BUFFER_SIZE)
+
+
+def deflate_member(source) -> Tuple[bytes, int, int]:
+    """压缩单个成员（在线程池中执行，zlib 压缩期间释放 GIL）
+    
+    Args:
+        source: 成员内容 bytes、源文件路径，或块数据 (源文件路径, offset, length)
+    Returns:
+        (原始 DEFLATE 数据, CRC32, 原始大小)
+    """
+    if isinstance(source, bytes):
+        data = source
+    elif isinstance(source, tuple):
+        data = read_file_range(*source)
+    else:
+        data = Path(source).read_bytes()
+    compressor = zlib.compressobj(DEFLATE_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+    payload = compressor.compress(data) + compressor.flush()
+    return payload, zlib.crc32(data), len(data)
+
+
+def iter_deflated_members(sources, num_workers):
+    """按输入顺序产出各成员压缩任务的 future，同时在途的任务数不超过 num_workers * 2 以限制内存占用"""
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        pending = deque()
+        for source in sources:
+            pending.append(executor.submit(deflate_member, source))
+            if len(pending) >= num_workers * 2:
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
+
+
+class _PrecompressedFlush:
+    """占位压缩器：数据已提前压缩，关闭成员时无需再输出任何内容"""
+    def flush(self):
+        return b""
+
+
+# write_deflated_member 依赖的 zipfile._ZipWriteFile 私有属性（CPython 3.6 起未变）
+_ZIP_WRITE_FILE_ATTRS = ("_fileobj", "_compressor", "_file_size", "_compress_size", "_crc")
+
+
+def set_compress_level(zinfo: zipfile.ZipInfo, level: int):
+    """设置成员的压缩级别：Python 3.13 起为公开属性 compress_level，此前只有私有的 _compresslevel"""
+    if hasattr(zipfile.ZipInfo, "compress_level"):
+        zinfo.compress_level = level
+    else:
+        zinfo._compresslevel = level
+
+
+def write_deflated_member(zipf: zipfile.ZipFile, zinfo: zipfile.ZipInfo, payload: bytes, crc: int, file_size: int):
+    """写入已压缩好的 DEFLATE 成员
+    
+    zipfile 没有写入原始压缩数据的公开接口：这里通过 zipf.open(zinfo, 'w') 写出本地文件头，
+    直接写入 payload，再回填写入句柄的 CRC 与大小，由其 close() 负责更新文件头和中央目录；
+    写入句柄缺少所需私有属性时（zipfile 实现变化），解压后交给句柄按公开接口重新压缩写入
+    """
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    set_compress_level(zinfo, DEFLATE_LEVEL)
+    zinfo.file_size = file_size
+    with zipf.open(zinfo, "w") as dst:
+        if not all(hasattr(dst, attr) for attr in _ZIP_WRITE_FILE_ATTRS):
+            dst.write(zlib.decompress(payload, -zlib.MAX_WBITS))
+            return
+        dst._fileobj.write(payload)
+        dst._compressor = _PrecompressedFlush()
+        dst._file_size = file_size
+        dst._compress_size = len(payload)
+        dst._crc = crc
+
+
+def write_jsonl_member(zipf: zipfile.ZipFile, arcname: str, lines: List[bytes], date_time):
+    """通过 ZipFile.open('w') 将 jsonl 各行流式压缩写入，不在内存中拼出整个文件
+    
+    行按约 1MiB 攒批后写入以减少压缩器调用次数；预先填入总大小，由 zipfile 自行决定是否启用 zip64
+    """
+    zinfo = zipfile.ZipInfo(arcname, date_time=date_time)
+    zinfo.external_attr = 0o600 << 16
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    set_compress_level(zinfo, DEFLATE_LEVEL)
+    zinfo.file_size = sum(len(line) for line in lines)
+    with zipf.open(zinfo, "w") as dst:
+        batch = []
+        batch_size = 0
+        for line in lines:
+            batch.append(line)
+            batch_size += len(line)
+            if batch_size >= ZIP_COPY_BUFFER_SIZE:
+                dst.write(b"".join(batch))
+                batch = []
+                batch_size = 0
+        if batch:
+            dst.write(b"".join(batch))
+
+
 def create_single_zip_concurrent(zip_info):
-    """并发创建单个zip文件（高性能版本）"""
-    zip_path, files_to_add, jsonl_content, config_content = zip_info
+    """并发创建单个zip文件（高性能版本）
+    
+    jsonl 逐行流式压缩写入；其余需要 DEFLATE 的成员（配置、非预压缩媒体）在线程池中并行压缩后按顺序写入，
+    已压缩的媒体格式随后直接存储；zip_info 可带第五个元素 compress_workers 指定压缩线程数
+    """
+    zip_path, files_to_add, jsonl_content, config_content = zip_info[:4]
+    compress_workers = zip_info[4] if len(zip_info) > 4 else 1
     
     try:
         start_time = time.time()
@@ -510,30 +766,75 @@ def create_single_zip_concurrent(zip_info):
         # 确保目标目录存在
         Path(zip_path).parent.mkdir(parents=True, exist_ok=True)
         
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=1, allowZip64=True) as zipf:
-            # 添加配置文件
-            if config_content:
-                zipf.writestr("dataset_config.yaml", config_content)
+        # 默认不压缩，按成员类型单独指定压缩方式
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_STORED, allowZip64=True) as zipf:
+            date_time = time.localtime(time.time())[:6]
             
             # 添加jsonl文件
-            for jsonl_path, content in jsonl_content.items():
-                zipf.writestr(jsonl_path, content.encode('utf-8'))
+            for jsonl_path, lines in jsonl_content.items():
+                write_jsonl_member(zipf, jsonl_path, lines, date_time)
+            
+            # 需要压缩的成员：(zip内路径, 源文件路径（内存内容为 None）, 内容 bytes 或源文件路径)
+            deflate_members = []
+            if config_content:
+                deflate_members.append(("dataset_config.yaml", None, config_content.encode('utf-8')))
+            
+            stored_files = []
+            for file_info in files_to_add:
+                src_path = file_info["src_path"]
+                if Path(src_path).suffix.lower() in PRECOMPRESSED_SUFFIXES or file_info["size"] > PARALLEL_DEFLATE_MAX_SIZE:
+                    stored_files.append(file_info)
+                elif "offset" in file_info:
+                    deflate_members.append((file_info["zip_path"], src_path, (src_path, file_info["offset"], file_info["size"])))
+                else:
+                    deflate_members.append((file_info["zip_path"], src_path, src_path))
+            
+            processed = 0
+            
+            # 并行压缩，按顺序写入
+            futures = iter_deflated_members((source for _, _, source in deflate_members), compress_workers)
+            for (arcname, src_path, source), future in zip(deflate_members, futures):
+                try:
+                    payload, crc, file_size = future.result()
+                    if src_path is None:
+                        # 与 ZipFile.writestr 一致的默认元数据
+                        zinfo = zipfile.ZipInfo(arcname, date_time=date_time)
+                        zinfo.external_attr = 0o600 << 16
+                    elif isinstance(source, tuple):
+                        zinfo = chunk_member_info(arcname, date_time)
+                    else:
+                        zinfo = zipfile.ZipInfo.from_file(src_path, arcname)
+                    write_deflated_member(zipf, zinfo, payload, crc, file_size)
+                except Exception as e:
+                    if src_path is None:
+                        raise
+                    log(f"⚠️ 添加文件失败 {src_path}: {e}")
+                    continue
+                
+                if src_path is not None:
+                    processed += 1
+                    # 每100个文件显示一次进度
+                    if processed % 100 == 0:
+                        log(f"🔧 {Path(zip_path).name}: 已处理 {processed}/{len(files_to_add)} 个文件")
             
-            # 批量添加媒体文件（优化I/O）
-            for i, file_info in enumerate(files_to_add):
+            # 已压缩的媒体格式直接存储；超大的待压缩文件流式压缩
+            for file_info in stored_files:
                 src_path = file_info["src_path"]
                 zip_path_in_archive = file_info["zip_path"]
                 
                 try:
-                    # 直接写入，减少中间缓存
-                    zipf.write(src_path, zip_path_in_archive)
-                    
-                    # 每100个文件显示一次进度
-                    if (i + 1) % 100 == 0:
-                        log(f"🔧 {Path(zip_path).name}: 已处理 {i+1}/{len(files_to_add)} 个文件")
+                    if Path(src_path).suffix.lower() in PRECOMPRESSED_SUFFIXES:
+                        write_stored_member(zipf, src_path, zip_path_in_archive, file_info.get("offset"), file_info["size"])
+                    else:
+                        zipf.write(src_path, zip_path_in_archive,
+                                   compress_type=zipfile.ZIP_DEFLATED, compresslevel=DEFLATE_LEVEL)
                 except Exception as e:
                     log(f"⚠️ 添加文件失败 {src_path}: {e}")
                     continue
+                
+                processed += 1
+                if processed % 100 == 0:
+                    log(f"🔧 {Path(zip_path).name}: 已处理 {processed}/{len(files_to_add)} 个文件")
         
         elapsed = time.time() - start_time
         log(f"✅ 完成创建: {Path(zip_path).name} ({elapsed:.2f}s)")
@@ -545,50 +846,109 @@ def create_single_zip_concurrent(zip_info):
 
 
 def allocate_files_to_volumes(unique_file_paths, jsonl_data, config_content, max_zip_size):
-    """智能分配文件到不同卷"""
+    """智能分配文件到不同卷（最佳适应递减）
+    
+    文件按大小降序（numpy argsort）依次放入剩余空间最小且仍能容纳它的卷，都放不下时才新开一卷；
+    相比只往最后一卷追加的首次适应，大文件留下的空隙可以被后续小文件填满，分卷数更少
+    """
     volumes = []
-    current_volume = {
-        "files": [],
-        "jsonl": jsonl_data,  # 每个卷都包含完整的JSONL数据
-        "config": config_content,  # 只有第一个卷包含配置
-        "size": 0
-    }
     
     # 计算基础开销（JSONL + config）
-    base_overhead = sum(len(content.encode('utf-8')) for content in jsonl_data.values())
+    base_overhead = sum(len(line) for lines in jsonl_data.values() for line in lines)
     if config_content:
         base_overhead += len(config_content.encode('utf-8'))
     
-    current_volume["size"] = base_overhead
-    
     # 按文件大小排序，大文件优先
-    sorted_files = sorted(unique_file_paths, key=lambda x: x["size"], reverse=True)
+    sizes = np.fromiter((file_info["size"] for file_info in unique_file_paths), dtype=np.int64, count=len(unique_file_paths))
+    free_volumes = []  # 按剩余容量升序排列的 (剩余容量, 卷序号)
     
-    for file_info in sorted_files:
-        file_size = file_info["size"]
+    for file_idx in np.argsort(-sizes, kind="stable"):
+        file_info = unique_file_paths[file_idx]
+        file_size = int(sizes[file_idx])
         
-        # 检查是否需要新卷
-        if current_volume["size"] + file_size > max_zip_size and current_volume["files"]:
-            # 当前卷已满，创建新卷
-            volumes.append(current_volume)
-            current_volume = {
+        # 找到剩余容量最小且能放下该文件的卷
+        pos = bisect.bisect_left(free_volumes, (file_size, -1))
+        if pos < len(free_volumes):
+            remaining, vol_idx = free_volumes.pop(pos)
+        else:
+            # 所有卷都放不下，创建新卷（超过分卷大小的单个文件独占一卷）
+            vol_idx = len(volumes)
+            volumes.append({
                 "files": [],
-                "jsonl": jsonl_data,
-                "config": None,  # 只有第一个卷有配置
+                "jsonl": jsonl_data,  # 每个卷都包含完整的JSONL数据
+                "config": config_content if vol_idx == 0 else None,  # 只有第一个卷包含配置
                 "size": base_overhead
-            }
+            })
+            remaining = max_zip_size - base_overhead
         
-        current_volume["files"].append(file_info)
-        current_volume["size"] += file_size
-    
-    # 添加最后一个卷
-    if current_volume["files"]:
-        volumes.append(current_volume)
+        volume = volumes[vol_idx]
+        volume["files"].append(file_info)
+        volume["size"] += file_size
+        remaining -= file_size
+        if remaining > 0:
+            bisect.insort(free_volumes, (remaining, vol_idx))
     
     return volumes
 
 
-def create_zip_files_streaming_optimized(updated_results, unique_files, output_path, max_zip_size_mb=2048, num_workers=4):
+def chunk_file(file_path):
+    """对单个文件做内容定义分块（FastCDC），返回带 sha256 的块列表"""
+    return list(fastcdc.fastcdc(str(file_path), min_size=CHUNK_AVG_SIZE // 4, avg_size=CHUNK_AVG_SIZE,
+                                max_size=CHUNK_AVG_SIZE * 4, hf=hashlib.sha256))
+
+
+def build_chunk_store(unique_file_paths, num_workers=4):
+    """块级去重：大文件按内容定义分块，相同的块在压缩包内只存储一次
+    
+    块存放在 MediaFiles/chunks/{sha256}.bin，每个被分块的文件生成一个 recipe
+    （{dataset}/MediaFiles/recipes/{media_type}/{idx}{suffix}.json，记录原始大小与块顺序），
+    解压后由 unzip_repath_dataset.py 按 recipe 拼接还原
+    
+    Returns:
+        files_to_add: 替换后的待写入文件列表（未分块的文件 + 唯一块）
+        recipes: {recipe在zip内的路径: recipe json 字符串}
+    """
+    candidates = [fp for fp in unique_file_paths if fp["size"] >= CHUNK_DEDUP_MIN_SIZE]
+    if not candidates:
+        return unique_file_paths, {}
+    
+    files_to_add = [fp for fp in unique_file_paths if fp["size"] < CHUNK_DEDUP_MIN_SIZE]
+    recipes = {}
+    seen_chunks = set()
+    original_size = 0
+    chunk_store_size = 0
+    
+    log(f"🧩 块级去重: 对 {len(candidates)} 个大文件进行内容定义分块...")
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        file_chunks = executor.map(chunk_file, (fp["src_path"] for fp in candidates))
+        for file_info, chunks in tqdm(zip(candidates, file_chunks), total=len(candidates), desc="分块去重"):
+            for chunk in chunks:
+                if chunk.hash in seen_chunks:
+                    continue
+                seen_chunks.add(chunk.hash)
+                files_to_add.append({
+                    "src_path": file_info["src_path"],
+                    "zip_path": f"{CHUNK_STORE_DIR}/{chunk.hash}.bin",
+                    "size": chunk.length,
+                    "offset": chunk.offset,
+                    "file_hash": chunk.hash,
+                    "dataset": file_info["dataset"]
+                })
+                chunk_store_size += chunk.length
+            
+            recipe_path = file_info["zip_path"].replace("/MediaFiles/", "/MediaFiles/recipes/", 1) + ".json"
+            recipes[recipe_path] = json.dumps({
+                "size": file_info["size"],
+                "chunks": [chunk.hash for chunk in chunks]
+            })
+            original_size += file_info["size"]
+    
+    log(f"🧩 块级去重完成: {len(seen_chunks)} 个唯一块，"
+        f"{original_size / (1024 * 1024):.1f} MB → {chunk_store_size / (1024 * 1024):.1f} MB")
+    return files_to_add, recipes
+
+
+def create_zip_files_streaming_optimized(updated_results, unique_files, output_path, max_zip_size_mb=2048, num_workers=4, chunk_dedup=False):
     """优化的流式创建zip文件，支持分卷和并发压缩"""
     max_zip_size = max_zip_size_mb * 1024 * 1024  # 转换为字节
     
@@ -624,20 +984,13 @@ def create_zip_files_streaming_optimized(updated_results, unique_files, output_p
     
     # 生成唯一文件路径列表（简化版）
     unique_file_paths = []
-    dataset_file_counters = defaultdict(lambda: defaultdict(int))  # {dataset: {media_type: count}}
     
-    # 直接从unique_files生成文件路径列表
+    # 直接复用去重阶段分配的 idx，与 path_mapping 写入 jsonl 的路径保持一致，不再重新编号
     for file_hash, info in unique_files.items():
         src_path = info['src_path']
-        media_type = info['media_type']
-        suffix = info['suffix']
         original_dataset = info['original_dataset']
         
-        # 为原始数据集生成文件路径
-        dataset_file_counters[original_dataset][media_type] += 1
-        idx = dataset_file_counters[original_dataset][media_type]
-        
-        zip_path = f"{original_dataset}/MediaFiles/{media_type}/{idx}{suffix}"
+        zip_path = f"{original_dataset}/MediaFiles/{info['media_type']}/{info['idx']}{info['suffix']}"
         unique_file_paths.append({
             "src_path": src_path,
             "zip_path": zip_path,
@@ -646,16 +999,30 @@ def create_zip_files_streaming_optimized(updated_results, unique_files, output_p
             "dataset": original_dataset
         })
     
+    # 块级去重：大文件替换为唯一块 + recipe（recipe 与 jsonl 一样写入每个分卷）
+    recipes = {}
+    if chunk_dedup:
+        unique_file_paths, recipes = build_chunk_store(unique_file_paths, num_workers)
+    
     # 计算总大小
     total_size = sum(fp["size"] for fp in unique_file_paths)
     # 加上配置文件大小（估算）
     config_yaml = yaml.dump(updated_config, default_flow_style=False, allow_unicode=True)
     total_size += len(config_yaml.encode('utf-8'))
+    total_size += sum(len(recipe) for recipe in recipes.values())
     
-    # 加上jsonl文件大小（估算）
-    for dataset_name, items in dataset_results.items():
-        jsonl_size = sum(len(json.dumps(item, ensure_ascii=False)) + 1 for item in items)
-        total_size += jsonl_size
+    # 准备JSONL数据：每条数据只序列化一次，保存为逐行 bytes 列表，压缩时再拼接，
+    # 避免字符串反复拼接以及为估算大小重复序列化
+    jsonl_data = {}  # {zip内路径: [行 bytes]}
+    for (dataset_name, metafile_path), items in file_results.items():
+        original_filename = Path(metafile_path).name
+        jsonl_path = f"{dataset_name}/MetaFiles/{original_filename}"
+        jsonl_data[jsonl_path] = [json_dumps_line(item) for item in items]
+    for recipe_path, recipe in recipes.items():
+        jsonl_data[recipe_path] = [recipe.encode('utf-8')]
+    
+    # 加上jsonl文件大小
+    total_size += sum(len(line) for lines in jsonl_data.values() for line in lines)
     
     total_size_mb = total_size / (1024 * 1024)
     log(f"📊 总数据大小: {total_size_mb:.1f} MB (去重后)")
@@ -668,20 +1035,8 @@ def create_zip_files_streaming_optimized(updated_results, unique_files, output_p
         zip_path = f"{output_path}.zip"
         log(f"📦 创建单个zip文件: {zip_path}")
         
-        # 准备JSONL数据（与分卷版本相同的逻辑）
-        jsonl_data = {}
-        for (dataset_name, metafile_path), items in file_results.items():
-            original_filename = Path(metafile_path).name
-            jsonl_path = f"{dataset_name}/MetaFiles/{original_filename}"
-            
-            jsonl_content = ""
-            for item in items:
-                jsonl_content += json.dumps(item, ensure_ascii=False) + "\n"
-            
-            jsonl_data[jsonl_path] = jsonl_content
-        
         # 使用统一的并发压缩函数
-        zip_info = (zip_path, unique_file_paths, jsonl_data, config_yaml)
+        zip_info = (zip_path, unique_file_paths, jsonl_data, config_yaml, num_workers)
         result = create_single_zip_concurrent(zip_info)
         
         if result["status"] == "success":
@@ -694,26 +1049,15 @@ def create_zip_files_streaming_optimized(updated_results, unique_files, output_p
         # 分卷压缩 - 智能分配 + 并发压缩
         log(f"📦 数据过大，开始智能分卷压缩...")
         
-        # 准备JSONL数据（与单文件版本相同的逻辑）
-        jsonl_data = {}
-        for (dataset_name, metafile_path), items in file_results.items():
-            original_filename = Path(metafile_path).name
-            jsonl_path = f"{dataset_name}/MetaFiles/{original_filename}"
-            
-            jsonl_content = ""
-            for item in items:
-                jsonl_content += json.dumps(item, ensure_ascii=False) + "\n"
-            
-            jsonl_data[jsonl_path] = jsonl_content
-        
         volumes = allocate_files_to_volumes(unique_file_paths, jsonl_data, config_yaml, max_zip_size)
         log(f"📦 智能分配为 {len(volumes)} 个分卷")
         
-        # 准备并发压缩任务
+        # 准备并发压缩任务；分卷之间已并发，剩余线程分给各分卷内部的成员压缩
+        compress_workers = max(1, num_workers // len(volumes))
         zip_tasks = []
         for vol_idx, volume in enumerate(volumes):
             zip_path = f"{output_path}_part{vol_idx + 1}.zip"
-            zip_info = (zip_path, volume["files"], volume["jsonl"], volume["config"])
+            zip_info = (zip_path, volume["files"], volume["jsonl"], volume["config"], compress_workers)
             zip_tasks.append(zip_info)
         
         # 并发压缩所有分卷
@@ -749,8 +1093,12 @@ def create_zip_files_streaming_optimized(updated_results, unique_files, output_p
         return zip_paths
 
 
-def process_datasets(yaml_path, save_dir, max_zip_size_mb=2048, num_workers=16, use_process=False):
-    """主处理函数 - 分阶段并发安全处理"""
+def process_datasets(yaml_path, save_dir, max_zip_size_mb=2048, num_workers=16, use_process=False, chunk_dedup=False, dedup_by_hash=False, hash_cache_path=""):
+    """主处理函数 - 分阶段并发安全处理
+
+    dedup_by_hash 为 True 时按文件内容哈希去重，否则按路径去重；
+    hash_cache_path 非空时哈希去重通过该 sqlite 缓存复用上次运行的哈希值
+    """
     yaml_path = Path(yaml_path)
     save_dir = Path(save_dir)
     save_dir.mkdir(parents=True, exist_ok=True)
@@ -760,8 +1108,8 @@ def process_datasets(yaml_path, save_dir, max_zip_size_mb=2048, num_workers=16,
     output_path = save_dir / output_name
     
     # 阶段1: 收集所有数据项
-    log("📋 阶段1: 收集数据项...")
-    all_items, dataset_config = collect_all_data_items(yaml_path)
+    log(f"📋 阶段1: 收集数据项 (使用 {num_workers} 个进程)...")
+    all_items, dataset_config = collect_all_data_items(yaml_path, num_workers)
     log(f"📋 共找到 {len(all_items)} 个数据项")
     
     if not all_items:
@@ -786,7 +1134,15 @@ def process_datasets(yaml_path, save_dir, max_zip_size_mb=2048, num_workers=16,
     if args.need_deduplicate:    
         worker_type = "多进程" if use_process else "多线程"
         log(f"🔄 阶段3: 媒体文件去重（{worker_type}）...")
-        unique_files, path_mapping = deduplicate_media_files_by_path(all_media_files)
+        if dedup_by_hash:
+            hash_cache = None
+            if hash_cache_path:
+                # 摘要为 get_file_hash_fast 的完整十六进制摘要，算法名与其实际使用的哈希保持一致
+                hash_algo = "xxh3_128" if xxhash is not None else ("blake3" if blake3 is not None else "md5")
+                hash_cache = HashCache(os.path.expanduser(hash_cache_path), algo=hash_algo)
+            unique_files, path_mapping = deduplicate_media_files_byhash(all_media_files, num_workers, use_process, hash_cache=hash_cache)
+        else:
+            unique_files, path_mapping = deduplicate_media_files_by_path(all_media_files)
     
         #阶段4：并行更新每个item的路径（多线程）
         log(f"📝 阶段4: 并行更新item路径 (使用 {num_workers} 个线程)...")
@@ -797,7 +1153,10 @@ def process_datasets(yaml_path, save_dir, max_zip_size_mb=2048, num_workers=16,
     
     # 阶段5: 流式创建zip文件
     log("📦 阶段5: 开始流式压缩...")
-    zip_files = create_zip_files_streaming_optimized(updated_results, unique_files, str(output_path), max_zip_size_mb, num_workers)
+    if chunk_dedup and fastcdc is None:
+        log("⚠️ 未安装 fastcdc（pip install '.[chunk-dedup]'），忽略 --chunk_dedup，按整文件存储")
+        chunk_dedup = False
+    zip_files = create_zip_files_streaming_optimized(updated_results, unique_files, str(output_path), max_zip_size_mb, num_workers, chunk_dedup)
     
     log(f"🎉 完成！共处理 {len(updated_results)} 个数据项")
     log(f"📁 输出文件: {', '.join(zip_files)}")
@@ -813,6 +1172,11 @@ if __name__ == "__main__":
     parser.add_argument('--num_workers', type=int, default=16, help="并发线程数")
     parser.add_argument('--use_process', action='store_true', help="使用多进程进行哈希计算（CPU密集型优化）")
     parser.add_argument('--need_deduplicate', type=bool, default= True, help="是否进行重复media文件去重")
+    parser.add_argument('--chunk_dedup', action='store_true', help="对大媒体文件做块级去重（需要 fastcdc，可通过 pip install '.[chunk-dedup]' 安装），解压时由 unzip_repath_dataset.py 还原")
+    parser.add_argument('--dedup_by_hash', action='store_true', help="按文件内容哈希去重（默认按路径去重）")
+    parser.add_argument('--hash_cache', type=str, default="", help="哈希去重时跨运行缓存哈希值的 sqlite 文件路径（默认: 不使用缓存）")
     
     args = parser.parse_args()
-    process_datasets(args.datasets_yaml, args.save_dir, args.max_zip_size, args.num_workers, args.use_process)
+    if args.hash_cache and not args.dedup_by_hash:
+        log("⚠️ 未指定 --dedup_by_hash，按路径去重不计算哈希，--hash_cache 不生效")
+    process_datasets(args.datasets_yaml, args.save_dir, args.max_zip_size, args.num_workers, args.use_process, args.chunk_dedup, args.dedup_by_hash, args.hash_cache)
@@ -1,25 +1,34 @@
-# 图片类型
-IMAGE_MIME_TYPES = {
-    'jpg': 'image/jpeg',
-    'jpeg': 'image/jpeg',
-    'png': 'image/png',
-    'gif': 'image/gif',
-    'webp': 'image/webp',
-    'bmp': 'image/bmp',
-    'tiff': 'image/tiff'
-}
-
-# 常见HTML标签列表（可根据需要扩展）
-HTML_TAGS = [
-    'a', 'abbr', 'address', 'area', 'article', 'aside', 'audio', 'b', 'base', 'bdi', 'bdo', 'blockquote', 'body',
-    'br', 'button', 'canvas', 'caption', 'cite', 'code', 'col', 'colgroup', 'data', 'datalist', 'dd', 'del', 'details',
-    'dfn', 'dialog', 'div', 'dl', 'dt', 'em', 'embed', 'fieldset', 'figcaption', 'figure', 'footer', 'form', 'h1', 'h2',
-    'h3', 'h4', 'h5', 'h6', 'head', 'header', 'hr', 'html', 'i', 'iframe', 'img', 'input', 'ins', 'kbd', 'label', 'legend',
-    'li', 'link', 'main', 'map', 'mark', 'meta', 'meter', 'nav', 'noscript', 'object', 'ol', 'optgroup', 'option', 'output',
-    'p', 'param', 'picture', 'pre', 'progress', 'q', 'rp', 'rt', 'ruby', 's', 'samp', 'script', 'section', 'select', 'small',
-    'source', 'span', 'strong', 'style', 'sub', 'summary', 'sup', 'svg', 'table', 'tbody', 'td', 'template', 'textarea',
-    'tfoot', 'th', 'thead', 'time', 'title', 'tr', 'track', 'u', 'ul', 'var', 'video', 'wbr'
-]
+import sys
+from types import MappingProxyType
+
+# 图片类型（同一 MIME 类型共用一个驻留字符串；只读视图，防止调用方修改共享常量）
+_JPEG = sys.intern('image/jpeg')
+IMAGE_MIME_TYPES = MappingProxyType({
+    'jpg': _JPEG,
+    'jpeg': _JPEG,
+    'png': sys.intern('image/png'),
+    'gif': sys.intern('image/gif'),
+    'webp': sys.intern('image/webp'),
+    'bmp': sys.intern('image/bmp'),
+    'tiff': sys.intern('image/tiff')
+})
+# 支持的图片扩展名（成员判断 O(1)）
+IMAGE_EXTENSIONS = frozenset(IMAGE_MIME_TYPES)
+# MIME 类型 → 扩展名（多个扩展名对应同一类型时取第一个，如 image/jpeg → jpg）
+MIME_TO_EXT = MappingProxyType({mime: ext for ext, mime in reversed(IMAGE_MIME_TYPES.items())})
+
+# 常见HTML标签（可根据需要扩展）；HTML_TAGS_ORDERED 保持固定顺序，用于拼接正则等需要稳定顺序的场景
+HTML_TAGS_ORDERED = tuple(
+    "a abbr address area article aside audio b base bdi bdo blockquote body br button canvas caption cite code col "
+    "colgroup data datalist dd del details dfn dialog div dl dt em embed fieldset figcaption figure footer form h1 "
+    "h2 h3 h4 h5 h6 head header hr html i iframe img input ins kbd label legend li link main map mark meta meter "
+    "nav noscript object ol optgroup option output p param picture pre progress q rp rt ruby s samp script section "
+    "select small source span strong style sub summary sup svg table tbody td template textarea tfoot th thead time "
+    "title tr track u ul var video wbr"
+    .split()
+)
+# 仅用于成员判断（tag in HTML_TAGS），哈希查找 O(1)
+HTML_TAGS = frozenset(HTML_TAGS_ORDERED)
 
 
 # 答案抽取 prompt
@@ -112,5 +121,25 @@ Result: (只给出最终选项，不要添加无关的描述，否则你将受
 '''
 
 
+def _split_prompt(prompt):
+    """在导入时把 prompt 模板按 {answer} 切成前后两段（并还原 {{ }} 转义），渲染时只需拼接字符串"""
+    prefix, suffix = prompt.split('{answer}')
+    return tuple(part.replace('{{', '{').replace('}}', '}') for part in (prefix, suffix))
+
+
+_EXTRACT_ANSWER_PARTS = _split_prompt(EXTRACT_ANSWER_PROMPT)
+_EXTRACT_OPTION_ANSWER_PARTS = _split_prompt(EXTRACT_OPTION_ANSWER_PROMPT)
+
+
+def render_extract_answer(answer: str) -> str:
+    """等价于 EXTRACT_ANSWER_PROMPT.format(answer=answer)"""
+    return _EXTRACT_ANSWER_PARTS[0] + answer + _EXTRACT_ANSWER_PARTS[1]
+
+
+def render_extract_option_answer(answer: str) -> str:
+    """等价于 EXTRACT_OPTION_ANSWER_PROMPT.format(answer=answer)"""
+    return _EXTRACT_OPTION_ANSWER_PARTS[0] + answer + _EXTRACT_OPTION_ANSWER_PARTS[1]
+
+
 
 
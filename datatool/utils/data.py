@@ -1,61 +1,405 @@
 import os
 import re
 import sys
+import json
+import mmap
+import hashlib
 import yaml
 import pickle as pkl
 import random
+import queue
+import threading
+import multiprocessing
 
+from array import array
 from glob import glob
-from copy import deepcopy
+from collections import defaultdict
 from omegaconf import OmegaConf
 from typing import List, Literal, Tuple, Union
 import base64
 from PIL import Image
 from io import BytesIO
-from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 import time
+import numpy as np
 
 from datatool.logger import log
 from datatool.utils.parallel import post_allocated_multiprocess, post_allocated_multithread, dynamic_task_pool_multiprocess
-from datatool.utils.file_io import load_jsonlines, save_jsonlines_mpi, save_jsonlines, \
-    load_video_bytes_base64, load_audio_bytes_base64, load_image_base64_with_type
+from datatool.utils.file_io import iter_jsonlines, save_jsonlines, get_file_lock, \
+    load_video_bytes_base64, load_audio_bytes_base64, load_image_base64_with_type, load_file_base64
 
+# 已处理 id 的哈希优先使用 xxh3_64，未安装时回退到 hashlib.blake2b
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
 
-def _build_tasks_for_one_file(args):
-    """纯函数：给定一个 metafile，返回该文件的所有 task 列表"""
-    metafile, target_metafile, dataset_name, skip_processed_items = args
-    tasks = []
-    
-    # 1. 已处理 id 集合
-    processed_items = set()
-    if os.path.exists(target_metafile):
-        if skip_processed_items:
+
+# 已处理 id 的旁路文件后缀：与目标 jsonl 同时追加写入，断点续跑时只需读取 id，不必解析整个目标文件
+# 旁路文件每批 id 之后跟一行 `#<目标文件字节数>`，只有与目标文件当前大小一致时才可信，见 _sidecar_target_size
+IDS_SIDECAR_SUFFIX = ".ids"
+
+
+def _sidecar_target_size(sidecar):
+    """读取旁路文件末尾记录的目标文件字节数；文件不存在或末行不是 `#<字节数>`（写入中断）时返回 None"""
+    try:
+        with open(sidecar, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            f.seek(max(0, size - 32))
+            tail = f.read()
+    except OSError:
+        return None
+    if not tail.endswith(b'\n'):
+        return None
+    last = tail[:-1].rsplit(b'\n', 1)[-1]
+    if not last.startswith(b'#'):
+        return None
+    try:
+        return int(last[1:])
+    except ValueError:
+        return None
+
+
+class _WriterBuffer:
+    """按目标文件缓存待追加的 jsonl 行，攒够一批后加文件锁一次性写入
+
+    替代逐条调用 save_jsonlines_mpi：每条数据一次的 加锁/打开/写入/关闭 摊薄到整批数据上。
+    多线程共用一个实例；多进程时每个进程持有 fork 得到的独立副本，由 worker_finalizer 在进程退出前 flush_all
+    同一把锁内还会把每条数据的 id（json 编码，每行一个）追加到 {save_path}.ids，见 _load_processed_ids
+    攒满的批次交给后台写线程落盘，worker 不必等待写入完成即可继续处理下一条数据；写线程在首次写出时按进程懒启动
+    """
+    # 后台写线程最多积压的批次数，积压满后 add 阻塞，限制内存占用
+    MAX_QUEUED_BATCHES = 8
+
+    def __init__(self, flush_size=512, max_pending=65536):
+        self.flush_size = flush_size      # 单个文件攒够多少行写一次
+        self.max_pending = max_pending    # 所有文件合计缓存行数上限，超过后全部写出
+        self._lines = defaultdict(list)   # {save_path: [(行 bytes, id 行 bytes 或 None)]}
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._queue = None                # 待写出的批次：(save_path, lines)，None 表示写线程退出
+        self._thread = None
+        self._thread_pid = None           # 写线程所属进程，fork 出的子进程需要另起写线程
+        self._error = None                # 写线程中的异常，由 flush_all 抛出
+
+    def add(self, save_path, data):
+        line = (json.dumps(data, ensure_ascii=False) + "\n").encode("utf-8")
+        id_line = None
+        if isinstance(data, dict) and "id" in data:
+            id_line = (json.dumps(data["id"], ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            lines = self._lines[save_path]
+            lines.append((line, id_line))
+            self._pending += 1
+            if self._pending >= self.max_pending:
+                batches, self._lines, self._pending = self._lines, defaultdict(list), 0
+            elif len(lines) >= self.flush_size:
+                batches = {save_path: self._lines.pop(save_path)}
+                self._pending -= len(lines)
+            else:
+                return
+            # 在锁内入队，保证不会排在 flush_all 的退出标记之后
+            self._ensure_writer()
+            for path, batch in batches.items():
+                self._queue.put((path, batch))
+
+    def flush_all(self):
+        """写出所有缓存数据并等待后台写线程结束"""
+        with self._lock:
+            batches, self._lines, self._pending = self._lines, defaultdict(list), 0
+            thread, q = self._thread, self._queue
+            if self._thread_pid != os.getpid():
+                thread = q = None
+            self._thread = self._queue = self._thread_pid = None
+        if q is not None:
+            q.put(None)
+            thread.join()
+        for path, batch in batches.items():
+            self._write(path, batch)
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def _ensure_writer(self):
+        # 调用方已持有 self._lock
+        if self._thread_pid == os.getpid():
+            return
+        self._queue = queue.Queue(maxsize=self.MAX_QUEUED_BATCHES)
+        self._thread = threading.Thread(target=self._writer_loop, args=(self._queue,), daemon=True)
+        self._thread_pid = os.getpid()
+        self._thread.start()
+
+    def _writer_loop(self, q):
+        while True:
+            item = q.get()
+            if item is None:
+                return
             try:
-                processed_items = {item["id"] for item in load_jsonlines(target_metafile)}
+                self._write(*item)
             except Exception as e:
-                log(f"Warn loading processed items from {target_metafile}: {e}")
-        else:
-            processed_items = set()
+                log(f"写入 {item[0]} 失败: {e}", level=log.ERROR)
+                self._error = e
+
+    @staticmethod
+    def _write(save_path, lines):
+        os.makedirs(os.path.dirname(save_path), exist_ok=True)
+        sidecar = save_path + IDS_SIDECAR_SUFFIX
+        with get_file_lock(save_path):
+            # 目标文件不存在时重建旁路文件；目标文件已存在时，只有旁路文件记录的大小与之一致才继续追加，
+            # 否则（旧版本写出的、写入中断、目标文件被其他方式改写过）旁路文件无法覆盖已有 id，直接删除
+            if not os.path.exists(save_path):
+                sidecar_mode = "wb"
+            elif _sidecar_target_size(sidecar) == os.path.getsize(save_path):
+                sidecar_mode = "ab"
+            else:
+                sidecar_mode = None
+                remove_file(sidecar)
+            # 先写目标文件再写旁路文件：中途失败时旁路文件记录的大小与目标文件不符，读取时回退到完整扫描
+            with open(save_path, "ab") as fp:
+                fp.write(b"".join(line for line, _ in lines))
+                target_size = fp.tell()
+            if sidecar_mode is not None:
+                with open(sidecar, sidecar_mode) as fp:
+                    fp.write(b"".join(id_line for _, id_line in lines if id_line is not None))
+                    fp.write(b"#%d\n" % target_size)
+
+
+# 行内第一个键是字符串 id（最常见的情况）时直接用正则取出，不必完整解析整行 json
+_LEADING_ID_RE = re.compile(rb'\s*\{\s*"id"\s*:\s*"([^"\\]*)"')
+
+
+def _iter_scanned_ids(path):
+    """只扫描 jsonl 文件每行的 id 字段，逐个产出 id
+
+    mmap 整个文件逐行查找；正则匹配不到（id 不在首位、含转义字符或非字符串）时才回退到 json 解析该行，
+    空行和无法解析的行跳过
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = 0
+            while start < size:
+                end = mm.find(b'\n', start)
+                if end == -1:
+                    end = size
+                match = _LEADING_ID_RE.match(mm, start, end)
+                if match:
+                    yield match.group(1).decode('utf-8')
+                else:
+                    line = mm[start:end]
+                    if line.strip():
+                        try:
+                            item_id = json.loads(line)["id"]
+                        except Exception:
+                            item_id = None
+                        if item_id is not None:
+                            yield item_id
+                start = end + 1
+
+
+def _scan_ids(path):
+    """返回 jsonl 文件中所有 id 的集合（用于跳过已处理的数据）"""
+    return set(_iter_scanned_ids(path))
+
+
+def _iter_processed_ids(target_metafile):
+    """逐个产出目标文件中已处理的 id（可能有重复）
+
+    旁路文件 {target_metafile}.ids 末尾记录的大小与目标文件一致时直接读取（每行一个 json 编码的 id），
+    否则（不存在、写入中断、目标文件被删除或被其他方式改写过）回退到 _iter_scanned_ids 扫描目标文件；
+    旁路文件中途解析失败时也改为扫描目标文件，已产出的 id 会再产出一次
+    """
+    sidecar = target_metafile + IDS_SIDECAR_SUFFIX
+    try:
+        use_sidecar = _sidecar_target_size(sidecar) == os.path.getsize(target_metafile)
+    except OSError:
+        use_sidecar = False
+    if use_sidecar:
+        try:
+            with open(sidecar, 'rb') as f:
+                for line in f:
+                    line = line.rstrip(b'\n')
+                    # 不含转义字符的字符串 id 直接去掉引号解码；# 开头的是目标文件大小记录
+                    if line.startswith(b'"') and b'\\' not in line:
+                        yield line[1:-1].decode('utf-8')
+                    elif line and not line.startswith(b'#'):
+                        yield json.loads(line)
+            return
+        except (OSError, ValueError):
+            pass
+    yield from _iter_scanned_ids(target_metafile)
+
+
+def _load_processed_ids(target_metafile):
+    """读取目标文件中已处理的 id 集合"""
+    return set(_iter_processed_ids(target_metafile))
+
+
+def _id_hash(item_id):
+    """id 的 64 位哈希；字符串与其他类型的 id 加不同前缀，避免 "1" 与 1 撞在一起"""
+    key = ("s" + item_id if isinstance(item_id, str) else "j" + json.dumps(item_id, ensure_ascii=False)).encode("utf-8")
+    if xxhash is not None:
+        return xxhash.xxh3_64_intdigest(key)
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+
+def _load_processed_id_hashes(target_metafile):
+    """读取目标文件中已处理 id 的 64 位哈希，返回排序去重后的 np.uint64 数组
 
+    每个 id 只占 8 字节（Python set[str] 每条约 100 字节），几千万条已处理数据也不会占满内存；
+    两个不同 id 哈希相同的概率约为 已处理条数 / 2**64，可以忽略
+    """
+    hashes = np.fromiter(map(_id_hash, _iter_processed_ids(target_metafile)), dtype=np.uint64)
+    return np.unique(hashes)
+
+
+def _build_tasks_for_one_file(args):
+    """纯函数：给定一个 metafile，返回该文件中所有待处理 item 的字节区间
+
+    只回传紧凑的 array('q')（[offset0, length0, offset1, length1, ...]），不再把整条 item dict
+    pickle 回主进程；处理时由 _read_task_item 按区间从 metafile 中读出该行
+    """
+    metafile, target_metafile, dataset_name, skip_processed_items = args
     
-    # 2. 读该文件全部 item
+    # 1. 已处理 id 的哈希
+    processed_hashes = None
+    if skip_processed_items and os.path.exists(target_metafile):
+        try:
+            processed_hashes = _load_processed_id_hashes(target_metafile)
+        except Exception as e:
+            log(f"Warn loading processed items from {target_metafile}: {e}")
+    if processed_hashes is not None and len(processed_hashes) == 0:
+        processed_hashes = None
+
+    # 2. 逐行流式扫描该文件，记录每个 item 的字节区间（空行和无法解析的行跳过）
+    # 首个键是字符串 id 时用 _LEADING_ID_RE 直接取出，不完整解析整行：该行只在处理时由 _read_task_item 解析一次，
+    # 其余部分损坏的行届时记录日志并跳过；匹配不到时才回退到 json 解析该行
+    spans = array('q')
+    hashes = array('Q')
     try:
-        all_items = load_jsonlines(metafile)
+        offset = 0
+        with open(metafile, 'rb') as f:
+            for line in f:
+                length = len(line)
+                match = _LEADING_ID_RE.match(line)
+                if match:
+                    item_id = match.group(1).decode('utf-8')
+                elif line.strip():
+                    try:
+                        item = json.loads(line)
+                    except ValueError:
+                        offset += length
+                        continue
+                    # 与原先一致：缺少 id 的 item 直接报错，id 为 null 的 item 照常处理
+                    if not isinstance(item, dict) or "id" not in item:
+                        raise KeyError(f"item without id in {metafile} at offset {offset}")
+                    item_id = item["id"]
+                else:
+                    offset += length
+                    continue
+                spans.append(offset)
+                spans.append(length)
+                if processed_hashes is not None:
+                    hashes.append(_id_hash(item_id))
+                offset += length
+    except KeyError:
+        raise
     except Exception as e:
         log(f"Error loading {metafile}: {e}")
-        return tasks
-    
-    # 3. 生成 task
-    for item in all_items:
-        if item["id"] not in processed_items:
-            tasks.append([
-                item,
-                metafile,          # src_path
-                target_metafile,   # save_path
-                dataset_name
-            ])
-    return tasks
+        return array('q')
+
+    # 3. 批量剔除已处理的 item
+    if processed_hashes is not None and len(hashes):
+        keep = ~np.isin(np.frombuffer(hashes, dtype=np.uint64), processed_hashes)
+        spans = array('q', np.frombuffer(spans, dtype=np.int64).reshape(-1, 2)[keep].tobytes())
+    return spans
+
+
+def _iter_file_tasks(spans, metafile, target_metafile, dataset_name):
+    """把 _build_tasks_for_one_file 返回的字节区间展开为 task：(src_path, offset, length, save_path, dataset_name)"""
+    for i in range(0, len(spans), 2):
+        yield (metafile, spans[i], spans[i + 1], target_metafile, dataset_name)
+
+
+def _scan_one_file(args):
+    """_build_tasks_for_one_file 的 imap_unordered 包装：连同文件信息一起返回，(metafile, target_metafile, dataset_name, spans)"""
+    metafile, target_metafile, dataset_name, _ = args
+    return metafile, target_metafile, dataset_name, _build_tasks_for_one_file(args)
+
+
+# 扫描 metafile 的进程数上限
+SCAN_PROCESSES = 8
+
+
+def _new_scan_pool(job_args):
+    """创建扫描 metafile 的进程池，需在主线程中、启动其他线程之前调用
+
+    子进程全部在创建时 fork 出来，且不设置 maxtasksperchild：进程池之后不会再从后台线程中 fork 新进程，
+    避免主进程已有多个线程（如 post_allocated_multiprocess 的填充线程、队列写入线程）时 fork 导致死锁
+    """
+    return multiprocessing.Pool(processes=max(1, min(SCAN_PROCESSES, len(job_args))))
+
+
+def _imap_scanned_files(job_args, pool=None):
+    """用进程池 imap_unordered 并行扫描各 metafile，按完成顺序逐个产出 _scan_one_file 的结果
+
+    结果取出即交给调用方，进程池不保留已完成任务的结果；
+    在其他线程中迭代时需传入预先在主线程中由 _new_scan_pool 创建的 pool
+    """
+    if not job_args:
+        return
+    if pool is None:
+        with _new_scan_pool(job_args) as pool:
+            yield from _imap_scanned_files(job_args, pool)
+        return
+    processes = min(SCAN_PROCESSES, len(job_args))
+    chunksize = max(1, min(16, len(job_args) // (processes * 4)))
+    yield from pool.imap_unordered(_scan_one_file, job_args, chunksize=chunksize)
+
+
+def _iter_collected_tasks(job_args, target_metafile_list, pool=None):
+    """并行扫描各 metafile，每扫描完一个文件立即产出其中的 task（生成器，不汇总全部 task）
+
+    有待处理数据的目标文件路径会追加到 target_metafile_list 中；pool 见 _imap_scanned_files
+    """
+    for metafile, target_metafile, dataset_name, spans in _imap_scanned_files(job_args, pool):
+        if spans:
+            target_metafile_list.append(target_metafile)
+        yield from _iter_file_tasks(spans, metafile, target_metafile, dataset_name)
+
+
+def _read_task_item(src_path, offset, length):
+    """按字节区间从 metafile 中读出单条 item（每次读到的都是新 dict，无需再 deepcopy）
+
+    该区间无法读取或解析时（收集任务后源文件被改动）记录日志并返回 None，由调用方跳过
+    """
+    try:
+        with open(src_path, 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.read(length))
+    except Exception as e:
+        log(f"skip unreadable item in {src_path} at offset {offset}: {e}", level=log.WARNING)
+        return None
+
+def _count_lines(path):
+    """统计文件行数：按 1MiB 分块读取并在 bytes 上计数换行符，不做 utf-8 解码；末行没有换行符时也计入"""
+    count = 0
+    last_chunk = b''
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                count += chunk.count(b'\n')
+                last_chunk = chunk
+    except Exception as e:
+        log(f"[统计] 统计 {path} 失败: {e}")
+        return None
+    if last_chunk and not last_chunk.endswith(b'\n'):
+        count += 1
+    return count
+
 
 def remove_file(path):
     try:
@@ -67,6 +411,168 @@ def remove_file(path):
     return False
 
 
+# yaml 配置解析缓存：{路径: (mtime_ns, 解析结果)}
+_YAML_CACHE = {}
+
+
+def _fast_yaml_load(path):
+    """读取数据集 yaml 配置，返回普通 dict（调用方只读，不要修改）
+
+    用 libyaml 的 CSafeLoader 解析，不构造 OmegaConf 的 DictConfig；按 (路径, mtime) 缓存，
+    同一次运行中收集任务和统计结果时不再重复解析。含 ${...} 插值时仍交给 OmegaConf 解析
+    """
+    path = os.path.abspath(path)
+    mtime_ns = os.stat(path).st_mtime_ns
+    cached = _YAML_CACHE.get(path)
+    if cached is not None and cached[0] == mtime_ns:
+        return cached[1]
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    if "${" in text:
+        config = OmegaConf.to_container(OmegaConf.create(text), resolve=True)
+    else:
+        config = yaml.load(text, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+    _YAML_CACHE[path] = (mtime_ns, config)
+    return config
+
+
+# 小于该字节数的 metafile 额外读一遍确认不是只有空白字符，更大的文件按大小直接视为非空
+_SMALL_METAFILE_SIZE = 4096
+
+
+def _iter_jsonl_files(root):
+    """用 os.scandir 递归遍历 root 下的 .jsonl 文件（同 glob，跳过隐藏文件与目录），产出 (路径, 文件大小)
+
+    DirEntry 自带文件类型，遍历目录时不必对每个条目再 stat 一次
+    """
+    stack = [root]
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    if entry.is_dir():
+                        stack.append(entry.path)
+                    elif entry.name.endswith('.jsonl') and entry.is_file():
+                        yield entry.path, entry.stat().st_size
+                except OSError:
+                    continue
+
+
+def _is_empty_metafile(metafile, size):
+    if size == 0:
+        return True
+    if size >= _SMALL_METAFILE_SIZE:
+        return False
+    with open(metafile, 'rb') as f:
+        return not f.read().strip()
+
+
+def _discover_metafiles(dataset_yaml_path, dst_metafiles_name):
+    """读取 yaml 中各数据集的 MetaFiles 目录，收集所有非空 metafile 及其目标文件路径
+
+    目标文件位于 MetaFiles 同级的 dst_metafiles_name 目录下，保持相对路径不变
+
+    Returns:
+        list: [(metafile, target_metafile, dataset_name)]；dst_metafiles_name 与某个 MetaFiles 目录同名时返回 None
+    """
+    all_metafiles_info = []
+    dataset_config = _fast_yaml_load(dataset_yaml_path)
+    for dataset_name, config in dataset_config["Datasets"].items():
+        metafile_dir = config["MetaFiles"]
+        # 检查目标目录
+        if dst_metafiles_name == os.path.basename(metafile_dir):
+            log(f"{dst_metafiles_name} has existed, please use a new metafile dirname.", level=log.ERROR)
+            return None
+        if not os.path.isdir(metafile_dir):
+            log(f"skip metafile_dir not exist: {metafile_dir}")
+            continue
+        target_dir = os.path.join(os.path.dirname(metafile_dir), dst_metafiles_name)
+        for metafile, size in sorted(_iter_jsonl_files(metafile_dir)):
+            try:
+                if _is_empty_metafile(metafile, size):
+                    log(f"skip empty metafile: {metafile}")
+                    continue
+            except Exception as e:
+                log(f"skip invalid metafile: {metafile}, error: {e}")
+                continue
+            target_metafile = os.path.join(target_dir, os.path.relpath(metafile, metafile_dir))
+            all_metafiles_info.append((metafile, target_metafile, dataset_name))
+    return all_metafiles_info
+
+
+def _find_lock_files(dirs):
+    """递归收集 dirs 下所有 *.jsonl.lock 文件
+
+    先去掉位于其他目录之下的子目录，每棵子树只 os.walk 一次
+    """
+    roots = []
+    for d in sorted(set(os.path.normpath(d) for d in dirs)):
+        if roots and (d == roots[-1] or d.startswith(roots[-1].rstrip(os.sep) + os.sep)):
+            continue
+        roots.append(d)
+
+    lock_files = []
+    for root in roots:
+        if not os.path.isdir(root):
+            log(f"目录不存在，跳过: {root}")
+            continue
+        def _on_error(e, root=root):
+            log(f"搜索目录 {root} 锁文件报错: {e}", level=log.WARNING)
+        count = len(lock_files)
+        for dirpath, _, filenames in os.walk(root, onerror=_on_error):
+            lock_files.extend(os.path.join(dirpath, name) for name in filenames if name.endswith(".jsonl.lock"))
+        log(f"找到 {len(lock_files) - count} 个锁文件 in {root}")
+    return lock_files
+
+
+# 删除锁文件的线程数：unlink 只是一次系统调用，期间释放 GIL，线程数不受 CPU 核数限制
+LOCK_UNLINK_WORKERS = 64
+
+
+def _unlink_lock_file(path):
+    try:
+        os.unlink(path)
+        return True
+    except FileNotFoundError:
+        return False
+    except Exception as e:
+        log(f"删除文件 {path} 失败: {e}", level=log.WARNING)
+        return False
+
+
+def _remove_lock_files(lock_files):
+    """多线程并发删除锁文件，返回实际删除的文件数"""
+    total_removed = 0
+    with ThreadPoolExecutor(max_workers=min(LOCK_UNLINK_WORKERS, len(lock_files))) as executor:
+        for i, removed in enumerate(executor.map(_unlink_lock_file, lock_files), 1):
+            total_removed += removed
+            if i % 1000 == 0:
+                log(f"已删除 {i} 个锁文件...")
+    return total_removed
+
+
+def _delete_target_metafiles(all_metafiles_info):
+    """skip_processed_items=False 时，主进程先行删除已存在的目标文件（及其 id 旁路文件），统一打日志"""
+    deleted_count = 0
+    for _, target_metafile, _ in all_metafiles_info:
+        if os.path.exists(target_metafile):
+            log(f"delete {target_metafile}")
+            try:
+                os.remove(target_metafile)
+                deleted_count += 1
+            except Exception as e:
+                log(f"failed to delete {target_metafile}: {e}", level=log.WARNING)
+        remove_file(target_metafile + IDS_SIDECAR_SUFFIX)
+    if deleted_count:
+        log(f"deleted {deleted_count} existing target metafiles before collection")
+
+
 def process_metafiles_hook(dataset_yaml_path,
                            hook_func,
                            dst_metafiles_name=None,
@@ -95,6 +601,7 @@ def process_metafiles_hook(dataset_yaml_path,
         hook_func (function): 钩子函数迭代器，该函数接收一个字典类型的参数，将需要保存的数据以迭代器形式返回
         dst_metafiles_name (str): 新数据存储目录的名称，若为 None，则原地修改原始文件
         skip_processed_items (bool, optional): 是否跳过已经处理过的数据。若为 False，将会删除已处理过的数据。Defaults to True
+            目标文件旁会保留 `{目标文件}.ids`（已写出的 id 列表），用于下次续跑时快速跳过已处理数据，可随时删除
         write_mode (Literal['item', 'file'], optional): 写入模式，'item'表示逐行处理并写入，'file'表示批量处理整个文件后写入。Defaults to 'item'
         num_workers (int, optional): 多进程的 worker 数量。Defaults to 1
     """
@@ -104,8 +611,8 @@ def process_metafiles_hook(dataset_yaml_path,
         # 加载已处理过的数据
         if os.path.exists(save_path) and skip_processed_items:
             if write_mode == "item":
-                processed_items = set([item["id"] for item in load_jsonlines(save_path)])
-                log(f"found {processed_items} items in caches.")
+                processed_items = _load_processed_ids(save_path)
+                log(f"found {len(processed_items)} items in caches.")
             else:
                 # 跳过已处理完的文件
                 log(f"skip {save_path} due to processed cache.")
@@ -113,22 +620,26 @@ def process_metafiles_hook(dataset_yaml_path,
         else:
             if os.path.exists(save_path):
                 os.remove(save_path)
+            remove_file(save_path + IDS_SIDECAR_SUFFIX)
             processed_items = set()
         all_new_data = []
+        writer = _WriterBuffer()
         log(f"Processing {src_path}...")
-        for item in load_jsonlines(src_path):
+        # iter_jsonlines 每次都解析出新的 dict，且每条数据只交给钩子一次，无需 deepcopy
+        for item in iter_jsonlines(src_path):
             if item["id"] in processed_items:
                 continue
             for new_data in hook_func(
-                    deepcopy(item), 
+                    item, 
                     dataset_name=dataset_name,
                     src_path=src_path,
                     **hook_kwargs
                 ):
                 if write_mode == "item":
-                    save_jsonlines([new_data], save_path, mode="a")
+                    writer.add(save_path, new_data)
                 else:
                     all_new_data.append(new_data)
+        writer.flush_all()
         if write_mode != "item" and len(all_new_data) > 0:
             save_jsonlines(all_new_data, save_path, mode="w")
         return None
@@ -138,40 +649,14 @@ def process_metafiles_hook(dataset_yaml_path,
 
     assert write_mode in ['item', 'file'], f"write_mode should be in ['item', 'file'], but got {write_mode}"
 
-    all_tasks = []
-    dataset_config = OmegaConf.load(dataset_yaml_path)
-    for dataset_name, config in dataset_config["Datasets"].items():
-        metafile_dir = config["MetaFiles"]
-        if not os.path.exists(metafile_dir):
-            log(f"skip metafile_dir not exist: {metafile_dir}")
-            continue
-        all_metafiles = glob(
-            os.path.join(metafile_dir, "**", "*.jsonl"), recursive=True)
-        # 增加当前数据集下的所有文件任务
-        if dst_metafiles_name == os.path.basename(metafile_dir):
-            log(f"{dst_metafiles_name} has existed, please use a new metafile dirname.", level=log.ERROR)
-            return
-        for metafile in all_metafiles:
-            try:
-                with open(metafile, 'r', encoding='utf-8') as f:
-                    has_valid_line = False
-                    for line in f:
-                        line = line.strip()
-                        if line:
-                            has_valid_line = True
-                            break
-                if not has_valid_line:
-                    log(f"skip empty metafile: {metafile}")
-                    continue
-            except Exception as e:
-                log(f"skip invalid metafile: {metafile}, error: {e}")
-                continue
-            all_tasks.append([
-                dataset_name,
-                metafile, 
-                os.path.join(os.path.dirname(metafile_dir),
-                            dst_metafiles_name, os.path.relpath(metafile, metafile_dir))
-            ])
+    all_metafiles_info = _discover_metafiles(dataset_yaml_path, dst_metafiles_name)
+    if all_metafiles_info is None:
+        return
+    # 增加所有数据集下的所有文件任务
+    all_tasks = [
+        [dataset_name, metafile, target_metafile]
+        for metafile, target_metafile, dataset_name in all_metafiles_info
+    ]
     log(f"Found {len(all_tasks)} metafiles in all.")
     _process(all_tasks, num_workers=num_workers)
     log("Done.")
@@ -182,121 +667,72 @@ def _process_yaml_items(dataset_yaml_path, hook_func, dst_metafiles_name, skip_p
     """
     处理yaml配置，item级并行
     """
+    # fork 后每个工作进程各自持有一份缓冲区，进程退出前由 worker_finalizer 写出剩余数据
+    writer = _WriterBuffer()
+
     @post_allocated_multiprocess
     def _process(task, **kwargs):
-        item, src_path, save_path, dataset_name = task
-        for new_data in hook_func(deepcopy(item), 
+        src_path, offset, length, save_path, dataset_name = task
+        item = _read_task_item(src_path, offset, length)
+        if item is None:
+            return None
+        for new_data in hook_func(item, 
                                   dataset_name=dataset_name, 
                                   src_path=src_path,
                                   save_path=save_path,
                                   **hook_kwargs):
-            save_jsonlines_mpi([new_data], save_path, mode="a")
+            writer.add(save_path, new_data)
         return None
-    # 时间点：任务收集阶段
-    task_collection_start = time.time()
-    all_tasks = [] # 每个 item 一个任务
     target_metafile_list = []
-    dataset_config = OmegaConf.load(dataset_yaml_path)
-# 🚀 优化1: 预收集所有metafile信息，避免重复计算
-    all_metafiles_info = []
-    for dataset_name, config in dataset_config["Datasets"].items():
-        metafile_dir = config["MetaFiles"]
-        all_metafiles = glob(
-            os.path.join(metafile_dir, "**", "*.jsonl"), recursive=True)
-        
-        # 检查目标目录
-        if dst_metafiles_name == os.path.basename(metafile_dir):
-            log(f"{dst_metafiles_name} has existed, please use a new metafile dirname.", level=log.ERROR)
-            return
-        
-        # 预收集metafile信息
-        for metafile in all_metafiles:
-            if os.path.exists(metafile):
-                target_metafile = metafile.replace(
-                    metafile_dir, 
-                    os.path.join(os.path.dirname(metafile_dir), dst_metafiles_name)
-                )
-                all_metafiles_info.append((metafile, target_metafile, dataset_name))
-    
+    # 🚀 优化1: 预收集所有metafile信息，避免重复计算
+    all_metafiles_info = _discover_metafiles(dataset_yaml_path, dst_metafiles_name)
+    if all_metafiles_info is None:
+        return
     log(f"Found {len(all_metafiles_info)} metafiles to process")
-    
+
     # 当不跳过已处理项时，主进程先行删除已存在的目标文件，统一打日志
     if not skip_processed_items:
-        deleted_count = 0
-        for _, target_metafile, _ in all_metafiles_info:
-            target_dir = os.path.dirname(target_metafile)
-            if not os.path.exists(target_dir):
-                continue
-            if os.path.exists(target_metafile):
-                log(f"delete {target_metafile}")
-                try:
-                    os.remove(target_metafile)
-                    deleted_count += 1
-                except Exception as e:
-                    log(f"failed to delete {target_metafile}: {e}", level=log.WARNING)
-        if deleted_count:
-            log(f"deleted {deleted_count} existing target metafiles before collection")
+        _delete_target_metafiles(all_metafiles_info)
     
-    # 🚀 优化2: 并行收集任务，充分利用多核CPU
+    # 🚀 优化2: 并行收集任务，边收集边处理
+    # 每扫描完一个 metafile 就把其中的 task 送入工作进程，不再先汇总全部 task；
+    # 收集与处理重叠，主进程内存占用只与数据队列长度有关
+    log("Collecting and processing tasks in parallel ...")
+    job_args = [
+        (metafile, target_metafile, dataset_name, skip_processed_items)
+        for metafile, target_metafile, dataset_name in all_metafiles_info
+    ]
     
-    # 并行收集任务
-    log("Collecting tasks in parallel ...")
-    with ProcessPoolExecutor(max_workers=min(8, len(all_metafiles_info))) as ex:
-        # 先把参数拍平
-        job_args = [
-            (metafile, target_metafile, dataset_name, skip_processed_items)
-            for metafile, target_metafile, dataset_name in all_metafiles_info
-        ]
-        # 提交
-        future_to_file = {ex.submit(_build_tasks_for_one_file, arg): arg[0] for arg in job_args}
-        
-        # 添加进度条显示并行收集进度
-        with tqdm(total=len(job_args), desc="Collecting tasks") as pbar:
-            for fut in as_completed(future_to_file):
-                file_tasks = fut.result()
-                all_tasks.extend(file_tasks)
-                
-                # 同时收集target_metafile_list
-                if file_tasks:
-                    # 从第一个task中获取target_metafile
-                    target_metafile = file_tasks[0][2]  # save_path
-                    target_metafile_list.append(target_metafile)
-                
-                pbar.update(1)
-                pbar.set_postfix({"total_tasks": len(all_tasks)})
-        
-        log(f"Collected {len(all_tasks)} tasks from {len(all_metafiles_info)} files")
-    
-    task_collection_time = time.time() - task_collection_start
-    log(f"[PERF-MAIN] Task collection took: {task_collection_time:.3f}s")
-    log(f"Found {len(all_tasks)} items in all metafiles.")
-
     # 多进程方式获取每条数据的 predicts
     execution_start = time.time()
     log(f"[PERF-MAIN] Starting ProcessPoolExecutor with {num_workers} workers...")
-    _process(all_tasks, num_workers=min(num_workers, len(all_tasks)))
+    # 扫描进程池在主线程中、工作进程与填充线程启动之前创建，扫描本身在填充线程中进行
+    with _new_scan_pool(job_args) as scan_pool:
+        results = _process(_iter_collected_tasks(job_args, target_metafile_list, scan_pool),
+                           num_workers=num_workers, worker_finalizer=writer.flush_all)
     execution_time = time.time() - execution_start
+    log(f"Processed {len(results)} items from {len(all_metafiles_info)} files")
     log(f"[PERF-MAIN] ProcessPool execution took: {execution_time:.3f}s")
-    log(f"[PERF-MAIN] Average time per task: {execution_time/len(all_tasks):.3f}s")
+    log(f"[PERF-MAIN] Average time per task: {execution_time/max(1, len(results)):.3f}s")
     log("Done.")
 
-    # 统计所有生成的数据条数
+    # 统计所有生成的数据条数（按字节统计换行符，多线程并行）
     total_count = 0
     folder_counts = {}
+    dataset_config = _fast_yaml_load(dataset_yaml_path)
     for dataset_name, config in dataset_config["Datasets"].items():
         metafile_dir = config["MetaFiles"]
         if dst_metafiles_name is not None:
             save_root = os.path.join(os.path.dirname(metafile_dir), dst_metafiles_name)
+            file_paths = [
+                os.path.join(root, file)
+                for root, dirs, files in os.walk(save_root)
+                for file in files if file.endswith('.jsonl')
+            ]
             folder_count = 0
-            for root, dirs, files in os.walk(save_root):
-                for file in files:
-                    if file.endswith('.jsonl'):
-                        file_path = os.path.join(root, file)
-                        try:
-                            count = sum(1 for _ in open(file_path, 'r', encoding='utf-8'))
-                            folder_count += count
-                        except Exception as e:
-                            log(f"[统计] 统计 {file_path} 失败: {e}")
+            if file_paths:
+                with ThreadPoolExecutor(max_workers=min(16, len(file_paths))) as executor:
+                    folder_count = sum(count for count in executor.map(_count_lines, file_paths) if count is not None)
             folder_counts[save_root] = folder_count
             total_count += folder_count
     for folder, count in folder_counts.items():
@@ -314,23 +750,7 @@ def _process_yaml_items(dataset_yaml_path, hook_func, dst_metafiles_name, skip_p
     log(f"需要清理锁文件的目录数量: {len(unique_dirs)}")
     
     # 收集所有锁文件
-    all_lock_files = []
-    for target_metafile_dir in unique_dirs:
-        if not os.path.exists(target_metafile_dir):
-            log(f"目录不存在，跳过: {target_metafile_dir}")
-            continue
-        try:
-            locks = glob(
-                os.path.join(target_metafile_dir, "**", "*.jsonl.lock"), recursive=True
-            )
-            if locks:
-                all_lock_files.extend(locks)
-                log(f"找到 {len(locks)} 个锁文件 in {target_metafile_dir}")
-            else:
-                log(f"不存在锁文件 in {target_metafile_dir}")
-                return
-        except Exception as e:
-            log(f"搜索目录 {target_metafile_dir} 锁文件报错: {e}", level=log.WARNING)
+    all_lock_files = _find_lock_files(unique_dirs)
 
     log(f"待删除锁文件总数: {len(all_lock_files)}")
     
@@ -338,14 +758,7 @@ def _process_yaml_items(dataset_yaml_path, hook_func, dst_metafiles_name, skip_p
         return
 
     # 多线程并发删除文件
-    total_removed = 0
-    with ThreadPoolExecutor(max_workers=min(4, len(all_lock_files))) as executor:
-        futures = {executor.submit(remove_file, f): f for f in all_lock_files}
-        for i, future in enumerate(as_completed(futures), 1):
-            if future.result():
-                total_removed += 1
-            if i % 1000 == 0:
-                log(f"已删除 {i} 个锁文件...")
+    total_removed = _remove_lock_files(all_lock_files)
 
     log(f"锁文件清理完成，共删除 {total_removed} 个文件")
     log("Done.")
@@ -379,32 +792,27 @@ def process_items_hook_multithreads(dataset_yaml_path,
         hook_func (function): 钩子函数迭代器，该函数接收一个字典类型的参数，将需要保存的数据以迭代器形式返回
         dst_metafiles_name (str): 新数据存储目录的名称，若为 None，则原地修改原始文件
         skip_processed_items (bool, optional): 是否跳过已经处理过的数据。若为 False，将会删除已处理过的数据。Defaults to True
+            目标文件旁会保留 `{目标文件}.ids`（已写出的 id 列表），用于下次续跑时快速跳过已处理数据，可随时删除
         num_workers (int, optional): 多线程的 worker 数量。Defaults to 1
     """
-    def single_process(task):
-        item, src_path, save_path, dataset_name = task
-        for new_data in hook_func(
-                deepcopy(item), 
-                src_path=src_path,
-                save_path=save_path,
-                dataset_name=dataset_name,
-                **hook_kwargs
-            ):
-            if new_data:
-                save_jsonlines_mpi([new_data], save_path, mode="a")
-        return None
+    # 所有线程共用一个缓冲区，全部任务完成后在主线程写出剩余数据
+    writer = _WriterBuffer()
+
     @post_allocated_multithread
     def _process(task, **kwargs):
-        item, src_path, save_path, dataset_name = task
+        src_path, offset, length, save_path, dataset_name = task
+        item = _read_task_item(src_path, offset, length)
+        if item is None:
+            return None
         for new_data in hook_func(
-                deepcopy(item), 
+                item, 
                 src_path=src_path,
                 save_path=save_path,
                 dataset_name=dataset_name,
                 **hook_kwargs
             ):
             if new_data:
-                save_jsonlines_mpi([new_data], save_path, mode="a")
+                writer.add(save_path, new_data)
         return None
         
     if not os.path.exists(dataset_yaml_path):
@@ -414,80 +822,41 @@ def process_items_hook_multithreads(dataset_yaml_path,
     task_collection_start = time.time()
     all_tasks = [] # 每个 item 一个任务
     target_metafile_list = []
-    dataset_config = OmegaConf.load(dataset_yaml_path)
-    
+
     # 🚀 优化1: 预收集所有metafile信息，避免重复计算
-    all_metafiles_info = []
-    for dataset_name, config in dataset_config["Datasets"].items():
-        metafile_dir = config["MetaFiles"]
-        all_metafiles = glob(
-            os.path.join(metafile_dir, "**", "*.jsonl"), recursive=True)
-        
-        # 检查目标目录
-        if dst_metafiles_name == os.path.basename(metafile_dir):
-            log(f"{dst_metafiles_name} has existed, please use a new metafile dirname.", level=log.ERROR)
-            return
-        
-        # 预收集metafile信息
-        for metafile in all_metafiles:
-            if os.path.exists(metafile):
-                target_metafile = metafile.replace(
-                    metafile_dir, 
-                    os.path.join(os.path.dirname(metafile_dir), dst_metafiles_name)
-                )
-                all_metafiles_info.append((metafile, target_metafile, dataset_name))
-    
+    all_metafiles_info = _discover_metafiles(dataset_yaml_path, dst_metafiles_name)
+    if all_metafiles_info is None:
+        return
     log(f"Found {len(all_metafiles_info)} metafiles to process")
-    
+
     # 当不跳过已处理项时，主进程先行删除已存在的目标文件，统一打日志
     if not skip_processed_items:
-        deleted_count = 0
-        for _, target_metafile, _, _ in all_metafiles_info:
-            target_dir = os.path.dirname(target_metafile)
-            if not os.path.exists(target_dir):
-                continue
-            if os.path.exists(target_metafile):
-                log(f"delete {target_metafile}")
-                try:
-                    os.remove(target_metafile)
-                    deleted_count += 1
-                except Exception as e:
-                    log(f"failed to delete {target_metafile}: {e}", level=log.WARNING)
-        if deleted_count:
-            log(f"deleted {deleted_count} existing target metafiles before collection")
+        _delete_target_metafiles(all_metafiles_info)
     
     # 🚀 优化2: 并行收集任务，充分利用多核CPU
     
     # 并行收集任务
     log("Collecting tasks in parallel ...")
-    with ProcessPoolExecutor(max_workers=min(8, len(all_metafiles_info))) as ex:
-        # 先把参数拍平
-        job_args = [
-            (metafile, target_metafile, dataset_name, skip_processed_items)
-            for metafile, target_metafile, dataset_name in all_metafiles_info
-        ]
-        # 提交
-        future_to_file = {ex.submit(_build_tasks_for_one_file, arg): arg[0] for arg in job_args}
-        # 汇总
-        # all_tasks = []
-        target_metafile_list = []
-        
-        # 添加进度条显示并行收集进度
-        with tqdm(total=len(job_args), desc="Collecting tasks") as pbar:
-            for fut in as_completed(future_to_file):
-                file_tasks = fut.result()
-                all_tasks.extend(file_tasks)
-                
-                # 同时收集target_metafile_list
-                if file_tasks:
-                    # 从第一个task中获取target_metafile
-                    target_metafile = file_tasks[0][2]  # save_path
-                    target_metafile_list.append(target_metafile)
-                
-                pbar.update(1)
-                pbar.set_postfix({"total_tasks": len(all_tasks)})
-        
-        log(f"Collected {len(all_tasks)} tasks from {len(all_metafiles_info)} files")
+    # 先把参数拍平
+    job_args = [
+        (metafile, target_metafile, dataset_name, skip_processed_items)
+        for metafile, target_metafile, dataset_name in all_metafiles_info
+    ]
+    target_metafile_list = []
+
+    # 添加进度条显示并行收集进度
+    with tqdm(total=len(job_args), desc="Collecting tasks") as pbar:
+        for metafile, target_metafile, dataset_name, spans in _imap_scanned_files(job_args):
+            all_tasks.extend(_iter_file_tasks(spans, metafile, target_metafile, dataset_name))
+
+            # 同时收集target_metafile_list
+            if spans:
+                target_metafile_list.append(target_metafile)
+
+            pbar.update(1)
+            pbar.set_postfix({"total_tasks": len(all_tasks)})
+
+    log(f"Collected {len(all_tasks)} tasks from {len(all_metafiles_info)} files")
     
     task_collection_time = time.time() - task_collection_start
     log(f"[PERF-MAIN] Task collection took: {task_collection_time:.3f}s")
@@ -498,13 +867,7 @@ def process_items_hook_multithreads(dataset_yaml_path,
     log(f"[PERF-MAIN] Starting ThreadPoolExecutor with {num_workers} workers...")
     execution_start = time.time()
     _process(all_tasks, num_workers=min(num_workers, len(all_tasks)))
-
-    # with ThreadPoolExecutor(max_workers=num_workers) as pool:
-    #     futures = {pool.submit(single_process, sample): sample for sample in all_tasks}
-    #     # 添加进度条
-    #     with tqdm(total=len(all_tasks), desc="Processing") as pbar:
-    #         for _ in as_completed(futures):
-    #             pbar.update(1)
+    writer.flush_all()
     
     execution_time = time.time() - execution_start
     log(f"[PERF-MAIN] ProcessPool execution took: {execution_time:.3f}s")
@@ -521,34 +884,14 @@ def process_items_hook_multithreads(dataset_yaml_path,
     log(f"需要清理锁文件的目录数量: {len(unique_dirs)}")
     
     # 收集所有锁文件
-    all_lock_files = []
-    for target_metafile_dir in unique_dirs:
-        if not os.path.exists(target_metafile_dir):
-            log(f"目录不存在，跳过: {target_metafile_dir}")
-            continue
-        try:
-            locks = glob(
-                os.path.join(target_metafile_dir, "**", "*.jsonl.lock"), recursive=True
-            )
-            if locks:
-                all_lock_files.extend(locks)
-                log(f"找到 {len(locks)} 个锁文件 in {target_metafile_dir}")
-        except Exception as e:
-            log(f"搜索目录 {target_metafile_dir} 锁文件报错: {e}", level=log.WARNING)
+    all_lock_files = _find_lock_files(unique_dirs)
 
     log(f"待删除锁文件总数: {len(all_lock_files)}")
 
     # 多线程并发删除文件
-    total_removed = 0
     if len(all_lock_files) == 0:
         return
-    with ThreadPoolExecutor(max_workers=min(16, len(all_lock_files))) as executor:
-        futures = {executor.submit(remove_file, f): f for f in all_lock_files}
-        for i, future in enumerate(as_completed(futures), 1):
-            if future.result():
-                total_removed += 1
-            if i % 1000 == 0:
-                log(f"已删除 {i} 个锁文件...")
+    total_removed = _remove_lock_files(all_lock_files)
 
     log(f"锁文件清理完成，共删除 {total_removed} 个文件")
     log("Done.")
@@ -570,7 +913,7 @@ def process_data_hook(dataset_path,
         dataset_path: 数据集路径
         hook_func: 钩子函数
         dst_metafiles_name: 目标文件夹名称
-        skip_processed_items: 是否跳过已处理过的数据，默认True
+        skip_processed_items: 是否跳过已处理过的数据，默认True；续跑依赖目标文件旁的 `{目标文件}.ids`，删除后回退为扫描目标文件
         num_workers: 并行进程/线程数
         parallel_level: "item"（默认，单条数据并行）或"file"（文件级并行）
         parallel_type: "process"（多进程，默认）或"thread"（多线程）
@@ -620,21 +963,19 @@ def get_image_base64(image_path, new_width=None, new_height=None):
   function: 本地图片路径转化成url
   image_path: str 图片路径
   """
-  # 读取图片
-  with open(image_path, "rb") as img:
-    # 调整图片尺寸
-    if new_width and new_height:
-      with Image.open(image_path, "r") as img:
-          img = img.resize((new_width, new_height))
-          img = img.convert("RGB")
-          # 将图片保存到字节流中，而不是文件中
-          buffered = BytesIO()
-          img.save(buffered, format="JPEG")
-
-      # 获取Base64编码
-      base64_encoded = base64.b64encode(buffered.getvalue()).decode('utf-8')
-    else:
-      base64_encoded = base64.b64encode(img.read()).decode("utf-8")
+  # 调整图片尺寸
+  if new_width and new_height:
+    with Image.open(image_path, "r") as img:
+        img = img.resize((new_width, new_height))
+        img = img.convert("RGB")
+        # 将图片保存到字节流中，而不是文件中
+        buffered = BytesIO()
+        img.save(buffered, format="JPEG")
+
+    # 获取Base64编码
+    base64_encoded = base64.b64encode(buffered.getbuffer()).decode('ascii')
+  else:
+    base64_encoded = load_file_base64(image_path)
 
   # 构建data URL
   base64_url = f"data:image/jpeg;base64,{base64_encoded}"
@@ -643,8 +984,7 @@ def get_image_base64(image_path, new_width=None, new_height=None):
 
 # 提取视频
 def get_video_base64(video_path):
-    with open(video_path, 'rb') as video_file:
-        video_base = base64.b64encode(video_file.read()).decode('utf-8')
+    video_base = load_file_base64(video_path)
     base64_url = f"data:image/jpeg;base64,{video_base}"
     return base64_url
 
@@ -657,6 +997,30 @@ def replace_media_path(path, source_dir, target_dir):
         return path.replace(source_dir, target_dir, 1)
     return path
 
+# 对话文本中的多媒体占位符
+_MEDIA_RE = re.compile(r'<(image|video|audio)>')
+
+
+def _image_content_base64(path):
+    img64, img_type = load_image_base64_with_type(path)
+    return {"type": "image_url", "image_url": {"url": f"data:{img_type};base64,{img64}"}}
+
+def _video_content_base64(path):
+    return {"type": "video_url", "video_url": {"url": f"data:video/mp4;base64,{load_video_bytes_base64(path)}"}}
+
+def _audio_content_base64(path):
+    return {"type": "input_audio", "audio_url": {"url": f"data:audio/ogg;base64,{load_audio_bytes_base64(path)}"}}
+
+# load_message_from_data 中各类占位符对应的 content 构造函数：{media_to_base64: {媒体类型: func(path)}}
+_MEDIA_CONTENT_BUILDERS = {
+    True: {"image": _image_content_base64, "video": _video_content_base64, "audio": _audio_content_base64},
+    False: {
+        "image": lambda path: {"type": "image_url", "image_url": {"url": path}},
+        "video": lambda path: {"type": "video_url", "video_url": {"url": path}},
+        "audio": lambda path: {"type": "input_audio", "input_audio": {"url": path}},
+    },
+}
+
 def load_message_from_data(
         meta_item, 
         load_media: bool = True, 
@@ -672,11 +1036,13 @@ def load_message_from_data(
     """
     import uuid
     messages = []
-    images = meta_item.get('images', [])
-    videos = meta_item.get('videos', [])
-    audios = meta_item.get('audios', [])
-
-    image_idx, video_idx, audio_idx = 0, 0, 0
+    # 各类多媒体按占位符出现的顺序依次取用（跨轮次），用完后多出的占位符直接丢弃
+    media_iters = {
+        "image": iter(meta_item.get('images') or []),
+        "video": iter(meta_item.get('videos') or []),
+        "audio": iter(meta_item.get('audios') or []),
+    }
+    builders = _MEDIA_CONTENT_BUILDERS[bool(media_to_base64)]
 
     conversations = meta_item['messages']
     if system_prompt is not None:
@@ -687,42 +1053,16 @@ def load_message_from_data(
         conv_text = conv['content']
 
         if role == 'user':
-            last_idx = 0
-            for match in re.finditer(r'<(image|video|audio)>', conv_text):
-                media_type = match.group(1)
-                start, end = match.span()
-                if start > last_idx:
-                    content.append({"type": "text", "text": conv_text[last_idx:start]})
-                if media_type == "image" and image_idx < len(images):
-                    img_path = replace_media_path(images[image_idx], source_dir, target_dir)
-                    if load_media:
-                        if media_to_base64:
-                            img64, img_type = load_image_base64_with_type(img_path)
-                            content.append({"type": "image_url", "image_url": {"url": f"data:{img_type};base64,{img64}"}})
-                        else:
-                            content.append({"type": "image_url", "image_url": {"url": img_path}})
-                    image_idx += 1
-                elif media_type == "video" and video_idx < len(videos):
-                    vid_path = replace_media_path(videos[video_idx], source_dir, target_dir)
-                    if load_media:
-                        if media_to_base64:
-                            vid64 = load_video_bytes_base64(vid_path)
-                            content.append({"type": "video_url", "video_url": {"url": f"data:video/mp4;base64,{vid64}"}})
-                        else:
-                            content.append({"type": "video_url", "video_url": {"url": vid_path}})
-                    video_idx += 1
-                elif media_type == "audio" and audio_idx < len(audios):
-                    aud_path = replace_media_path(audios[audio_idx], source_dir, target_dir)
-                    if load_media:
-                        if media_to_base64:
-                            aud64 = load_audio_bytes_base64(aud_path)
-                            content.append({"type": "input_audio", "audio_url": {"url": f"data:audio/ogg;base64,{aud64}"}})
-                        else:
-                            content.append({"type": "input_audio", "input_audio": {"url": aud_path}})
-                    audio_idx += 1
-                last_idx = end
-            if last_idx < len(conv_text):
-                content.append({"type": "text", "text": conv_text[last_idx:]})
+            # split 得到 [文本, 媒体类型, 文本, 媒体类型, ..., 文本]，空文本不输出
+            parts = _MEDIA_RE.split(conv_text)
+            if parts[0]:
+                content.append({"type": "text", "text": parts[0]})
+            for media_type, text in zip(parts[1::2], parts[2::2]):
+                path = next(media_iters[media_type], None)
+                if path is not None and load_media:
+                    content.append(builders[media_type](replace_media_path(path, source_dir, target_dir)))
+                if text:
+                    content.append({"type": "text", "text": text})
             messages.append({"role": role, "content": content})
         elif role == 'system':
             content = [{"type": "text", "text": conv_text}]
@@ -769,7 +1109,7 @@ def load_media_item(path: str, media_type: str, load_media: bool, media_to_base6
 
 
 def remove_media_tags(text):
-    return re.sub(r'<(image|video|audio)>', '', text)
+    return _MEDIA_RE.sub('', text)
 
 
 
@@ -827,7 +1167,7 @@ def process_turn_hook(dataset_path,
     initial_tasks = []
     
     if ext in ['.yaml', '.yml']:
-        dataset_config = OmegaConf.load(dataset_path)
+        dataset_config = _fast_yaml_load(dataset_path)
         
         for dataset_name, config in dataset_config["Datasets"].items():
             metafile_dir = config["MetaFiles"]
@@ -865,7 +1205,7 @@ def process_turn_hook(dataset_path,
                 if os.path.exists(target_metafile):
                     if skip_processed_items:
                         try:
-                            processed_items = {item["id"] for item in load_jsonlines(target_metafile)}
+                            processed_items = _load_processed_ids(target_metafile)
                             log(f"Found {len(processed_items)} processed items in {target_metafile}")
                         except Exception as e:
                             log(f"Error loading processed items from {target_metafile}: {e}")
@@ -877,8 +1217,9 @@ def process_turn_hook(dataset_path,
                             log(f"✅ Deleted: {target_metafile}")
                         except Exception as e:
                             log(f"⚠️ Failed to delete {target_metafile}: {e}", level=log.WARNING)
+                        remove_file(target_metafile + IDS_SIDECAR_SUFFIX)
                 
-                for item in load_jsonlines(metafile):
+                for item in iter_jsonlines(metafile):
                     if item["id"] not in processed_items:
                         try:
                             initial_task = prepare_initial_tasks_func(
@@ -937,7 +1278,7 @@ def process_turn_hook(dataset_path,
     # 删除临时锁文件
     log("Cleaning up lock files...")
     if ext in ['.yaml', '.yml']:
-        dataset_config = OmegaConf.load(dataset_path)
+        dataset_config = _fast_yaml_load(dataset_path)
         for dataset_name, config in dataset_config["Datasets"].items():
             metafile_dir = config["MetaFiles"]
             target_dir = os.path.join(os.path.dirname(metafile_dir), dst_metafiles_name)
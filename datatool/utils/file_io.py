@@ -2,6 +2,7 @@ import io
 import os
 import json
 import math
+import mmap
 import uuid
 import base64
 import hashlib
@@ -35,15 +36,15 @@ def save_jsonlines(data, save_path, mode="w"):
     if len(data) == 0:
         log(f"Warning: data is empty, skip saving for {save_path}")
         return
+    if isinstance(data, dict):
+        data = [data]
+    elif not isinstance(data, list):
+        raise TypeError("data must be list or dict")
     os.makedirs(os.path.dirname(save_path), exist_ok=True)
-    with jsonlines.open(save_path, mode) as fp:
-        if isinstance(data, list):
-            for c_data in data:
-                fp.write(c_data)
-        elif isinstance(data, dict):
-            fp.write(data)
-        else:
-            raise TypeError("data must be list or dict")
+    # 整批序列化后一次写入，避免逐条 write 的调用与编码开销
+    buf = "".join(json.dumps(c_data, ensure_ascii=False) + "\n" for c_data in data).encode("utf-8")
+    with open(save_path, mode + "b") as fp:
+        fp.write(buf)
 
 def save_metafiles(data, output_dir, chunk_size=1000):
     for i in range(0, len(data), chunk_size):
@@ -52,9 +53,19 @@ def save_metafiles(data, output_dir, chunk_size=1000):
         output_file = os.path.join(output_dir, f"meta_{file_index:06d}.jsonl")
         save_jsonlines(chunk, output_file)
 
+# {file_path: FileLock}，每个进程按目标文件复用同一个锁对象，fork 出的子进程各自持有一份
+_LOCK_CACHE = {}
+
+def get_file_lock(file_path):
+    """返回 file_path 对应的文件锁（锁文件为 `{file_path}.lock`），同一进程内按路径缓存复用"""
+    lock = _LOCK_CACHE.get(file_path)
+    if lock is None:
+        lock = _LOCK_CACHE.setdefault(file_path, FileLock(f"{file_path}.lock"))
+    return lock
+
 def save_jsonlines_mpi(new_data, file_path, mode="a"):
-    # 创建文件锁，锁文件名可以是原文件名加上 `.lock`
-    lock = FileLock(f"{file_path}.lock")
+    # 锁文件名为原文件名加上 `.lock`
+    lock = get_file_lock(file_path)
 
     # 使用文件锁，确保只有一个进程可以访问该文件
     with lock:
@@ -85,6 +96,18 @@ def load_jsonlines(src_pathes):
     return data
 
 
+def iter_jsonlines(src_path):
+    """逐行流式读取 jsonl 文件，每次产出一条数据；空行和无法解析的行跳过（与 load_jsonlines 的结果一致，但不把整个文件读入内存）"""
+    with open(src_path, "rb") as fp:
+        for line in fp:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except Exception:
+                continue  # 跳过无法解析的行
+
+
 def load_pickle(file_path):
     try:
         with open(file_path, 'rb') as f:
@@ -112,8 +135,8 @@ def save_pickle(data, file_path, mode="w"):
         pkl.dump(data, fp)
 
 def save_pickle_mpi(new_data, file_path, mode="a"):
-    # 创建文件锁，锁文件名可以是原文件名加上 `.lock`
-    lock = FileLock(f"{file_path}.lock")
+    # 锁文件名为原文件名加上 `.lock`
+    lock = get_file_lock(file_path)
 
     # 使用文件锁，确保只有一个进程可以访问该文件
     with lock:
@@ -131,6 +154,17 @@ def load_image_bytes(image_path):
     with open(image_path, "rb") as f:
         return f.read()
 
+def load_file_base64(file_path):
+    """将本地文件内容编码为 base64 字符串
+
+    mmap 映射文件后直接交给 b64encode，不再额外读出一份完整的 bytes，大视频文件可省下与文件等大的内存峰值
+    """
+    with open(file_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ""
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return base64.b64encode(mm).decode("ascii")
+
 def save_image_bytes(img_bytes, dst_image_path):
     with open(dst_image_path, "wb") as fp:
         fp.write(img_bytes)
@@ -171,6 +205,9 @@ def load_image_base64(image, new_width=None, new_height=None):
     elif isinstance(image, str) and image.startswith("data:image/"):
         image_data = base64.b64decode(image.split(",")[1])
     elif isinstance(image, str) and os.path.isfile(image):
+        if new_width is None and new_height is None:
+            # 不缩放时直接对映射的文件内容编码，不读出完整 bytes
+            return load_file_base64(image)
         image_data = load_image_bytes(image)
     else:
         raise ValueError("Invalid image path or data.")
@@ -271,8 +308,7 @@ def load_video_bytes_base64(video_path):
             response.raise_for_status()
             return base64.b64encode(response.content).decode("utf-8")
     else:
-        with open(video_path, 'rb') as video_file:
-            return base64.b64encode(video_file.read()).decode('utf-8')
+        return load_file_base64(video_path)
 
 
 
@@ -283,5 +319,4 @@ def load_audio_bytes_base64(audio_path):
             response.raise_for_status()
             return base64.b64encode(response.content).decode("utf-8")
     else:
-        with open(audio_path, 'rb') as audio_file:
-            return base64.b64encode(audio_file.read()).decode('utf-8')
\ No newline at end of file
+        return load_file_base64(audio_path)
\ No newline at end of file
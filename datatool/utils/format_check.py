@@ -1,8 +1,19 @@
 import re
-from datatool.utils.constant import EXTRACT_ANSWER_PROMPT, HTML_TAGS
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+from datatool.utils.constant import HTML_TAGS_ORDERED, render_extract_answer
 from deprecated import deprecated
 
 
+# LLM 抽取答案的结果缓存：批处理中同一份解答文本经常重复出现，命中时不再调用模型
+# 键为 (模型对象 id, 文本的 blake2b 摘要)，只保存 16 字节摘要而不是整段文本；超过容量按 LRU 淘汰
+EXTRACT_CACHE_SIZE = 65536
+_extract_cache = OrderedDict()
+_extract_cache_lock = threading.Lock()
+
+
 def is_contains_chinese(strs):
     for _char in strs:
         if '\u4e00' <= _char <= '\u9fa5':
@@ -97,7 +108,7 @@ def find_html_tags(text):
     """找到所有非表格相关的标准html标签，返回标签列表"""
     # 排除table相关
     exclude = {'table', 'tr', 'td', 'th'}
-    tags_pattern = '|'.join([tag for tag in HTML_TAGS if tag not in exclude])
+    tags_pattern = '|'.join([tag for tag in HTML_TAGS_ORDERED if tag not in exclude])
     # 匹配开头或闭合标签
     pattern = rf'</?({tags_pattern})\b[^>]*>'
     return re.findall(pattern, text, flags=re.IGNORECASE)
@@ -105,7 +116,7 @@ def find_html_tags(text):
 def remove_html_tags(text):
     """去除所有非表格相关的标准html标签，返回纯文本"""
     exclude = {'table', 'tr', 'td', 'th'}
-    tags_pattern = '|'.join([tag for tag in HTML_TAGS if tag not in exclude])
+    tags_pattern = '|'.join([tag for tag in HTML_TAGS_ORDERED if tag not in exclude])
     pattern = rf'</?(?:{tags_pattern})\b[^>]*>'
     return re.sub(pattern, '', text, flags=re.IGNORECASE)
 
@@ -167,10 +178,35 @@ def extract_boxed_answer(text, api_extract_model=None):
             return boxed[0]
     # 否则用 LLM 抽取
     if api_extract_model is not None:
-        prompt = EXTRACT_ANSWER_PROMPT.format(answer=text)
-        result = api_extract_model.generate([{"role": "user", "content": prompt}])
-        for line in result.splitlines():
-            line = line.strip()
-            if line:
-                return line
-    return ""
\ No newline at end of file
+        return extract_answer_by_llm(text, api_extract_model)
+    return ""
+
+
+def extract_answer_by_llm(text, api_extract_model):
+    """用 LLM 从解答文本中抽取最终答案，同一模型、相同文本的结果直接复用缓存"""
+    key = (id(api_extract_model), hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest())
+    with _extract_cache_lock:
+        cached = _extract_cache.get(key)
+        # 缓存值中保留模型的弱引用：既能识别模型被回收后 id 被复用导致的误命中，又不阻止模型被回收
+        if cached is not None and cached[0]() is api_extract_model:
+            _extract_cache.move_to_end(key)
+            return cached[1]
+    
+    answer = ""
+    result = api_extract_model.generate([{"role": "user", "content": render_extract_answer(text)}])
+    for line in result.splitlines():
+        line = line.strip()
+        if line:
+            answer = line
+            break
+    
+    try:
+        model_ref = weakref.ref(api_extract_model)
+    except TypeError:
+        # 不支持弱引用的模型对象不缓存
+        return answer
+    with _extract_cache_lock:
+        _extract_cache[key] = (model_ref, answer)
+        if len(_extract_cache) > EXTRACT_CACHE_SIZE:
+            _extract_cache.popitem(last=False)
+    return answer
\ No newline at end of file
@@ -0,0 +1,88 @@
+import os
+import sqlite3
+import threading
+
+from datatool.logger import log
+
+
+class HashCache:
+    """基于 sqlite（WAL 模式）的文件哈希缓存，重复处理同一批数据时跳过未变化文件的哈希计算
+
+    - 以 (st_dev, st_ino, algo) 为键，文件大小或 mtime 变化时视为失效
+    - algo 由调用方指定，需同时区分哈希算法与摘要格式，不同脚本可共用同一个缓存文件
+    - 每个进程/线程使用独立连接；写入先进入进程内缓冲区，每 FLUSH_EVERY 条批量提交一次
+    - fork 得到的子进程不写出父进程的缓冲区；多进程使用时需在工作进程退出前调用 flush（如作为 worker_finalizer）
+    """
+    FLUSH_EVERY = 1000
+
+    def __init__(self, db_path, algo):
+        self.db_path = str(db_path)
+        self.algo = algo
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pending = []
+        self._pending_pid = os.getpid()
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        conn = self._connect()
+        pk_columns = {row[1] for row in conn.execute("PRAGMA table_info(hash_cache)") if row[5]}
+        if pk_columns and "algo" not in pk_columns:
+            # 旧版缓存仅以 (dev, ino) 为键，不同算法会互相覆盖，直接重建
+            conn.execute("DROP TABLE hash_cache")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS hash_cache ("
+            "dev INTEGER, ino INTEGER, size INTEGER, mtime INTEGER, algo TEXT, digest BLOB, "
+            "PRIMARY KEY (dev, ino, algo))"
+        )
+        conn.commit()
+
+    def _connect(self):
+        """获取当前进程、当前线程的连接（fork 后不能复用父进程的连接）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=60)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, dev, ino, size, mtime_ns):
+        """查询缓存，命中返回写入时的摘要，否则返回 None"""
+        row = self._connect().execute(
+            "SELECT size, mtime, digest FROM hash_cache WHERE dev = ? AND ino = ? AND algo = ?",
+            (dev, ino, self.algo)
+        ).fetchone()
+        if row is None or row[0] != size or row[1] != mtime_ns:
+            return None
+        return row[2]
+
+    def put(self, dev, ino, size, mtime_ns, digest):
+        """缓存一条摘要（str 或 bytes），缓冲区满 FLUSH_EVERY 条时批量写入"""
+        row = (dev, ino, size, mtime_ns, self.algo, digest)
+        with self._lock:
+            if self._pending_pid != os.getpid():
+                # fork 继承的父进程缓冲区由父进程负责写入
+                self._pending = []
+                self._pending_pid = os.getpid()
+            self._pending.append(row)
+            if len(self._pending) < self.FLUSH_EVERY:
+                return
+            rows, self._pending = self._pending, []
+        self._write(rows)
+
+    def flush(self):
+        """写入缓冲区中剩余的条目"""
+        with self._lock:
+            if self._pending_pid != os.getpid():
+                return
+            rows, self._pending = self._pending, []
+        if rows:
+            self._write(rows)
+
+    def _write(self, rows):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO hash_cache VALUES (?, ?, ?, ?, ?, ?)", rows)
+        except sqlite3.Error as e:
+            log(f"⚠️ 写入哈希缓存失败 {self.db_path}: {e}")
@@ -1,4 +1,5 @@
 import os
+import sys
 import functools
 import multiprocessing
 import threading
@@ -106,42 +107,81 @@ def pre_allocated_multiprocess(func):
             
     return wrapper
 
+class _WorkerExit:
+    """流式模式下工作进程退出前放入结果队列的结束标记；failed 表示该进程因处理某条数据出错而提前退出"""
+    def __init__(self, failed=False):
+        self.failed = failed
+
+
 def post_allocated_multiprocess(func):
+    """多进程装饰器（动态分配数据，抢占制）
+
+    all_data 可以是列表，也可以是迭代器/生成器（流式模式）：流式模式下由主进程内的线程边产生边分发数据，
+    数据队列有上限（背压），工作进程无需等待全部数据产生完毕即可开始处理。
+    worker_finalizer: 可选，每个工作进程处理完所有数据后在该进程内调用一次（如写出进程内缓冲的数据）；
+        其抛出异常时该进程以非零状态退出，主进程在所有进程结束后抛出 RuntimeError
+    """
     @functools.wraps(func)
-    def wrapper(all_data, num_workers=1, **kwargs):
+    def wrapper(all_data, num_workers=1, worker_finalizer=None, **kwargs):
         log(f"Using {num_workers} processes...")
+        streaming = not hasattr(all_data, "__len__")
         
         # 使用原生的 multiprocessing.Queue 而不是 manager.Queue
-        data_queue = multiprocessing.Queue()
+        data_queue = multiprocessing.Queue(maxsize=num_workers * 64 if streaming else 0)
         result_queue = multiprocessing.Queue()
         
+        # 流式模式下填充线程的状态：已放入的数据条数、数据源抛出的异常
+        filler_state = {"produced": 0, "error": None}
+
         # 使用单独的进程来填充队列，避免阻塞主进程
         def queue_filler(data_list, queue):
-            for data in data_list:
-                queue.put(data)
-            # 放入结束标记
-            for _ in range(num_workers):
-                queue.put(None)
+            try:
+                for data in data_list:
+                    queue.put(data)
+                    filler_state["produced"] += 1
+            except Exception as e:
+                log(f"Data producer Error: {e}", level=log.ERROR)
+                filler_state["error"] = e
+            finally:
+                # 放入结束标记（数据源出错时也要放入，否则工作进程会一直阻塞在 get 上）
+                for _ in range(num_workers):
+                    queue.put(None)
         
-        # 启动填充进程
-        filler_process = multiprocessing.Process(
-            target=queue_filler, 
-            args=(all_data, data_queue)
-        )
-        filler_process.start()
+        # 启动填充进程（流式模式下数据源可能依赖主进程内的状态，改为在工作进程启动后用线程填充）
+        if not streaming:
+            filler = multiprocessing.Process(
+                target=queue_filler, 
+                args=(all_data, data_queue)
+            )
+            filler.start()
         
         # 工作进程函数
         def worker(queue, result_queue, **kwargs):
+            failed = False
             while True:
                 try:
-                    data = queue.get(timeout=1)
+                    # 流式模式下数据产生速度不定，阻塞等待直到收到结束标记
+                    data = queue.get() if streaming else queue.get(timeout=1)
                     if data is None:  # 结束标记
                         break
                     result = func(data, **kwargs)
                     result_queue.put(result)
                 except Exception as e:
                     log(f"Process {kwargs.get('process_id')} Error: {e}")
+                    failed = True
                     break
+            finalizer_failed = False
+            if worker_finalizer is not None:
+                try:
+                    worker_finalizer()
+                except Exception as e:
+                    log(f"Process {kwargs.get('process_id')} finalizer Error: {e}", level=log.ERROR)
+                    finalizer_failed = True
+            if streaming:
+                result_queue.put(_WorkerExit(failed))
+            if finalizer_failed:
+                # 通过退出码通知主进程：finalizer 未能写出的数据已经丢失
+                sys.exit(1)
             # log(f"Process {kwargs.get('process_id')} finished!!!")
         
         # 立即启动所有工作进程
@@ -154,18 +194,52 @@ def post_allocated_multiprocess(func):
             p.start()
             processes.append(p)
         
+        if streaming:
+            filler = threading.Thread(target=queue_filler, args=(all_data, data_queue), daemon=True)
+            filler.start()
+        
         # 收集结果
         all_results = []
-        with tqdm(total=len(all_data), desc="Processing data") as pbar:
-            for _ in range(len(all_data)):
-                result = result_queue.get()
-                all_results.append(result)
-                pbar.update(1)
+        if streaming:
+            # 总数未知，收到所有工作进程的结束标记即完成
+            finished = failed_workers = 0
+            with tqdm(desc="Processing data") as pbar:
+                while finished < num_workers:
+                    result = result_queue.get()
+                    if isinstance(result, _WorkerExit):
+                        finished += 1
+                        failed_workers += result.failed
+                        continue
+                    all_results.append(result)
+                    pbar.update(1)
+        else:
+            with tqdm(total=len(all_data), desc="Processing data") as pbar:
+                for _ in range(len(all_data)):
+                    result = result_queue.get()
+                    all_results.append(result)
+                    pbar.update(1)
         
-        # 等待所有进程完成
-        filler_process.join()
+        # 等待所有进程完成（填充线程在工作进程异常退出时可能阻塞在满队列上，不无限等待）
+        filler.join(timeout=5 if streaming else None)
         for p in processes:
             p.join()
+
+        if streaming:
+            if filler_state["error"] is not None:
+                raise filler_state["error"]
+            # 每个出错退出的进程消耗了一条数据但没有结果；其余差额是所有进程退出后没人处理的数据
+            unprocessed = filler_state["produced"] - len(all_results) - failed_workers
+            if filler.is_alive() or unprocessed > 0:
+                msg = (f"{failed_workers}/{num_workers} worker processes exited with errors, "
+                       f"{'remaining' if filler.is_alive() else unprocessed} tasks were not processed")
+                log(msg, level=log.ERROR)
+                raise RuntimeError(msg)
+        
+        exited_abnormally = [p.exitcode for p in processes if p.exitcode != 0]
+        if exited_abnormally:
+            msg = f"{len(exited_abnormally)}/{num_workers} worker processes exited abnormally (exit codes: {exited_abnormally})"
+            log(msg, level=log.ERROR)
+            raise RuntimeError(msg)
         
         return all_results
     
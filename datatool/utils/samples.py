@@ -3,8 +3,79 @@ import re
 import json
 import random
 
-from glob import glob
 from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor
+
+# 按块读取统计换行符时的块大小
+LINE_COUNT_CHUNK_SIZE = 16 * 1024 * 1024
+
+def count_lines(file_path):
+    """统计文件行数（最后一行没有换行符时也计入）
+    按大块读取并用 bytes.count 统计换行符，避免逐行构造 Python 字符串
+    Args:
+        file_path: 文件路径
+
+    Returns:
+        int: 行数
+    """
+    line_nums = 0
+    last_byte = b'\n'
+    with open(file_path, 'rb', buffering=0) as f:
+        while True:
+            chunk = f.read(LINE_COUNT_CHUNK_SIZE)
+            if not chunk:
+                break
+            line_nums += chunk.count(b'\n')
+            last_byte = chunk[-1:]
+    if last_byte != b'\n':
+        line_nums += 1
+    return line_nums
+
+def iter_jsonl_files(root_dir):
+    """递归遍历 root_dir 下的所有 jsonl 文件，等价于 glob("**/*.jsonl", recursive=True)
+    直接基于 os.walk 产出路径字符串，不构造 Path 对象也不排序；与 glob 一致跳过隐藏文件和目录
+    Args:
+        root_dir: 根目录路径
+
+    Yields:
+        str: jsonl 文件路径
+    """
+    for dirpath, dirnames, filenames in os.walk(root_dir, followlinks=True):
+        dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+        for filename in filenames:
+            if filename.endswith('.jsonl') and not filename.startswith('.'):
+                yield os.path.join(dirpath, filename)
+
+def list_files_by_suffix(directory, suffixes):
+    """列出 directory 下（不递归）指定后缀的文件，等价于 Path(directory).glob("*.jsonl") 等
+    基于 os.scandir 只做字符串后缀判断，不为不匹配的条目构造 Path 对象；与 Path.glob 一致包含隐藏文件，
+    返回顺序为 scandir 顺序，需要确定顺序时由调用方排序
+    Args:
+        directory: 目录路径
+        suffixes: 后缀字符串或后缀元组，如 ".jsonl" 或 (".yaml", ".yml")
+
+    Returns:
+        list: 文件路径字符串
+    """
+    with os.scandir(directory) as it:
+        return [entry.path for entry in it
+                if entry.name.endswith(suffixes) and entry.is_file()]
+
+def find_metafile_dirs(data_dir, metafile_name):
+    """递归查找 data_dir 下名为 metafile_name 的目录，找到后不再进入其内部
+    Args:
+        data_dir: 数据根目录路径
+        metafile_name: meta 目录名
+
+    Returns:
+        list: 排序后的 meta 目录路径
+    """
+    metafile_dirs = []
+    for dirpath, dirnames, _ in os.walk(data_dir, followlinks=True):
+        if metafile_name in dirnames:
+            metafile_dirs.append(os.path.join(dirpath, metafile_name))
+        dirnames[:] = [d for d in dirnames if d != metafile_name and not d.startswith('.')]
+    return sorted(metafile_dirs)
 
 def stat_sample_nums(meta_dir):
     """递归统计 meta_dir 目录下所有 jsonl 文件中的样本数量
@@ -14,12 +85,12 @@ def stat_sample_nums(meta_dir):
     Returns:
         int: 总的样本数量
     """
-    meta_files = glob(os.path.join(meta_dir, "**", "*.jsonl"), recursive=True)
-    sample_nums = 0
-    for file in meta_files:
-        with open(file, 'r', encoding='utf-8') as f:
-            sample_nums += sum(1 for _ in f)
-    return sample_nums
+    meta_files = list(iter_jsonl_files(meta_dir))
+    if not meta_files:
+        return 0
+    # 计数在 C 层完成并释放 GIL，多线程可以并行读取多个文件
+    with ThreadPoolExecutor(max_workers=min(32, len(meta_files))) as executor:
+        return sum(executor.map(count_lines, meta_files))
 
 def reservoir_sampling_from_jsonls(file_paths, sample_size=20000):
     """